@@ -0,0 +1,175 @@
+"""
+This module contains an access log which records requests on the event loop without
+formatting them and writes them in batches from a background thread
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+#
+# The number of entries which we format and write at once
+#
+_CHUNK = 256
+
+
+class AccessLog: # pylint: disable=too-many-instance-attributes
+    """
+    A log of the requests processed by a container.
+
+    For every request, the protocol records the time, the address of the client, method, URL,
+    status code, the number of bytes sent and the duration, i.e. the time from the moment the
+    header has been received until the response is ready to be written. The entries are stored in
+    a ring buffer of capacity entries which is allocated once. Recording an entry only stores
+    references and numbers in this buffer, while formatting and writing the entries is left to a
+    background thread which wakes up every flush_interval seconds and writes all entries recorded
+    since the last flush, in batches of a few hundred entries between which it lets the event loop
+    take over the interpreter lock. If more than capacity entries are recorded between two
+    flushes, the oldest entries are lost, and their number is added to dropped.
+
+    Every entry is written as one line with the fields separated by spaces, like
+
+    2026-10-16T12:00:00.000123Z 127.0.0.1:51234 GET /index.html 200 1043 0.000187
+
+    If output (a text file) is given, the lines of a batch are written to this file in a
+    single write. Otherwise, every line is passed to the logger aioweb.accesslog at level INFO.
+    """
+
+    __slots__ = ['_capacity', '_flush_interval', '_output', '_entries', '_clock_offset',
+                 '_head', '_tail', '_lock', '_stopped', '_thread', 'dropped']
+
+    def __init__(self, capacity: int = 8192, flush_interval: float = 1.0,
+                 output: Optional[TextIO] = None) -> None:
+        self._capacity = capacity
+        self._flush_interval = flush_interval
+        self._output = output
+        #
+        # The ring buffer. Every slot holds a tuple, as building one tuple is cheaper
+        # than storing the fields one by one
+        #
+        self._entries = [None] * capacity # type: List[Any]
+        #
+        # The protocol passes the time at which a request started as measured by
+        # perf_counter, which we turn into the time of day only when formatting
+        #
+        self._clock_offset = time.time() - time.perf_counter()
+        #
+        # The number of entries recorded and flushed so far. Only the event loop
+        # advances the head and only a flush advances the tail
+        #
+        self._head = 0
+        self._tail = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None # type: Optional[threading.Thread]
+        self.dropped = 0
+
+    def record(self, method: str, url: bytes, header: bytes, # pylint: disable=too-many-arguments
+               sent: int, started: float, duration: float, peer: Any):
+        """
+        Record a request, given the encoded header of its response, from which the status
+        code is taken, the number of bytes sent and the value of time.perf_counter when the
+        request started
+        """
+
+        #
+        # Every header starts with HTTP/1.x followed by the three digits of the
+        # status code, which we convert without slicing the header
+        #
+        self._entries[self._head % self._capacity] = (
+            started, peer, method, url,
+            (header[9] - 48) * 100 + (header[10] - 48) * 10 + header[11] - 48,
+            sent, duration)
+        self._head += 1
+
+    def flush(self):
+        """
+        Write all entries which have been recorded since the last flush
+        """
+
+        with self._lock:
+            head = self._head
+            position = max(self._tail, head - self._capacity)
+            self.dropped += position - self._tail
+            while position < head:
+                end = min(head, position + _CHUNK)
+                lines = self._format(position, end)
+                #
+                # While we have been formatting, the event loop has continued to record
+                # entries and might have overwritten some of those we have formatted,
+                # including the one which it might be writing right now. We drop them
+                #
+                overwritten = min(max(0, self._head + 1 - self._capacity - position), len(lines))
+                self.dropped += overwritten
+                self._write(lines[overwritten:])
+                position = end
+                #
+                # Give the event loop a chance to take over the interpreter lock
+                # before we continue with the next chunk
+                #
+                time.sleep(0)
+            self._tail = head
+
+    def _write(self, lines: List[str]):
+        if not lines:
+            return
+        if self._output is None:
+            for line in lines:
+                logger.info(line)
+            return
+        self._output.write("".join([line + "\n" for line in lines]))
+        self._output.flush()
+
+    def _format(self, start: int, head: int) -> List[str]: # pylint: disable=too-many-locals
+        #
+        # Format the entries from start up to head. As this competes with the event loop
+        # for the interpreter lock, we format the date only once per second and every
+        # address only once per batch
+        #
+        lines = []
+        peers = {} # type: Dict[Any, str]
+        second = -1
+        date = ""
+        for position in range(start, head):
+            started, peer, method, url, status, sent, duration = \
+                self._entries[position % self._capacity]
+            moment = started + self._clock_offset
+            if int(moment) != second:
+                second = int(moment)
+                date = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+            address = peers.get(peer)
+            if address is None:
+                address = peers[peer] = "%s:%d" % peer[:2] if isinstance(peer, tuple) \
+                    else str(peer or "-")
+            lines.append("%s.%06dZ %s %s %s %d %d %.6f" % (
+                date, (moment - second) * 1000000, address, method,
+                url.decode("utf-8", "replace"), status, sent, duration))
+        return lines
+
+    def start(self):
+        """
+        Start the thread which flushes the log periodically
+        """
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="aioweb-access-log", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the thread, which flushes the log a last time before it exits
+        """
+
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self._flush_interval):
+            self.flush()
+        self.flush()
@@ -0,0 +1,116 @@
+"""
+This module contains the admission control which limits the number of connections and
+of concurrent handler invocations, so that a server under overload stays responsive
+"""
+
+import collections
+from typing import Deque, Optional
+
+import aioweb.response
+
+
+class AdmissionControl:
+    """
+    Limits for the connections and handler invocations of a container.
+
+    At most max_connections connections are served at the same time. Further connections are
+    accepted, but parked, i.e. we do not read from them until one of the served connections is
+    closed, at which point the connection which has been parked for the longest time is admitted.
+    As the idle timeout of the container still applies, a connection which stays parked for longer
+    than the timeout is closed.
+
+    At most max_in_flight handler invocations are running at the same time. If a request arrives
+    while this limit is reached, the handler is not invoked, and the request is answered with
+    status code 503 and a Retry-After header asking the client to come back after retry_after
+    seconds. The number of requests rejected in this way is counted in rejected.
+
+    A value of None means that there is no limit.
+    """
+
+    __slots__ = ['_max_connections', '_max_in_flight', '_connections', '_in_flight',
+                 '_parked', 'response', 'rejected']
+
+    def __init__(self, max_connections: Optional[int] = None,
+                 max_in_flight: Optional[int] = None, retry_after: int = 1) -> None:
+        self._max_connections = max_connections
+        self._max_in_flight = max_in_flight
+        self._connections = 0
+        self._in_flight = 0
+        self._parked = collections.deque() # type: Deque
+        #
+        # The response to rejected requests, whose headers are encoded only once
+        #
+        self.response = aioweb.response.Response(b"Service Unavailable", status_code=503,
+                                                 headers={"Retry-After": str(retry_after)})
+        self.rejected = 0
+
+    @property
+    def connections(self) -> int:
+        """
+        The number of connections which are currently served
+        """
+
+        return self._connections
+
+    @property
+    def parked(self) -> int:
+        """
+        The number of connections which wait to be admitted
+        """
+
+        return len(self._parked)
+
+    @property
+    def in_flight(self) -> int:
+        """
+        The number of running handler invocations
+        """
+
+        return self._in_flight
+
+    def connection_made(self, protocol) -> bool:
+        """
+        Register a new connection. Return True if it can be served right away, otherwise
+        the connection is parked and its method admit is called once it can be served
+        """
+
+        if self._max_connections is None or self._connections < self._max_connections:
+            self._connections += 1
+            return True
+        self._parked.append(protocol)
+        return False
+
+    def connection_lost(self, protocol):
+        """
+        Unregister a connection and admit a parked connection if there is one
+        """
+
+        try:
+            self._parked.remove(protocol)
+            return
+        except ValueError:
+            pass
+        self._connections -= 1
+        while self._parked and (self._max_connections is None
+                                or self._connections < self._max_connections):
+            self._connections += 1
+            self._parked.popleft().admit()
+
+    def acquire(self) -> bool:
+        """
+        Reserve a slot for a handler invocation. Return False if the limit is reached,
+        in which case the handler must not be invoked
+        """
+
+        if self._max_in_flight is not None and self._in_flight >= self._max_in_flight:
+            self.rejected += 1
+            return False
+        self._in_flight += 1
+        return True
+
+    def release(self):
+        """
+        Release the slot of a handler invocation which has completed
+        """
+
+        self._in_flight -= 1
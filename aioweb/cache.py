@@ -0,0 +1,292 @@
+"""
+This module contains a cache for complete responses which the protocol consults before
+invoking the handler of the container
+"""
+
+import asyncio
+import collections
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+import aioweb.response
+
+#
+# The status codes of responses which we cache
+#
+_CACHEABLE_STATUS = (200, 203, 301, 404, 410)
+
+#
+# Directives of a Cache-Control header which prevent caching
+#
+_NO_CACHE = ("no-store", "no-cache", "private")
+
+#
+# An estimate of the memory used per entry in addition to the encoded response
+#
+_ENTRY_OVERHEAD = 256
+
+#
+# Passed to requests waiting for a response if the request which
+# produces the response is cancelled
+#
+_RETRY = object()
+
+
+class CachedResponse: # pylint: disable=too-few-public-methods
+    """
+    A response stored in the cache.
+
+    Apart from the status line, which depends on the HTTP version of the request, the Date and
+    Server headers, which change every second, and the Connection header, which depends on the
+    request, the response is stored in encoded form, i.e. header_lines contains the encoded header
+    lines and content_length the line with the length of the body and the empty line terminating
+    the header
+    """
+
+    __slots__ = ['status_code', 'header_lines', 'content_length', 'body', 'expires', 'size']
+
+    def __init__(self, status_code: int, header_lines: bytes, body: bytes,
+                 expires: float) -> None:
+        self.status_code = status_code
+        self.header_lines = header_lines
+        self.content_length = b'Content-Length: %d\r\n\r\n' % len(body)
+        self.body = body
+        self.expires = expires
+        self.size = len(header_lines) + len(self.content_length) + len(body) + _ENTRY_OVERHEAD
+
+
+def _header(headers: Optional[Dict[str, str]], name: str) -> Optional[str]:
+    #
+    # Look up a header of a response, ignoring the case of its name
+    #
+    if not headers:
+        return None
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _ttl(headers: Optional[Dict[str, str]], default_ttl: float, shared: bool = True) -> float:
+    #
+    # Determine for how many seconds a response may be cached, based on its
+    # Cache-Control header. A result of zero means that we must not cache it.
+    # If shared is false, the response belongs to a request with credentials,
+    # and we only cache it if the header explicitly allows this
+    #
+    if _header(headers, "Set-Cookie") is not None:
+        return 0
+    value = _header(headers, "Cache-Control")
+    if value is None:
+        return default_ttl if shared else 0
+    ttl = default_ttl
+    for directive in value.lower().split(","):
+        name, _, argument = directive.strip().partition("=")
+        if name in _NO_CACHE:
+            return 0
+        if name == "public":
+            shared = True
+        if name in ("max-age", "s-maxage"):
+            try:
+                ttl = int(argument.strip('"'))
+            except ValueError:
+                return 0
+            if name == "s-maxage":
+                shared = True
+                break
+    if not shared:
+        return 0
+    return max(ttl, 0)
+
+
+Producer = Callable[[Any], Awaitable[Tuple[int, Any]]]
+
+class ResponseCache: # pylint: disable=too-many-instance-attributes
+    """
+    A cache for complete responses to GET requests.
+
+    Responses are looked up by method, URL and the values of the request headers listed in vary.
+    The cache holds at most max_bytes bytes of encoded responses and evicts the least recently used
+    entries if it is full. Responses larger than max_entry_bytes are not cached at all.
+
+    Only responses with a body given as a sequence of bytes and one of the status codes in
+    _CACHEABLE_STATUS are cached. A response is kept for default_ttl seconds, unless the handler
+    returns an aioweb.response.Response with a Cache-Control header, in which case max-age and
+    s-maxage determine the lifetime, and no-store, no-cache and private prevent caching. Responses
+    which set a cookie are never cached.
+
+    As the cache is shared by all clients, requests with an Authorization header, or with a
+    Cookie header unless Cookie is listed in vary, are never answered from the cache. Their
+    responses are only cached if the Cache-Control header contains public or s-maxage.
+
+    If several requests for the same key miss the cache at the same time, only the first of them
+    invokes the handler, and the others wait for its result. Thus an entry which expires while
+    it is in high demand results in a single invocation of the handler. If the result turns out
+    not to be cacheable, the waiting requests invoke the handler themselves.
+    """
+
+    __slots__ = ['_max_bytes', '_max_entry_bytes', '_default_ttl', '_vary', '_entries',
+                 '_pending', '_size', 'hits', 'misses']
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, default_ttl: float = 5.0,
+                 vary: Iterable[str] = (), max_entry_bytes: Optional[int] = None) -> None:
+        self._max_bytes = max_bytes
+        self._max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 8
+        self._default_ttl = default_ttl
+        self._vary = tuple(vary)
+        self._entries = collections.OrderedDict() # type: collections.OrderedDict
+        self._pending = {} # type: Dict[Any, asyncio.Future]
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """
+        The estimated number of bytes used by the cached responses
+        """
+
+        return self._size
+
+    def vary_on(self, name: str):
+        """
+        Add a request header to the headers whose values are part of the key
+        """
+
+        if name.lower() not in [header.lower() for header in self._vary]:
+            self._vary = self._vary + (name,)
+
+    def clear(self):
+        """
+        Remove all entries from the cache
+        """
+
+        self._entries.clear()
+        self._size = 0
+
+    async def fetch(self, request, produce: Producer) -> Tuple[Optional[CachedResponse], Any]:
+        """
+        Return the response to a request, either from the cache or by calling the coroutine
+        function produce, which is expected to return a pair of status code and result of the
+        handler. Return a pair of the cached response, or None if the response is not cached,
+        and the pair returned by produce, or None if we have found the response in the cache
+        """
+
+        key = self._key(request)
+        if key is None or self._has_credentials(request):
+            return await self._fetch_uncached(key, request, produce)
+        entry = self._lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return entry, None
+        self.misses += 1
+        pending = self._pending.get(key) # type: Optional[asyncio.Future]
+        while pending is not None:
+            #
+            # Someone else is already producing this response, wait for it. The
+            # future must not be cancelled if we are, as others might wait for it
+            #
+            entry = await asyncio.shield(pending)
+            if entry is None:
+                return None, await produce(request)
+            if entry is not _RETRY:
+                return entry, None
+            #
+            # The request producing the response has been cancelled, so
+            # try again, taking over its role if nobody else has done so
+            #
+            pending = self._pending.get(key)
+        future = asyncio.get_event_loop().create_future()
+        self._pending[key] = future
+        stored = _RETRY # type: Any
+        try:
+            response = await produce(request)
+            stored = self._store(key, response)
+        finally:
+            del self._pending[key]
+            future.set_result(stored)
+        if stored is not None:
+            return stored, None
+        return None, response
+
+    async def _fetch_uncached(self, key, request,
+                              produce: Producer) -> Tuple[Optional[CachedResponse], Any]:
+        #
+        # Produce the response to a request which we do not answer from the cache.
+        # If the request has a key, it carries credentials, and we store the
+        # response only if it may be shared
+        #
+        response = await produce(request)
+        stored = None
+        if key is not None:
+            stored = self._store(key, response, shared=False)
+        if stored is not None:
+            return stored, None
+        return None, response
+
+    def _key(self, request) -> Any:
+        if request.method() != "GET":
+            return None
+        if not self._vary:
+            return request.url()
+        headers = request.headers()
+        return (request.url(),) + tuple(headers.get(name) for name in self._vary)
+
+    def _has_credentials(self, request) -> bool:
+        #
+        # Return true if the response to the request might be specific to
+        # the user sending it, so that it must not be shared with others
+        #
+        headers = request.headers()
+        if headers.get("Authorization") is not None:
+            return True
+        if headers.get("Cookie") is None:
+            return False
+        return "cookie" not in [name.lower() for name in self._vary]
+
+    def _lookup(self, key) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, response: Tuple[int, Any],
+               shared: bool = True) -> Optional[CachedResponse]:
+        status_code, result = response
+        header_lines = aioweb.response.CONTENT_TYPE_TEXT
+        headers = None
+        if isinstance(result, aioweb.response.Response):
+            status_code = result.status_code
+            header_lines = result.encoded_headers()
+            headers = result.headers
+            result = result.body
+        if status_code not in _CACHEABLE_STATUS:
+            return None
+        if not isinstance(result, (bytes, bytearray, memoryview)):
+            return None
+        ttl = _ttl(headers, self._default_ttl, shared)
+        if ttl <= 0:
+            return None
+        entry = CachedResponse(status_code, header_lines, bytes(result),
+                               time.monotonic() + ttl)
+        if entry.size > self._max_entry_bytes:
+            return None
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._size += entry.size
+        while self._size > self._max_bytes:
+            self._remove(next(iter(self._entries)))
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= entry.size
@@ -0,0 +1,195 @@
+"""
+This module contains the compression of response bodies, negotiated using the
+Accept-Encoding header of a request
+"""
+
+import asyncio
+import zlib
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
+
+import aioweb.response
+
+#
+# The window sizes which select the format of the compressed data,
+# see the documentation of zlib.compressobj
+#
+_WBITS = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+}
+
+#
+# Content types which we compress by default, in addition to all text types
+#
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/javascript", "application/xml",
+    "application/xhtml+xml", "image/svg+xml",
+)
+
+#
+# Responses with these status codes are never compressed
+#
+_SKIP_STATUS = (204, 206, 304)
+
+#
+# The maximum number of distinct values of the Accept-Encoding header for which we cache the
+# result of the negotiation
+#
+_MAX_NEGOTIATIONS = 256
+
+
+def _compress(data, wbits: int, level: int) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    return compressor.compress(data) + compressor.flush()
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """
+    Return the encoding which we use for a request with the given Accept-Encoding header,
+    i.e. gzip or deflate, or None if the client does not accept either of them. If both are
+    accepted, the one with the higher quality value wins, preferring gzip if they are equal
+    """
+
+    qualities = {} # type: Dict[str, float]
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    #
+    # An asterisk matches all codings which are not listed explicitly
+    #
+    default = qualities.get("*", 0.0)
+    best = None
+    best_quality = 0.0
+    for coding in _WBITS:
+        quality = qualities.get(coding, default)
+        if quality > best_quality:
+            best = coding
+            best_quality = quality
+    return best
+
+
+class Compression: # pylint: disable=too-few-public-methods
+    """
+    Compression of response bodies.
+
+    For every response, we determine an encoding from the Accept-Encoding header of the request
+    and compress the body if the content type is a text type or listed in content_types, the body
+    is at least min_size bytes long and the response does not already carry a Content-Encoding.
+    Responses with status 204, 206 or 304 and files are never compressed.
+
+    Bodies of at least thread_threshold bytes are compressed in a thread of the given executor
+    (the default executor of the loop if none is given), as zlib releases the GIL while it
+    compresses, so that the event loop is not stalled. Bodies which are produced as asynchronous
+    iterators are compressed incrementally. After every chunk, we flush the compressor so that
+    the client receives the data as soon as it has been produced.
+    """
+
+    __slots__ = ['_min_size', '_level', '_thread_threshold', '_executor', '_content_types',
+                 '_negotiations']
+
+    def __init__(self, min_size: int = 1024, level: int = 6, # pylint: disable=too-many-arguments
+                 thread_threshold: int = 65536, executor=None,
+                 content_types: Iterable[str] = COMPRESSIBLE_TYPES) -> None:
+        self._min_size = min_size
+        self._level = level
+        self._thread_threshold = thread_threshold
+        self._executor = executor
+        self._content_types = tuple(content_types)
+        self._negotiations = {} # type: Dict[bytes, Optional[str]]
+
+    async def compress(self, request, status_code: int, result: Any) -> Tuple[int, Any]:
+        """
+        Compress the result of a handler if possible. Return the status code and the
+        result, which is a new response object if we have compressed the body
+        """
+
+        if isinstance(result, aioweb.response.Response):
+            status_code = result.status_code
+            headers = result.headers
+            content_type = result.content_type
+            body = result.body
+        else:
+            headers = None
+            content_type = "text/plain; charset=utf-8"
+            body = result
+        if not self._applies(status_code, headers, content_type, body):
+            return status_code, result
+        #
+        # From here on, the response would be compressed if the client accepts it,
+        # so the response depends on the Accept-Encoding header of the request
+        #
+        headers = dict(headers) if headers else {}
+        vary = headers.get("Vary")
+        headers["Vary"] = "Accept-Encoding" if not vary else vary + ", Accept-Encoding"
+        encoding = self._negotiate(request)
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+            if hasattr(body, "__aiter__"):
+                body = self._compress_stream(body, _WBITS[encoding])
+            elif memoryview(body).nbytes >= self._thread_threshold:
+                loop = asyncio.get_event_loop()
+                body = await loop.run_in_executor(self._executor, _compress, body,
+                                                  _WBITS[encoding], self._level)
+            else:
+                body = _compress(body, _WBITS[encoding], self._level)
+        return status_code, aioweb.response.Response(body, status_code=status_code,
+                                                     headers=headers,
+                                                     content_type=content_type)
+
+    def _applies(self, status_code: int, headers: Optional[Dict[str, str]],
+                 content_type: str, body: Any) -> bool:
+        #
+        # Check whether a response is a candidate for compression
+        #
+        if status_code in _SKIP_STATUS:
+            return False
+        if headers and "Content-Encoding" in headers:
+            return False
+        if not self._compressible(content_type):
+            return False
+        if hasattr(body, "__aiter__"):
+            return True
+        return (isinstance(body, (bytes, bytearray, memoryview))
+                and memoryview(body).nbytes >= self._min_size)
+
+    def _compressible(self, content_type: str) -> bool:
+        mime_type = content_type.partition(";")[0].strip().lower()
+        return mime_type.startswith("text/") or mime_type in self._content_types
+
+    def _negotiate(self, request) -> Optional[str]:
+        #
+        # Clients send only a few distinct values, so we remember
+        # the result for every value we have seen
+        #
+        value = request.headers().get("Accept-Encoding")
+        if value is None:
+            return None
+        try:
+            return self._negotiations[value]
+        except KeyError:
+            pass
+        encoding = negotiate(value.decode("latin-1"))
+        if len(self._negotiations) >= _MAX_NEGOTIATIONS:
+            self._negotiations.clear()
+        self._negotiations[value] = encoding
+        return encoding
+
+    async def _compress_stream(self, stream: AsyncIterator, wbits: int) -> AsyncIterator[bytes]:
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, wbits)
+        loop = asyncio.get_event_loop()
+        async for chunk in stream:
+            if not isinstance(chunk, (bytes, bytearray)) or not chunk:
+                continue
+            if len(chunk) >= self._thread_threshold:
+                data = await loop.run_in_executor(self._executor, compressor.compress, chunk)
+            else:
+                data = compressor.compress(chunk)
+            yield data + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
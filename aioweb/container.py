@@ -5,10 +5,36 @@ and invokes a user specific handler.
 
 import abc
 import asyncio
-from typing import Callable, Awaitable
+import inspect
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+from typing import Callable, Awaitable, List, Optional
 
 
+import aioweb.accesslog
+import aioweb.admission
+import aioweb.cache
+import aioweb.compression
+import aioweb.handlers
+import aioweb.metrics
 import aioweb.request
+import aioweb.protocol
+import aioweb.restart
+import aioweb.exceptions
+import aioweb.timer
+import aioweb.response
+import aioweb.router
+import aioweb.static
+
+logger = logging.getLogger(__name__)
+
+#
+# The backlog of the sockets which we bind and listen on ourselves
+#
+_BACKLOG = 100
 
 class WebContainer:
     """
@@ -25,7 +51,9 @@ class WebContainer:
     a reference to the container in which the handler executes. A handler can now do one of the
     following things. Either it returns a sequence of bytes, which will then be sent back as
     response with status code 200, or it creates an exception using the method create_exception
-    of the container and raises it, which will return an error 500.
+    of the container and raises it, which will return an error 500. A handler can also return an
+    asynchronous iterator yielding sequences of bytes, which will then be streamed to the client
+    using chunked transfer encoding as they are produced.
     """
 
     @abc.abstractmethod
@@ -55,35 +83,468 @@ class WebContainer:
 
 Handler = Callable[[aioweb.request.Request, WebContainer], Awaitable[bytes]]
 
-class HttpToolsWebContainer(WebContainer):
+class HttpToolsWebContainer(WebContainer): # pylint: disable=too-many-instance-attributes
 
     """
     An implementation of the abstract web container class
+
+    The parameter body_window is the number of bytes of a request body which we buffer for a
+    handler consuming the body as a stream before we stop reading from the connection. The
+    parameters write_buffer_high and write_buffer_low are the watermarks for the write buffer
+    of each connection. If the write buffer exceeds the high watermark, a handler streaming a
+    response is suspended until the buffer has drained below the low watermark. If they are not
+    specified, the defaults of the transport are used. Connections which are idle for more than
+    timeout_seconds are closed. To avoid the overhead of a timer per connection, all connections
+    share a timer wheel with a resolution of one second. If pipeline_concurrency is larger than one,
+    up to this number of pipelined requests on one connection are handled concurrently, while the
+    responses are still sent in the order of the requests. If a cache (an instance of
+    aioweb.cache.ResponseCache) is given, responses to GET requests are served from this cache
+    where possible, without invoking the handler. If compression (an instance of
+    aioweb.compression.Compression) is given, response bodies are compressed if the client
+    accepts it. As the cache then holds compressed responses, the Accept-Encoding header of the
+    request is added to the headers by which the cache distinguishes responses.
+
+    Handlers which are plain functions instead of coroutines, and handlers marked with
+    aioweb.handlers.run_in_thread, are run in a pool of thread_pool_size threads (by default,
+    the default size of a ThreadPoolExecutor), after the body of the request has been received.
+    If thread_queue_limit invocations are already waiting for a thread, further requests for
+    such handlers are answered with status code 503. If such a handler returns an awaitable, for
+    instance a lambda which calls a coroutine function, the result is awaited on the event loop.
+
+    Handlers marked with aioweb.handlers.cpu_bound are run in a pool of process_pool_size worker
+    processes, which is started together with the container. Such a handler receives a snapshot
+    of the request, which includes the complete body, and None instead of the container. With
+    several worker processes, every worker starts a pool of its own, so process_pool_size is the
+    size of the pool per worker. By default, the CPUs are divided among the workers, so that
+    there is one process per CPU in total, but at least one per worker.
+
+    If metrics (an instance of aioweb.metrics.Metrics) are given, all connections report to them.
+    If in addition metrics_path is given, the container answers GET requests for this path with
+    the metrics in the text format of Prometheus, without invoking the handler. With several
+    worker processes, every worker keeps metrics of its own.
+
+    If admission (an instance of aioweb.admission.AdmissionControl) is given, it limits the number
+    of connections served at the same time and the number of concurrent handler invocations. Excess
+    connections are parked until another connection is closed, and excess requests are answered
+    with status code 503. With several worker processes, the limits apply to every worker.
+
+    If access_log (an instance of aioweb.accesslog.AccessLog) is given, every request is recorded
+    in it, and the thread which writes the log runs while the container is serving. With several
+    worker processes, every worker runs a thread of its own which writes to the same output.
+
+    The parameters max_pipeline_depth, max_header_bytes and max_body_bytes limit the resources
+    a single connection can consume, see aioweb.protocol.HttpProtocol. By default, at most 64
+    requests are queued per connection, headers are limited to 64 KB and bodies are not limited.
+
+    When the container is stopped, it stops accepting connections right away and closes all idle
+    connections. Connections on which requests are in progress are closed once the responses to
+    these requests have been sent, the last of which carries a Connection: close header. If this
+    takes longer than grace_seconds, the remaining connections are closed without further ado.
+
+    If hot_restart is set, the container can be restarted without refusing a single connection,
+    either by sending SIGHUP to the process or by calling restart. The container then starts a
+    new process running restart_command (by default, the command line of the current process)
+    which inherits the listening socket, waits until the new process serves requests, but at most
+    restart_timeout seconds, and stops as described above. While the new process starts up, we
+    keep accepting connections on the shared socket. A container started in this way takes over
+    the inherited socket instead of binding its own and reports that it is ready once it serves
+    requests. With several worker processes, the supervisor is restarted, and the workers share
+    the listening socket of the supervisor instead of binding their own sockets, as only a socket
+    which exists once can be handed over.
+
+    If workers is larger than one, start will not serve requests itself, but act as a supervisor
+    which forks the given number of worker processes, each of which runs its own event loop and
+    serves requests on the same port. Where the platform supports it, every worker binds its own
+    socket using SO_REUSEPORT so that the kernel distributes incoming connections evenly, otherwise
+    the workers share a listening socket bound by the supervisor. Workers which die are restarted,
+    and stopping the supervisor will stop all workers.
     """
 
     __slots__ = ['_host', '_port', '_handler',
-                 '_stop', '_server']
+                 '_stop', '_server', '_body_window',
+                 '_write_buffer_high', '_write_buffer_low', '_workers',
+                 '_timeout_seconds', '_timer_wheel', '_header_cache',
+                 '_pipeline_concurrency', '_cache', '_compression', '_thread_pool',
+                 '_process_pool_size', '_process_pool', '_metrics',
+                 '_admission', '_max_pipeline_depth', '_max_header_bytes',
+                 '_max_body_bytes', '_grace_seconds', '_loop', '_stop_event',
+                 '_connections', '_hot_restart', '_restart_command',
+                 '_restart_timeout', '_restart_task', '_listen_socket', '_access_log']
 
-    def __init__(self, host: str, port: str, handler: Handler) -> None:
+    def __init__(self, host: str, port: str, handler: Handler, # pylint: disable=too-many-arguments,too-many-locals
+                 body_window: int = 65536,
+                 write_buffer_high: Optional[int] = None,
+                 write_buffer_low: Optional[int] = None,
+                 workers: int = 1,
+                 timeout_seconds: int = 5,
+                 pipeline_concurrency: int = 1,
+                 cache: Optional[aioweb.cache.ResponseCache] = None,
+                 compression: Optional[aioweb.compression.Compression] = None,
+                 thread_pool_size: Optional[int] = None,
+                 thread_queue_limit: int = 64,
+                 process_pool_size: Optional[int] = None,
+                 metrics: Optional[aioweb.metrics.Metrics] = None,
+                 metrics_path: Optional[str] = None,
+                 admission: Optional[aioweb.admission.AdmissionControl] = None,
+                 max_pipeline_depth: Optional[int] = 64,
+                 max_header_bytes: Optional[int] = 65536,
+                 max_body_bytes: Optional[int] = None,
+                 grace_seconds: float = 5.0,
+                 hot_restart: bool = False,
+                 restart_command: Optional[List[str]] = None,
+                 restart_timeout: float = 30.0,
+                 access_log: Optional[aioweb.accesslog.AccessLog] = None) -> None:
         self._host = host
         self._port = port
-        self._handler = handler
+        self._thread_pool = aioweb.handlers.ThreadPool(thread_pool_size, thread_queue_limit)
+        if process_pool_size is None:
+            process_pool_size = max(1, (os.cpu_count() or 1) // workers)
+        self._process_pool_size = process_pool_size
+        self._process_pool = None # type: Optional[aioweb.handlers.ProcessPool]
+        self._handler = self._wrap(handler)
         self._stop = False
         self._server = False
+        self._loop = None # type: Optional[asyncio.AbstractEventLoop]
+        self._stop_event = None # type: Optional[asyncio.Event]
+        self._grace_seconds = grace_seconds
+        self._connections = aioweb.protocol.ConnectionRegistry()
+        self._hot_restart = hot_restart
+        self._restart_command = restart_command
+        self._restart_timeout = restart_timeout
+        self._restart_task = None # type: Optional[asyncio.Task]
+        self._listen_socket = None # type: Optional[socket.socket]
+        self._body_window = body_window
+        self._write_buffer_high = write_buffer_high
+        self._write_buffer_low = write_buffer_low
+        self._workers = workers
+        self._timeout_seconds = timeout_seconds
+        self._max_pipeline_depth = max_pipeline_depth
+        self._max_header_bytes = max_header_bytes
+        self._max_body_bytes = max_body_bytes
+        self._timer_wheel = None # type: Optional[aioweb.timer.TimerWheel]
+        self._header_cache = aioweb.response.HeaderCache()
+        self._pipeline_concurrency = pipeline_concurrency
+        self._cache = cache
+        self._compression = compression
+        if cache is not None and compression is not None:
+            cache.vary_on("Accept-Encoding")
+        self._metrics = metrics
+        self._admission = admission
+        self._access_log = access_log
+        if metrics is not None and metrics_path is not None:
+            self._handler = self._serve_metrics(self._handler, metrics, metrics_path)
+
+    @staticmethod
+    def _serve_metrics(handler, metrics: aioweb.metrics.Metrics, path: str):
+        #
+        # Answer requests for the metrics ourselves and pass
+        # everything else on to the handler
+        #
+        async def handle_metrics(request, container, **params):
+            if request.path() == path and request.method() == "GET":
+                return await metrics(request, container)
+            return await handler(request, container, **params)
+        return handle_metrics
+
+    def _wrap(self, handler):
+        #
+        # Turn a handler which needs to run in a thread or a process into a coroutine
+        # function which waits for the body and then hands the handler over to the pool
+        #
+        if aioweb.handlers.runs_in_process(handler):
+            if self._process_pool is None:
+                self._process_pool = aioweb.handlers.ProcessPool(self._process_pool_size)
+            process_pool = self._process_pool
+
+            async def run_in_process(request, container, **params): # pylint: disable=unused-argument
+                await request.body()
+                return await process_pool.run(handler, request, **params)
+            return run_in_process
+        if not aioweb.handlers.runs_in_thread(handler):
+            return handler
+        pool = self._thread_pool
+
+        async def run_in_pool(request, container, **params):
+            await request.body()
+            result = await pool.run(handler, request, container, **params)
+            #
+            # A plain function can still return a coroutine, for instance if it is a
+            # lambda calling a coroutine function. This needs to run on the loop
+            #
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        return run_in_pool
+
+    def _create_protocol(self):
+        return aioweb.protocol.HttpProtocol(self, body_window=self._body_window,
+                                            write_buffer_high=self._write_buffer_high,
+                                            write_buffer_low=self._write_buffer_low,
+                                            timeout_seconds=self._timeout_seconds,
+                                            timer_wheel=self._timer_wheel,
+                                            header_cache=self._header_cache,
+                                            pipeline_concurrency=self._pipeline_concurrency,
+                                            cache=self._cache,
+                                            compression=self._compression,
+                                            metrics=self._metrics,
+                                            admission=self._admission,
+                                            max_pipeline_depth=self._max_pipeline_depth,
+                                            max_header_bytes=self._max_header_bytes,
+                                            max_body_bytes=self._max_body_bytes,
+                                            registry=self._connections,
+                                            access_log=self._access_log)
+
+    def _bind_socket(self, reuse_port: bool) -> socket.socket:
+        #
+        # Create a socket bound to our host and port
+        #
+        family, socktype, proto, _, address = socket.getaddrinfo(self._host, int(self._port),
+                                                                 type=socket.SOCK_STREAM,
+                                                                 flags=socket.AI_PASSIVE)[0]
+        sock = socket.socket(family, socktype, proto)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1) # type: ignore
+        sock.bind(address)
+        return sock
 
     async def start(self):
-        loop = asyncio.get_running_loop()
-        self._server = await loop.create_server(lambda: aioweb.protocol.HttpProtocol(self),
-                                                host=self._host,
-                                                port=self._port)
+        #
+        # If we have been started by a container which hands its socket
+        # over to us, we serve on this socket
+        #
+        sock = aioweb.restart.inherited_socket()
+        if self._workers > 1:
+            await self._supervise(sock)
+        else:
+            await self._serve(sock, on_ready=aioweb.restart.notify_ready)
+
+    async def _serve(self, sock=None, on_ready=None):
+        #
+        # Serve requests in this process, either on the socket handed over to us or
+        # on our host and port, and call on_ready once we accept connections
+        #
+        loop = self._create_stop_event()
+        if sock is None and self._hot_restart:
+            #
+            # Bind the socket ourselves, as we need it to hand it over
+            #
+            sock = self._bind_socket(reuse_port=False)
+            sock.listen(_BACKLOG)
+        self._listen_socket = sock
+        self._timer_wheel = aioweb.timer.TimerWheel(self._timeout_seconds, loop=loop)
+        self._timer_wheel.start()
+        self._header_cache.start(loop)
+        if self._access_log is not None:
+            self._access_log.start()
+        if self._process_pool is not None:
+            await self._process_pool.start()
+        if sock is not None:
+            self._server = await loop.create_server(self._create_protocol,
+                                                    sock=sock)
+        else:
+            self._server = await loop.create_server(self._create_protocol,
+                                                    host=self._host,
+                                                    port=self._port)
         await self._server.start_serving()
-        while not self._stop:
-            await asyncio.sleep(1)
+        self._watch_restart_signal(loop)
+        if on_ready is not None:
+            on_ready()
+        await self._stop_event.wait() # type: ignore
+        #
+        # Stop accepting connections and wait until the open
+        # connections have completed their requests
+        #
+        self._unwatch_restart_signal(loop)
         self._server.close()
+        await self._drain_connections()
         await self._server.wait_closed()
+        self._timer_wheel.stop()
+        self._header_cache.stop()
+        if self._access_log is not None:
+            self._access_log.stop()
+        self._thread_pool.shutdown()
+        if self._process_pool is not None:
+            #
+            # Waiting for the worker processes to exit blocks, so
+            # we do this in a thread to keep the loop running
+            #
+            await loop.run_in_executor(None, self._process_pool.shutdown)
+
+    def _run_worker(self, sock: socket.socket, reuse_port: bool, ready):
+        #
+        # This is the entry point of a worker process. We leave it to the
+        # supervisor to decide when to stop or restart, so we ignore SIGINT
+        # and SIGHUP and stop on SIGTERM. The wakeup descriptor of the event
+        # loop of the supervisor is still installed and needs to go
+        #
+        self._loop = None
+        self._stop_event = None
+        self._stop = False
+        self._hot_restart = False
+        self._restart_task = None
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        self._workers = 1
+        if reuse_port:
+            sock.close()
+            sock = self._bind_socket(reuse_port=True)
+        asyncio.run(self._serve(sock, on_ready=ready.release))
+
+    def _spawn_worker(self, context, sock: socket.socket, reuse_port: bool,
+                      ready) -> multiprocessing.process.BaseProcess:
+        process = context.Process(target=self._run_worker, args=(sock, reuse_port, ready),
+                                  daemon=True)
+        process.start()
+        logger.debug("Started worker process %d", process.pid)
+        return process
+
+    async def _supervise(self, sock=None):
+        #
+        # Bind the socket before forking so that we fail early if the port is
+        # not available. If we can use SO_REUSEPORT, we only use this socket to
+        # reserve the port and do not listen on it, as otherwise the kernel would
+        # also route connections to this socket. A socket which we hand over to
+        # a successor or have taken over is shared by all workers
+        #
+        loop = self._create_stop_event()
+        reuse_port = hasattr(socket, "SO_REUSEPORT") and not self._hot_restart and sock is None
+        if sock is None:
+            sock = self._bind_socket(reuse_port)
+            if not reuse_port:
+                sock.listen(_BACKLOG)
+        self._listen_socket = sock
+        context = multiprocessing.get_context("fork")
+        ready = context.Semaphore(0)
+        processes = [
+            self._spawn_worker(context, sock, reuse_port, ready) for _ in range(self._workers)
+        ] # type: List[multiprocessing.process.BaseProcess]
+        #
+        # Our predecessor, if any, stops once all workers accept connections
+        #
+        await loop.run_in_executor(None, self._wait_for_workers, ready)
+        aioweb.restart.notify_ready()
+        self._watch_restart_signal(loop)
+        while not self._stop:
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), 1) # type: ignore
+            except asyncio.TimeoutError:
+                pass
+            for index, process in enumerate(processes):
+                if not process.is_alive() and not self._stop:
+                    logger.error("Worker process %d exited with code %s, restarting",
+                                 process.pid, process.exitcode)
+                    processes[index] = self._spawn_worker(context, sock, reuse_port, ready)
+        self._unwatch_restart_signal(loop)
+        #
+        # Ask all workers to stop and wait until they are done. Workers which
+        # do not stop within a reasonable time are killed
+        #
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            await loop.run_in_executor(None, process.join, self._grace_seconds + 5)
+            if process.is_alive():
+                logger.error("Worker process %d did not stop, killing it", process.pid)
+                process.kill()
+                process.join()
+        sock.close()
+
+    def _wait_for_workers(self, ready):
+        #
+        # Wait until every worker has released the semaphore once, which
+        # it does when it accepts connections
+        #
+        for _ in range(self._workers):
+            if not ready.acquire(timeout=self._restart_timeout):
+                logger.error("Worker processes did not start in time")
+                return
+
+    def _watch_restart_signal(self, loop: asyncio.AbstractEventLoop):
+        if not self._hot_restart:
+            return
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self.restart)
+        except RuntimeError:
+            #
+            # Signals can only be handled in the main thread, but
+            # restart can still be called
+            #
+            logger.debug("Not restarting on SIGHUP outside of the main thread")
+
+    def _unwatch_restart_signal(self, loop: asyncio.AbstractEventLoop):
+        if self._hot_restart:
+            loop.remove_signal_handler(signal.SIGHUP)
+
+    def _create_stop_event(self) -> asyncio.AbstractEventLoop:
+        #
+        # Create the event which stop sets, taking into account
+        # that stop might already have been called
+        #
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        if self._stop:
+            self._stop_event.set()
+        return self._loop
+
+    async def _drain_connections(self):
+        #
+        # Close idle connections and let the others complete their requests
+        # within the grace period
+        #
+        for protocol in self._connections:
+            protocol.shutdown()
+        if not await self._connections.wait_empty(self._grace_seconds):
+            logger.error("Closing %d connections which are still busy", len(self._connections))
+            for protocol in self._connections:
+                protocol.abort()
 
     def stop(self):
+        #
+        # This can be called from a signal handler or another thread, so we
+        # ask the loop to set the event instead of setting it ourselves
+        #
         self._stop = True
+        if self._loop is not None and self._stop_event is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                #
+                # The loop has already been closed
+                #
+                pass
+
+    def restart(self):
+        """
+        Hand the listening socket over to a new process and stop once this process serves
+        requests. Like stop, this method is threadsafe and can be called from a signal handler
+        """
+
+        if not self._hot_restart:
+            raise RuntimeError("Hot restart is not enabled")
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._start_successor)
+            except RuntimeError:
+                #
+                # The loop has already been closed
+                #
+                pass
+
+    def _start_successor(self):
+        if self._stop or self._listen_socket is None:
+            return
+        if self._restart_task is not None and not self._restart_task.done():
+            logger.debug("Ignoring restart while a restart is in progress")
+            return
+        self._restart_task = asyncio.ensure_future(self._hand_over(self._listen_socket))
+
+    async def _hand_over(self, sock: socket.socket):
+        if await aioweb.restart.spawn_successor(sock, self._restart_command,
+                                                self._restart_timeout):
+            self.stop()
 
     def create_exception(self, msg: str):
         return aioweb.exceptions.HTTPException(msg)
@@ -91,3 +552,57 @@ class HttpToolsWebContainer(WebContainer):
     async def handle_request(self, request: aioweb.request.Request):
         result = await self._handler(request, self)
         return result
+
+
+class RoutingWebContainer(HttpToolsWebContainer):
+
+    """
+    A container which dispatches requests to different handlers depending on method and path.
+
+    Handlers are registered using add_route, specifying the method, a path pattern as understood
+    by aioweb.router.Router and the handler. Values of path parameters are passed to the handler
+    as keyword arguments, i.e. a handler for the pattern /users/{id:int} has the signature
+
+    async def handler(request, container, id)
+
+    If no route matches the path of a request, a response with status code 404 is returned, and if
+    a route matches but has no handler for the method, a response with status code 405 is returned,
+    in both cases without invoking any handler. All other parameters are as for the
+    HttpToolsWebContainer
+    """
+
+    __slots__ = ['_router']
+
+    def __init__(self, host: str, port: str,
+                 router: Optional[aioweb.router.Router] = None, **kwargs) -> None:
+        super().__init__(host, port, handler=self._dispatch, **kwargs)
+        if router is None:
+            router = aioweb.router.Router()
+        self._router = router
+
+    def add_route(self, method: str, pattern: str, handler):
+        """
+        Register a handler for the given method and path pattern
+        """
+
+        self._router.add_route(method, pattern, self._wrap(handler))
+
+    def add_static(self, prefix: str, directory: str, **kwargs):
+        """
+        Serve the files in the given directory below the path prefix, using an
+        aioweb.static.StaticFiles handler. Additional keyword arguments are passed
+        to the handler
+        """
+
+        self.add_route("GET", prefix.rstrip("/") + "/{path:path}",
+                       aioweb.static.StaticFiles(directory, **kwargs))
+
+    async def _dispatch(self, request: aioweb.request.Request, container: WebContainer):
+        match = self._router.match(request.path())
+        if match is None:
+            return aioweb.router.NOT_FOUND
+        route, params = match
+        handler = route.handlers.get(request.method())
+        if handler is None:
+            return route.method_not_allowed
+        return await handler(request, container, **params)
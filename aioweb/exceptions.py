@@ -4,5 +4,16 @@ Exceptions used in the aioweb package
 
 class HTTPException(BaseException):
     """
-    This class signals an error during the processing of a HTTP request
+    This class signals an error during the processing of a HTTP request. The status code
+    is used for the response, for the default 500 the message is prefixed accordingly
+    """
+
+    def __init__(self, *args, status_code: int = 500) -> None:
+        super().__init__(*args)
+        self.status_code = status_code
+
+
+class WebSocketClosed(Exception):
+    """
+    Raised when a message is sent through a WebSocket which is already closed
     """
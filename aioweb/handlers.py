@@ -0,0 +1,219 @@
+"""
+This module contains helpers to run handlers which are not native coroutines
+or which are CPU-bound
+"""
+
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import functools
+import inspect
+import logging
+from typing import Any, Optional
+
+import aioweb.request
+import aioweb.response
+
+logger = logging.getLogger(__name__)
+
+#
+# The response returned if the pool is saturated. Retry-After tells the client
+# that it makes sense to try again soon
+#
+SERVICE_UNAVAILABLE = aioweb.response.Response(b"Service Unavailable", status_code=503,
+                                               headers={"Retry-After": "1"})
+
+
+def run_in_thread(handler):
+    """
+    Mark a handler to be run in the thread pool of the container. This is only
+    needed for handlers which are not plain functions but need to block, as the
+    container detects plain functions itself
+    """
+
+    handler.aioweb_thread = True
+    return handler
+
+
+def cpu_bound(handler):
+    """
+    Mark a handler as CPU-bound, so that the container runs it in its process pool.
+    The handler and its result need to be picklable, so it should be a function defined
+    at module level
+    """
+
+    handler.aioweb_process = True
+    return handler
+
+
+def runs_in_process(handler) -> bool:
+    """
+    Return true if a handler has been marked using cpu_bound
+    """
+
+    return getattr(handler, "aioweb_process", False)
+
+
+def runs_in_thread(handler) -> bool:
+    """
+    Return true if a handler needs to be run in the thread pool, i.e. if it has been
+    marked using run_in_thread or if it is neither a coroutine function nor an object
+    with a coroutine function as __call__ method
+    """
+
+    if getattr(handler, "aioweb_thread", False):
+        return True
+    target = handler
+    while isinstance(target, functools.partial):
+        target = target.func
+    if inspect.iscoroutinefunction(target):
+        return False
+    if inspect.isfunction(target) or inspect.ismethod(target):
+        return True
+    call = getattr(target, "__call__", None)
+    return call is not None and not inspect.iscoroutinefunction(call)
+
+
+class ThreadPool:
+    """
+    A pool of threads in which the container runs synchronous handlers.
+
+    At most max_workers handlers run at the same time, and at most max_queue further
+    invocations wait for a free thread. If more handlers are invoked, they are not queued,
+    but answered with the response SERVICE_UNAVAILABLE right away, so that the backlog
+    of a saturated pool does not grow without bound. The threads are started when they
+    are needed for the first time.
+    """
+
+    __slots__ = ['_max_workers', '_max_queue', '_executor', '_in_flight']
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue: int = 64) -> None:
+        self._max_workers = max_workers
+        self._max_queue = max_queue
+        self._executor = None # type: Optional[concurrent.futures.ThreadPoolExecutor]
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        """
+        The number of invocations which are running or waiting for a thread
+        """
+
+        return self._in_flight
+
+    async def run(self, func, *args, **kwargs) -> Any:
+        """
+        Run func with the given arguments in a thread and return its result, or
+        SERVICE_UNAVAILABLE if there is no capacity left
+        """
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._max_workers, thread_name_prefix="aioweb")
+        if self._in_flight >= self._executor._max_workers + self._max_queue: # pylint: disable=protected-access
+            logger.error("Thread pool saturated, rejecting request")
+            return SERVICE_UNAVAILABLE
+        loop = asyncio.get_event_loop()
+        future = self._executor.submit(func, *args, **kwargs)
+        #
+        # We count an invocation until the thread is done with it, even if the
+        # request is cancelled in the meantime, as it still occupies a thread
+        #
+        self._in_flight += 1
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._done))
+        return await asyncio.wrap_future(future, loop=loop)
+
+    def shutdown(self):
+        """
+        Shut down the executor without waiting for running handlers
+        """
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _done(self):
+        self._in_flight -= 1
+
+
+def _warm_up():
+    #
+    # Submitted once per worker when the pool is started,
+    # so that all worker processes exist before the first request
+    #
+    return None
+
+
+def _run_snapshot(handler, snapshot: aioweb.request.RequestSnapshot, params):
+    #
+    # This runs in a worker process. There is no container in this process,
+    # so the handler receives None instead
+    #
+    return handler(snapshot, None, **params)
+
+
+class ProcessPool:
+    """
+    A pool of processes in which the container runs CPU-bound handlers.
+
+    A handler receives a snapshot of the request (an aioweb.request.RequestSnapshot) containing
+    method, URL, headers and the complete body, and its result is sent back to the container. Bodies
+    of at least shm_threshold bytes are passed in a block of shared memory instead of being pickled
+    and written to the pipe leading to the worker. The worker processes are started by start, so
+    that the first requests do not have to wait for them. If a worker process dies, the pool is
+    replaced by a new one and the requests which were in progress fail.
+    """
+
+    __slots__ = ['_max_workers', '_shm_threshold', '_context', '_executor']
+
+    def __init__(self, max_workers: Optional[int] = None, shm_threshold: int = 1024 * 1024,
+                 context=None) -> None:
+        self._max_workers = max_workers
+        self._shm_threshold = shm_threshold
+        self._context = context
+        self._executor = None # type: Optional[concurrent.futures.ProcessPoolExecutor]
+
+    async def start(self):
+        """
+        Create the worker processes and wait until all of them are up
+        """
+
+        executor = self._get_executor()
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*[loop.run_in_executor(executor, _warm_up)
+                               for _ in range(executor._max_workers)]) # pylint: disable=protected-access
+
+    async def run(self, handler, request, **params) -> Any:
+        """
+        Run handler with a snapshot of the request in a worker process and return its
+        result. The body of the request needs to be complete
+        """
+
+        snapshot = request.snapshot(self._shm_threshold)
+        executor = self._get_executor()
+        try:
+            return await asyncio.get_event_loop().run_in_executor(
+                executor, functools.partial(_run_snapshot, handler, snapshot, params))
+        except concurrent.futures.process.BrokenProcessPool:
+            logger.error("Worker process died, replacing process pool")
+            if self._executor is executor:
+                executor.shutdown(wait=False)
+                self._executor = None
+            raise
+        finally:
+            snapshot.release()
+
+    def shutdown(self):
+        """
+        Shut down the worker processes after the running handlers have completed
+        """
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._max_workers, mp_context=self._context)
+        return self._executor
@@ -0,0 +1,112 @@
+"""
+This module contains the structure in which we store the headers of a request
+"""
+
+import collections.abc
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+#
+# Header names which we expect to see in most requests. For these names, we map the
+# spellings commonly used by clients to a single lowercase string, so that we do not
+# have to decode and lowercase them again and again
+#
+_COMMON_NAMES = [
+    "Accept", "Accept-Encoding", "Accept-Language", "Authorization", "Cache-Control",
+    "Connection", "Content-Length", "Content-Type", "Cookie", "Host", "If-Modified-Since",
+    "If-None-Match", "Origin", "Range", "Referer", "Transfer-Encoding", "Upgrade",
+    "User-Agent", "X-Forwarded-For", "X-Requested-With",
+]
+
+_INTERNED = {} # type: Dict[bytes, str]
+for _name in _COMMON_NAMES:
+    _INTERNED[_name.encode("ascii")] = _name.lower()
+    _INTERNED[_name.lower().encode("ascii")] = _name.lower()
+
+
+def _lower(name: bytes) -> str:
+    try:
+        return _INTERNED[name]
+    except KeyError:
+        return name.decode("latin-1").lower()
+
+
+class Headers(collections.abc.Mapping):
+    """
+    The headers of a request.
+
+    While parsing, names and values are simply appended as raw bytes to a flat list, so that
+    collecting the headers of a request does not require any decoding. Only when a handler looks up
+    a header for the first time, we build an index which maps the lowercased names to their values.
+    Lookups are therefore case-insensitive, and keys can be given as string or bytes.
+
+    A header can appear more than once in a request. Indexing returns the first value, while
+    getall returns all values in the order in which they have been received. Values are returned
+    as bytes.
+    """
+
+    __slots__ = ['_items', '_index']
+
+    def __init__(self, items: Optional[List[bytes]] = None) -> None:
+        self._items = items if items is not None else [] # type: List[bytes]
+        self._index = None # type: Optional[Dict[str, List[bytes]]]
+
+    def add(self, name: bytes, value: bytes):
+        """
+        Append a header, called by the protocol for every header line
+        """
+
+        self._items.append(name)
+        self._items.append(value)
+        self._index = None
+
+    def getall(self, name: Union[str, bytes], default=None) -> List[bytes]:
+        """
+        Return a list of all values of the given header, or default if the
+        header is not present
+        """
+
+        values = self._get_index().get(self._key(name))
+        if values is None:
+            return default
+        return list(values)
+
+    def raw_items(self) -> List[Tuple[bytes, bytes]]:
+        """
+        Return all headers as pairs of name and value, exactly as they have
+        been received
+        """
+
+        items = self._items
+        return list(zip(items[0::2], items[1::2]))
+
+    def __getitem__(self, name: Union[str, bytes]) -> bytes:
+        return self._get_index()[self._key(name)][0]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._get_index())
+
+    def __len__(self) -> int:
+        return len(self._get_index())
+
+    def __repr__(self) -> str:
+        return "Headers(%r)" % self.raw_items()
+
+    @staticmethod
+    def _key(name: Union[str, bytes]) -> str:
+        if isinstance(name, bytes):
+            return _lower(name)
+        return name.lower()
+
+    def _get_index(self) -> Dict[str, List[bytes]]:
+        if self._index is None:
+            index = {} # type: Dict[str, List[bytes]]
+            items = self._items
+            for position in range(0, len(items), 2):
+                name = _lower(items[position])
+                values = index.get(name)
+                if values is None:
+                    index[name] = [items[position + 1]]
+                else:
+                    values.append(items[position + 1])
+            self._index = index
+        return self._index
@@ -0,0 +1,195 @@
+"""
+This module contains a registry of metrics which the protocol updates while it processes
+requests and which can be exported in the text format used by Prometheus
+"""
+
+import math
+from typing import List, Set
+
+import aioweb.protocol # pylint: disable=cyclic-import
+import aioweb.response
+
+#
+# The upper bound of the first bucket of the latency histogram in seconds. The upper
+# bound of every further bucket is twice the bound of the previous one
+#
+_FIRST_BUCKET = 0.0001
+
+#
+# The number of buckets with an upper bound, so the largest bound is about 13 seconds.
+# Observations above that are only counted in the implicit bucket +Inf
+#
+_BUCKETS = 18
+
+#
+# The content type of the text format of Prometheus
+#
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """
+    A histogram with buckets whose bounds grow exponentially.
+
+    The bucket of an observation is determined from the binary exponent of the value, so
+    recording an observation takes constant time, and the histogram uses a fixed amount of
+    memory regardless of the number of observations
+    """
+
+    __slots__ = ['_first', '_counts', 'count', 'sum']
+
+    def __init__(self, first: float = _FIRST_BUCKET, buckets: int = _BUCKETS) -> None:
+        self._first = first
+        self._counts = [0] * (buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def bounds(self) -> List[float]:
+        """
+        Return the upper bounds of the buckets, not including the bucket +Inf
+        """
+
+        return [self._first * 2 ** index for index in range(len(self._counts) - 1)]
+
+    def observe(self, value: float):
+        """
+        Record an observation
+        """
+
+        self.count += 1
+        self.sum += value
+        ratio = value / self._first
+        if ratio <= 1.0:
+            self._counts[0] += 1
+            return
+        #
+        # frexp returns m and e with ratio = m * 2 ** e and 0.5 <= m < 1, so for a ratio
+        # which is not a power of two, the bucket is e. A power of two belongs to the
+        # bucket whose bound it is, i.e. e - 1
+        #
+        mantissa, index = math.frexp(ratio)
+        if mantissa == 0.5:
+            index -= 1
+        self._counts[min(index, len(self._counts) - 1)] += 1
+
+    def cumulative(self) -> List[int]:
+        """
+        Return the number of observations which are less than or equal to the bound of each
+        bucket, including the bucket +Inf as the last element
+        """
+
+        result = []
+        total = 0
+        for count in self._counts:
+            total += count
+            result.append(total)
+        return result
+
+
+class Metrics: # pylint: disable=too-many-instance-attributes
+    """
+    The metrics of a container.
+
+    The protocol increments the counters and records the latency of every request, i.e. the time
+    from the moment the header has been received until the response is ready to be written. The
+    state of the open connections and the number of requests waiting in their queues are not
+    tracked while requests are processed, but collected from the connections when the metrics are
+    exported, so that they do not add to the cost of a request. To make this possible, protocols
+    register with the metrics when a connection is made.
+
+    The number of requests per second can be derived from the counter of requests, for instance
+    using the function rate of Prometheus.
+    """
+
+    __slots__ = ['requests', 'bytes_received', 'bytes_sent', 'handler_exceptions',
+                 'timeouts', 'latency', '_connections']
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.handler_exceptions = 0
+        self.timeouts = 0
+        self.latency = Histogram()
+        self._connections = set() # type: Set
+
+    def add_connection(self, protocol):
+        """
+        Register a protocol whose connection has been made
+        """
+
+        self._connections.add(protocol)
+
+    def remove_connection(self, protocol):
+        """
+        Remove a protocol whose connection has been lost
+        """
+
+        self._connections.discard(protocol)
+
+    def connection_states(self):
+        """
+        Return a dictionary which maps the names of the connection states to the
+        number of open connections in this state
+        """
+
+        states = {state.name: 0 for state in aioweb.protocol.ConnectionState}
+        for protocol in self._connections:
+            states[protocol.get_state().name] += 1
+        return states
+
+    def queue_depths(self) -> List[int]:
+        """
+        Return the number of queued requests for each open connection
+        """
+
+        return [protocol.get_queue_depth() for protocol in self._connections]
+
+    def render(self) -> bytes:
+        """
+        Return the metrics in the text format of Prometheus
+        """
+
+        lines = []
+
+        def add(name: str, kind: str, description: str, samples):
+            lines.append("# HELP %s %s" % (name, description))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, value in samples:
+                lines.append("%s%s %s" % (name, labels, value))
+
+        add("aioweb_requests_total", "counter", "Number of requests handled",
+            [("", self.requests)])
+        add("aioweb_received_bytes_total", "counter", "Number of bytes received",
+            [("", self.bytes_received)])
+        add("aioweb_sent_bytes_total", "counter", "Number of bytes sent",
+            [("", self.bytes_sent)])
+        add("aioweb_handler_exceptions_total", "counter", "Number of exceptions raised by handlers",
+            [("", self.handler_exceptions)])
+        add("aioweb_timeouts_total", "counter", "Number of connections closed as idle",
+            [("", self.timeouts)])
+        add("aioweb_connections", "gauge", "Number of open connections by state",
+            [('{state="%s"}' % name.lower(), count)
+             for name, count in self.connection_states().items()])
+        depths = self.queue_depths()
+        add("aioweb_queued_requests", "gauge", "Number of requests waiting in connection queues",
+            [("", sum(depths))])
+        add("aioweb_max_queue_depth", "gauge", "Largest number of requests waiting in one queue",
+            [("", max(depths, default=0))])
+        bounds = ["%g" % bound for bound in self.latency.bounds()] + ["+Inf"]
+        name = "aioweb_request_duration_seconds"
+        add(name, "histogram", "Time until the response to a request is ready",
+            [('_bucket{le="%s"}' % bound, count)
+             for bound, count in zip(bounds, self.latency.cumulative())]
+            + [("_sum", repr(self.latency.sum)), ("_count", self.latency.count)])
+        lines.append("")
+        return "\n".join(lines).encode("utf-8")
+
+    async def __call__(self, request, container):
+        """
+        Serve the metrics, so that an instance can be used as a handler. The response
+        must not be stored by a response cache, as the metrics change all the time
+        """
+
+        return aioweb.response.Response(self.render(), headers={"Cache-Control": "no-store"},
+                                        content_type=CONTENT_TYPE)
@@ -2,20 +2,109 @@
 This module implements a protocol which can be used with asyncio and controls the
 processing flow of a request
 """
+# pylint: disable=too-many-lines
 
 import asyncio
+import collections
 import logging
+import mmap
+import socket
+import time
 from enum import Enum
-from typing import Dict
+from typing import Any, AsyncIterator, Deque, Iterator, Optional, Set, Tuple, TYPE_CHECKING
 
 import httptools # type: ignore
 
+import aioweb.accesslog
+import aioweb.admission
+import aioweb.cache
+import aioweb.compression
+import aioweb.headers
 import aioweb.request
-import aioweb.container
 import aioweb.exceptions
+import aioweb.timer
+import aioweb.response
+import aioweb.websocket
+
+if TYPE_CHECKING:
+    import aioweb.container # pylint: disable=cyclic-import
+    import aioweb.metrics # pylint: disable=cyclic-import
 
 logger = logging.getLogger(__name__)
 
+#
+# Reasons for which reading from the transport can be paused
+#
+_PAUSED_BY_BODY = 1         # A handler does not consume the request body fast enough
+_PAUSED_BY_ADMISSION = 2    # The connection is parked by the admission control
+_PAUSED_BY_PIPELINE = 4     # Too many requests are waiting to be handled
+_PAUSED_BY_ERROR = 8        # We have rejected a request and stop reading for good
+_PAUSED_BY_WEBSOCKET = 16   # The client asks for a WebSocket which is not yet accepted
+
+#
+# Decoded versions of the most common HTTP methods
+#
+_METHODS = {method.encode(): method for method in
+            ("GET", "HEAD", "POST", "PUT", "DELETE", "PATCH", "OPTIONS")}
+
+#
+# Bodies up to this size are copied into the buffer holding the header so that the
+# response can be handed over to the transport with a single write. Larger bodies are
+# written separately to avoid copying them
+#
+_COPY_THRESHOLD = 16384
+
+#
+# The size of the pieces in which we write a memory mapped file
+# if the transport does not support sendfile
+#
+_FILE_CHUNK_SIZE = 262144
+
+#
+# Responses with these status codes never have a body
+#
+_NO_BODY_STATUS = (204, 304)
+
+#
+# The header cache used if the container does not provide one
+#
+_HEADER_CACHE = aioweb.response.HeaderCache()
+
+
+class _Rejected(Exception):
+    #
+    # Raised by a parser callback to stop parsing when we reject a request
+    #
+    def __init__(self, status_code: int, reason: str) -> None:
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+
+
+class _Rejection:
+    #
+    # Put into the queue instead of a request which we reject before its header is
+    # complete. It provides what the worker loop needs from a request to send the
+    # response, after which the connection is closed
+    #
+    __slots__ = ['status_code', 'reason']
+
+    def __init__(self, status_code: int, reason: str) -> None:
+        self.status_code = status_code
+        self.reason = reason
+
+    @staticmethod
+    def http_version() -> str: # pylint: disable=missing-function-docstring
+        return "1.1"
+
+    @staticmethod
+    def keep_alive() -> bool: # pylint: disable=missing-function-docstring
+        return False
+
+    def release(self): # pylint: disable=missing-function-docstring
+        pass
+
+
 class ConnectionState(Enum):
     """
     This encodes the state of a connection.
@@ -34,6 +123,59 @@ class ConnectionState(Enum):
 
 
 
+class ConnectionRegistry:
+    """
+    The open connections of a container, which the container needs to know about to
+    shut them down. Protocols add themselves when a connection is made and remove
+    themselves when it is lost
+    """
+
+    __slots__ = ['_protocols', '_waiter']
+
+    def __init__(self) -> None:
+        self._protocols = set() # type: Set[HttpProtocol]
+        self._waiter = None # type: Optional[asyncio.Future]
+
+    def __len__(self) -> int:
+        return len(self._protocols)
+
+    def __iter__(self) -> Iterator["HttpProtocol"]:
+        return iter(list(self._protocols))
+
+    def add(self, protocol: "HttpProtocol"):
+        """
+        Register a protocol whose connection has been made
+        """
+
+        self._protocols.add(protocol)
+
+    def discard(self, protocol: "HttpProtocol"):
+        """
+        Remove a protocol whose connection has been lost
+        """
+
+        self._protocols.discard(protocol)
+        if not self._protocols and self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def wait_empty(self, timeout: float) -> bool:
+        """
+        Wait until all connections have been lost, but at most timeout seconds. Return
+        True if there are no connections left
+        """
+
+        if not self._protocols:
+            return True
+        self._waiter = asyncio.get_event_loop().create_future()
+        try:
+            await asyncio.wait_for(self._waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiter = None
+
+
 class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attributes
 
     """
@@ -47,29 +189,117 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
     to wait for the request body or proceed. In any case, the handler is expected to return
     a sequence of bytes which will then be used as the body of the response.
 
-    If the parser signals that a message is complete, the future embedded into the current
-    request will be completed using the request body as a result.
+    Body parts delivered by the parser are handed over to the request which is currently parsed,
+    from where the handler can consume them as a stream. If the handler falls behind, the request
+    will ask us to pause reading from the transport until the handler has caught up. If the parser
+    signals that a message is complete, the future embedded into the current request will be
+    completed using the request body as a result.
+
+    By default, the requests received via one connection are handled one after the other. If
+    pipeline_concurrency is larger than one, up to this number of pipelined requests are handled
+    concurrently, each in a task of its own. The responses are still written in the order in which
+    the requests have been received, so a response which is ready early is held back until all
+    responses to earlier requests have been written.
+
+    If metrics (an instance of aioweb.metrics.Metrics) are given, the protocol registers the
+    connection with them and updates their counters and the latency histogram. If admission
+    (an instance of aioweb.admission.AdmissionControl) is given, we do not read from the connection
+    before it has been admitted, and answer requests with status code 503 instead of invoking the
+    handler if too many handlers are already running.
+
+    To bound the memory used by a connection, we stop reading from it while max_pipeline_depth
+    requests are waiting to be handled. As the parser cannot be stopped in the middle of the data
+    it has been given, all requests contained in one read from the socket are queued, so the
+    number of waiting requests can exceed the limit by the number of requests which fit into
+    one read. We also reject requests whose header (request line and header
+    lines) is larger than max_header_bytes with status code 431 and requests whose body is larger
+    than max_body_bytes with status code 413. We check the size of the header whenever the parser
+    has delivered a complete header line, and the parser itself does not accept more than 80 KB of
+    header in any case. Requests which the parser cannot parse are rejected with status code 400.
+    After rejecting a request, we do not read from the connection any more and close it once the
+    response has been sent. If the handler for a request is already running when its body turns
+    out to be too large or invalid, it receives an HTTPException with this status code when it
+    waits for the body. A limit of None means that there is no limit.
+
+    If a registry (an instance of ConnectionRegistry) is given, the protocol registers its
+    connection with it, so that the container can call shutdown for all open connections.
+
+    If an access_log (an instance of aioweb.accesslog.AccessLog) is given, every request answered
+    by a handler or from the cache is recorded in it. Apart from the address of the client, which
+    we look up once per connection, this only stores references to data we have anyway.
     """
 
     __slots__ = ['_loop', '_transport', '_queue', '_container',
                  '_current_task', '_timeout_seconds', '_timeout_handler',
-                 '_parser', '_state', '_headers', '_body_future', '_body']
+                 '_parser', '_state', '_headers', '_request', '_body_window',
+                 '_paused_by', '_write_paused', '_drain_waiter',
+                 '_write_buffer_high', '_write_buffer_low', '_timer_wheel',
+                 'last_activity', '_header_cache', '_url', '_pipeline_concurrency',
+                 '_cache', '_compression', '_metrics', '_admission',
+                 '_max_pipeline_depth', '_max_header_bytes', '_max_body_bytes',
+                 '_header_bytes', '_body_bytes', '_registry', '_draining',
+                 '_outstanding', '_last_request', '_access_log', '_peer', '_websocket',
+                 '_ping_sent']
 
-    def __init__(self, container: aioweb.container.WebContainer,
-                 loop=None, timeout_seconds: int = 5) -> None:
+    def __init__(self, container: "aioweb.container.WebContainer", # pylint: disable=too-many-arguments,too-many-locals
+                 loop=None, timeout_seconds: int = 5,
+                 body_window: int = 65536,
+                 write_buffer_high: Optional[int] = None,
+                 write_buffer_low: Optional[int] = None,
+                 timer_wheel: Optional[aioweb.timer.TimerWheel] = None,
+                 header_cache: Optional[aioweb.response.HeaderCache] = None,
+                 pipeline_concurrency: int = 1,
+                 cache: Optional[aioweb.cache.ResponseCache] = None,
+                 compression: Optional[aioweb.compression.Compression] = None,
+                 metrics: Optional["aioweb.metrics.Metrics"] = None,
+                 admission: Optional[aioweb.admission.AdmissionControl] = None,
+                 max_pipeline_depth: Optional[int] = 64,
+                 max_header_bytes: Optional[int] = 65536,
+                 max_body_bytes: Optional[int] = None,
+                 registry: Optional[ConnectionRegistry] = None,
+                 access_log: Optional[aioweb.accesslog.AccessLog] = None) -> None:
         if loop is None:
             loop = asyncio.get_event_loop()
         self._loop = loop
-        self._transport = None
+        self._transport = None # type: Any
         self._container = container
         self._current_task = None
         self._timeout_seconds = timeout_seconds
         self._timeout_handler = None
+        self._timer_wheel = timer_wheel
+        self.last_activity = 0
+        if header_cache is None:
+            header_cache = _HEADER_CACHE
+        self._header_cache = header_cache
+        self._pipeline_concurrency = pipeline_concurrency
+        self._cache = cache
+        self._compression = compression
+        self._metrics = metrics
+        self._admission = admission
+        self._max_pipeline_depth = max_pipeline_depth
+        self._max_header_bytes = max_header_bytes
+        self._max_body_bytes = max_body_bytes
+        self._header_bytes = 0
+        self._body_bytes = 0
+        self._registry = registry
+        self._draining = False
+        self._outstanding = 0
+        self._last_request = None # type: Optional[aioweb.request.HTTPToolsRequest]
+        self._access_log = access_log
+        self._peer = None # type: Any
+        self._websocket = None # type: Optional[aioweb.websocket.WebSocket]
+        self._ping_sent = False
         self._parser = None
         self._state = ConnectionState.CLOSED
-        self._headers = {} # type: Dict[str, bytes]
-        self._body_future = None
-        self._body = None
+        self._headers = aioweb.headers.Headers()
+        self._url = b""
+        self._request = None # type: Optional[aioweb.request.HTTPToolsRequest]
+        self._body_window = body_window
+        self._paused_by = 0
+        self._write_paused = False
+        self._drain_waiter = None # type: Optional[asyncio.Future]
+        self._write_buffer_high = write_buffer_high
+        self._write_buffer_low = write_buffer_low
         self._queue = asyncio.Queue() # type: asyncio.Queue
 
     def connection_made(self, transport):
@@ -84,25 +314,49 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
         self._transport = transport
         logger.debug("Connection started, transport is %s", self._transport)
         #
+        # Apply the watermarks for the write buffer if we have been asked to
+        # do so, otherwise stick to the defaults of the transport
+        #
+        if self._write_buffer_high is not None or self._write_buffer_low is not None:
+            transport.set_write_buffer_limits(high=self._write_buffer_high,
+                                              low=self._write_buffer_low)
+        if self._access_log is not None:
+            self._peer = transport.get_extra_info("peername")
+        #
         #
         # Schedule a task to handle all requests coming in via this connection
         #
         self._current_task = asyncio.create_task(self._worker_loop())
         #
-        # Schedule a timer
+        # Schedule a timer. If the container has given us a timer wheel, we register
+        # with the wheel instead of using a timer of our own
         #
-        logger.debug("Scheduling timeout")
-        self._timeout_handler = self._loop.call_later(self._timeout_seconds, self._do_timeout)
+        if self._timer_wheel is not None:
+            self._timer_wheel.add(self)
+        else:
+            logger.debug("Scheduling timeout")
+            self._timeout_handler = self._loop.call_later(self._timeout_seconds, self._do_timeout)
         self._state = ConnectionState.PENDING
+        if self._metrics is not None:
+            self._metrics.add_connection(self)
+        if self._registry is not None:
+            self._registry.add(self)
+        #
+        # If there are too many connections already, do not read
+        # from this one until it is admitted
+        #
+        if self._admission is not None and not self._admission.connection_made(self):
+            logger.debug("Parking connection")
+            self._pause_reading(_PAUSED_BY_ADMISSION)
 
     def connection_lost(self, exc):
         """
         Signal that a connection has been closed.
 
         This callback is invoked by the transport when the connection is lost. Exceptions
-        passed will be ignored. The current task will be cancelled, and the state of the
-        connection will be set to closed. Any pending timeout handlers will be cancelled as
-        well.
+        passed will be ignored. The current task will be cancelled, unless it runs the session
+        of a WebSocket, and the state of the connection will be set to closed. Any pending
+        timeout handlers will be cancelled as well.
         """
 
         if exc:
@@ -113,6 +367,15 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
             logger.error("Connection closed with message %s", exc)
         logger.debug("Connection closed")
         self._transport = None
+        if self._websocket is not None:
+            #
+            # A running session learns from its WebSocket that the connection is
+            # gone and is left to finish on its own, so that it can clean up
+            #
+            if self._websocket.started:
+                self._current_task = None
+            self._websocket.connection_lost()
+            self._websocket = None
         if self._current_task is not None:
             #
             # Cancel the task. This will (in the next iteration of the loop) resume
@@ -127,7 +390,25 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
             logger.debug("Cancelling timeout handler")
             self._timeout_handler.cancel()
             self._timeout_handler = None
+        if self._timer_wheel is not None:
+            self._timer_wheel.remove(self)
+        if self._metrics is not None:
+            self._metrics.remove_connection(self)
+        if self._admission is not None:
+            self._admission.connection_lost(self)
+        if self._registry is not None:
+            self._registry.discard(self)
+        self._ping_sent = False
         self._queue = asyncio.Queue()
+        self._outstanding = 0
+        self._last_request = None
+        self._request = None
+        self._url = b""
+        self._paused_by = 0
+        self._write_paused = False
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+        self._drain_waiter = None
         self._state = ConnectionState.CLOSED
 
     def data_received(self, data: bytes):
@@ -145,6 +426,20 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
         if self._parser is None:
             self._parser = httptools.HttpRequestParser(self) # pylint: disable=no-member
         #
+        # Once we have rejected a request, we ignore whatever the client sends
+        #
+        if self._paused_by & _PAUSED_BY_ERROR:
+            return
+        #
+        # Once the client has asked for an upgrade, the data is no longer HTTP
+        # but belongs to the WebSocket
+        #
+        if self._websocket is not None:
+            self._websocket.feed_data(data)
+            self._ping_sent = False
+            self._record_activity(len(data))
+            return
+        #
         # If we were pending before, i.e. this is the first piece of a new request,
         # advance the status
         #
@@ -154,16 +449,201 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
         # Feed data into parser, which might eventually trigger callbacks
         # or raise exceptions if the data is not valid
         #
-        self._parser.feed_data(data) # type: ignore
+        try:
+            self._parser.feed_data(data) # type: ignore
+        except httptools.HttpParserCallbackError as exc: # pylint: disable=no-member
+            rejected = exc.__context__
+            if not isinstance(rejected, _Rejected):
+                raise
+            self._reject(rejected.status_code, rejected.reason) # pylint: disable=no-member
+        except httptools.HttpParserError as exc: # pylint: disable=no-member
+            logger.error("Could not parse request (msg=%s)", exc)
+            self._reject(400, "Bad Request")
+        except httptools.HttpParserUpgrade as exc: # pylint: disable=no-member
+            #
+            # The request asking for the upgrade is complete and queued, and the
+            # data following it starts at the offset given by the parser
+            #
+            self._upgrade(data[exc.args[0]:])
+        self._record_activity(len(data))
+
+    def _record_activity(self, received: int):
+        if self._metrics is not None:
+            self._metrics.bytes_received += received
         #
-        # If we have a running timeout, reschedule it. This is not awfully
-        # efficient, we could also let it expire and reschedule only then...
+        # Record the activity. If we use a timer wheel, this is all we need to
+        # do, the wheel will pick up the new value when the old deadline comes.
+        # Otherwise, if we have a running timeout, reschedule it
         #
-        if self._timeout_handler is not None:
+        if self._timer_wheel is not None:
+            self.last_activity = self._timer_wheel.now
+        elif self._timeout_handler is not None:
             logger.debug("Resetting timeout")
             self._timeout_handler.cancel()
             self._timeout_handler = self._loop.call_later(self._timeout_seconds, self._do_timeout)
 
+    def _upgrade(self, data: bytes):
+        #
+        # The client has asked to upgrade the connection. We hold back whatever it
+        # sends until the handler has decided whether to accept the upgrade. If it
+        # does not, the connection cannot return to HTTP and is closed after the
+        # response
+        #
+        logger.debug("Client asks for upgrade")
+        self._websocket = aioweb.websocket.WebSocket(
+            self._transport, self._loop, self._drain,
+            self._pause_for_websocket, self._resume_for_websocket)
+        self._websocket.feed_data(data)
+        self._pause_reading(_PAUSED_BY_WEBSOCKET)
+        if self._last_request is not None:
+            self._last_request.close_connection()
+
+    def pause_writing(self):
+        """
+        Signal that the write buffer of the transport is full.
+
+        This callback is invoked by the transport when the size of its write buffer exceeds
+        the high watermark. Until resume_writing is called, the worker loop will suspend after
+        writing instead of handing over more data to the transport
+        """
+
+        logger.debug("Pausing writes")
+        self._write_paused = True
+
+    def resume_writing(self):
+        """
+        Signal that the write buffer of the transport has drained.
+
+        This callback is invoked by the transport when the size of its write buffer drops below
+        the low watermark. We release the worker loop if it is waiting for this
+        """
+
+        logger.debug("Resuming writes")
+        self._write_paused = False
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+        self._drain_waiter = None
+
+    async def _drain(self):
+        #
+        # Wait until the transport is willing to accept more data
+        #
+        if not self._write_paused:
+            return
+        self._drain_waiter = self._loop.create_future()
+        await self._drain_waiter
+
+    def _pause_reading(self, reason: int):
+        #
+        # Pause reading from the transport. We keep track of the reasons
+        # so that we only resume once all of them are cleared
+        #
+        if self._paused_by == 0 and self._transport is not None:
+            self._transport.pause_reading()
+        self._paused_by |= reason
+
+    def _resume_reading(self, reason: int):
+        if self._paused_by & reason:
+            self._paused_by &= ~reason
+            if self._paused_by == 0 and self._transport is not None:
+                self._transport.resume_reading()
+
+    def _reject(self, status_code: int, reason: str):
+        #
+        # Reject the request which is currently parsed and stop reading. If the
+        # request has already been handed over to the worker loop, its handler
+        # receives an exception when it waits for the body, otherwise we queue
+        # the response so that it is sent after the responses to earlier requests
+        #
+        logger.error("Rejecting request with status %d (%s)", status_code, reason)
+        self._pause_reading(_PAUSED_BY_ERROR)
+        if self._request is not None:
+            self._request.fail(aioweb.exceptions.HTTPException(reason, status_code=status_code))
+            self._request = None
+        else:
+            self._outstanding += 1
+            self._queue.put_nowait(_Rejection(status_code, reason))
+
+    def _next_request(self):
+        #
+        # Called by the worker loop after taking a request from the queue
+        #
+        if self._paused_by & _PAUSED_BY_PIPELINE:
+            self._resume_reading(_PAUSED_BY_PIPELINE)
+
+    def shutdown(self):
+        """
+        Close the connection once the responses to all requests received so far have been sent.
+
+        A connection which is idle, i.e. on which no request has arrived yet or which is waiting
+        between two requests, is closed right away. Otherwise, the response to the last request
+        received, and to every request which still comes in, carries a Connection: close header,
+        and the connection is closed once all outstanding responses have been sent. A connection
+        on which the client has sent a part of a request is not closed, as the client could not
+        tell whether its request has been processed. Instead, this request is the last one. This
+        includes data which the kernel has received but which we have not yet read
+        """
+
+        self._draining = True
+        if self._transport is None:
+            return
+        if self._websocket is not None and self._websocket.started:
+            logger.debug("Closing WebSocket")
+            self._websocket.going_away()
+            return
+        if self._state == ConnectionState.HEADER:
+            return
+        if self._outstanding == 0 and self._state == ConnectionState.PENDING:
+            if not self._unread_data():
+                logger.debug("Closing idle connection")
+                self._transport.close()
+        elif self._last_request is not None:
+            self._last_request.close_connection()
+
+    def _unread_data(self) -> bool:
+        #
+        # Check whether the socket holds data which has not been passed to us yet,
+        # for instance because reading is paused or because the event loop has
+        # not yet noticed it. Peeking does not remove the data from the socket
+        #
+        sock = self._transport.get_extra_info("socket")
+        if sock is None:
+            return False
+        peek = socket.socket(fileno=sock.fileno())
+        try:
+            return peek.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b""
+        except OSError:
+            return False
+        finally:
+            peek.detach()
+
+    def abort(self):
+        """
+        Close the connection immediately, dropping responses which are not yet sent
+        """
+
+        if self._transport is not None:
+            self._transport.abort()
+
+    def admit(self):
+        """
+        Start reading from a connection which has been parked by the admission control
+        """
+
+        logger.debug("Admitting connection")
+        self._resume_reading(_PAUSED_BY_ADMISSION)
+
+    def _pause_for_body(self):
+        self._pause_reading(_PAUSED_BY_BODY)
+
+    def _resume_for_body(self):
+        self._resume_reading(_PAUSED_BY_BODY)
+
+    def _pause_for_websocket(self):
+        self._pause_reading(_PAUSED_BY_WEBSOCKET)
+
+    def _resume_for_websocket(self):
+        self._resume_reading(_PAUSED_BY_WEBSOCKET)
 
     def get_state(self):
         """
@@ -172,11 +652,53 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
 
         return self._state
 
+    def get_queue_depth(self) -> int:
+        """
+        Return the number of requests which have been received but not yet
+        picked up by the worker loop
+        """
+
+        return self._queue.qsize()
+
     #
     # Helper method to invoke the container handler and create a response
     #
-    async def _invoke_handler(self, request: aioweb.request.HTTPToolsRequest) -> bytes:
+    async def _invoke_handler(self,
+                              request: aioweb.request.HTTPToolsRequest) -> Tuple[bytes, Any, Any]:
         assert isinstance(request, aioweb.request.HTTPToolsRequest)
+        #
+        # If we have a cache, ask the cache first. It will only invoke
+        # the handler if it does not have a response yet
+        #
+        if self._cache is not None:
+            entry, response = await self._cache.fetch(request, self._produce)
+            if entry is not None:
+                return self._encode_cached(request, entry)
+        else:
+            response = await self._produce(request)
+        status_code, result = response
+        return self._encode_response(request, status_code, result)
+
+    async def _produce(self, request: aioweb.request.HTTPToolsRequest) -> Tuple[int, Any]:
+        #
+        # Invoke the handler and compress the result if needed. We do this
+        # before the response is cached so that the cache holds compressed bodies.
+        # If too many handlers are running, we reject the request instead
+        #
+        if self._admission is None:
+            response = await self._call_handler(request)
+        elif not self._admission.acquire():
+            return 503, self._admission.response
+        else:
+            try:
+                response = await self._call_handler(request)
+            finally:
+                self._admission.release()
+        if self._compression is not None:
+            response = await self._compression.compress(request, *response)
+        return response
+
+    async def _call_handler(self, request: aioweb.request.HTTPToolsRequest) -> Tuple[int, Any]:
         #
         # Asynchronously invoke container handler for this request
         #
@@ -184,6 +706,9 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
         try:
             result = await self._container.handle_request(request)
         except aioweb.exceptions.HTTPException as exc:
+            if exc.status_code != 500:
+                logger.error("Handler failed with status %d (msg=%s)", exc.status_code, exc)
+                return exc.status_code, bytes(str(exc), "utf-8")
             msg = "Internal server error, message is %s" % exc
         except BaseException as exc: # pylint: disable=broad-except
             msg = "Unknown exception (type=%s, msg=%s) caught" % (type(exc), exc)
@@ -193,50 +718,369 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
         #
         if msg is not None:
             logger.error("Have message %s from previous error", msg)
-            result = bytes(msg, "utf-8")
-            status_code = 500
-        else:
-            status_code = 200
+            if self._metrics is not None:
+                self._metrics.handler_exceptions += 1
+            return 500, bytes(msg, "utf-8")
+        return 200, result
 
+    def _encode_cached(self, request: aioweb.request.HTTPToolsRequest,
+                       entry: aioweb.cache.CachedResponse) -> Tuple[bytes, Any, Any]:
         #
-        # If the result is not a sequence of bytes, replace it
-        # by an empty sequence unless it is a bytearray in which
-        # case we convert it
+        # Build a response from an entry of the cache, which only lacks the
+        # parts depending on the request and on the current time
         #
-        if isinstance(result, bytearray):
-            result = bytes(result)
-        if not isinstance(result, bytes):
-            logger.error("Result is not a sequence of bytes, replacing by empty string")
-            result = b""
+        parts = [
+            aioweb.response.status_line(request.http_version(), entry.status_code),
+            self._header_cache.prelude,
+            entry.header_lines,
+            b'' if request.keep_alive() else aioweb.response.CONNECTION_CLOSE,
+            entry.content_length
+            ]
+        if len(entry.body) <= _COPY_THRESHOLD:
+            parts.append(entry.body)
+            return b''.join(parts), None, None
+        return b''.join(parts), entry.body, None
+
+    def _encode_response(self, request: aioweb.request.HTTPToolsRequest,
+                         status_code: int, result: Any) -> Tuple[bytes, Any, Any]:
+        #
+        # If the handler returned a response object, take status code and
+        # headers from there and continue with its body
+        #
+        if result.__class__ is aioweb.websocket.Upgrade:
+            return self._encode_upgrade(request, result)
+        header_lines = aioweb.response.CONTENT_TYPE_TEXT
+        if isinstance(result, aioweb.response.Response):
+            status_code = result.status_code
+            header_lines = result.encoded_headers()
+            result = result.body
 
         http_version = request.http_version()
 
-        content_length = len(result)
-        response_bytes = b''.join([
-            bytes("HTTP/%s %s OK\r\n" % (http_version, status_code), "utf-8"),
-            b'Content-Type: text/plain; charset=utf-8\r\n',
-            bytes("Content-Length: %d\r\n" % content_length, "utf-8"),
-            b'\r\n',
-            result
+        #
+        # If the handler returned an asynchronous iterator, we only build the
+        # header here and let the worker loop stream the body. For HTTP 1.1, we
+        # use chunked transfer encoding, for HTTP 1.0, we close the connection
+        # to signal the end of the body
+        #
+        if hasattr(result, "__aiter__"):
+            if http_version == "1.0":
+                framing = aioweb.response.CONNECTION_CLOSE
+            elif not request.keep_alive():
+                framing = (aioweb.response.TRANSFER_ENCODING_CHUNKED
+                           + aioweb.response.CONNECTION_CLOSE)
+            else:
+                framing = aioweb.response.TRANSFER_ENCODING_CHUNKED
+            header_bytes = b''.join([
+                aioweb.response.status_line(http_version, status_code),
+                self._header_cache.prelude,
+                header_lines,
+                framing,
+                b'\r\n'
+                ])
+            return header_bytes, None, result
+
+        parts = [
+            aioweb.response.status_line(http_version, status_code),
+            self._header_cache.prelude,
+            header_lines,
+            b'' if request.keep_alive() else aioweb.response.CONNECTION_CLOSE
+            ]
+        if status_code in _NO_BODY_STATUS:
+            parts.append(b'\r\n')
+            return b''.join(parts), None, None
+
+        #
+        # A file is sent by the worker loop after the header
+        #
+        if isinstance(result, aioweb.response.FileBody):
+            parts.append(b'Content-Length: %d\r\n\r\n' % result.count)
+            return b''.join(parts), result, None
+
+        #
+        # We accept any object supporting the buffer protocol as body, like a
+        # bytearray, a memoryview or a memory mapped file. Everything apart from
+        # bytes and bytearrays is turned into a flat memoryview, which the transport
+        # can write without copying it. If the result does not support the buffer
+        # protocol, replace it by an empty sequence
+        #
+        if not isinstance(result, (bytes, bytearray)):
+            try:
+                result = memoryview(result).cast("B")
+            except TypeError:
+                logger.error("Result is not a sequence of bytes, replacing by empty string")
+                result = b""
+
+        parts.append(b'Content-Length: %d\r\n\r\n' % len(result))
+        if len(result) <= _COPY_THRESHOLD:
+            parts.append(result)
+            return b''.join(parts), None, None
+        return b''.join(parts), result, None
+
+    def _encode_upgrade(self, request: aioweb.request.HTTPToolsRequest,
+                        upgrade: aioweb.websocket.Upgrade) -> Tuple[bytes, Any, Any]:
+        #
+        # Accept the upgrade to a WebSocket if the request is a valid handshake. The
+        # session is passed on to the worker loop in place of a stream
+        #
+        key = None
+        if self._websocket is not None and request is self._last_request:
+            key = aioweb.websocket.handshake_key(request)
+        if key is None:
+            logger.error("Refusing invalid request for a WebSocket")
+            return self._encode_response(request, 400, b"Bad Request")
+        if self._draining:
+            return self._encode_response(request, 503, b"Service Unavailable")
+        header_bytes = b''.join([
+            aioweb.response.status_line(request.http_version(), 101),
+            self._header_cache.prelude,
+            b'Upgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: ',
+            aioweb.websocket.accept_key(key),
+            b'\r\n\r\n'
             ])
-        return response_bytes
+        return header_bytes, None, upgrade
+
+    async def _run_websocket(self, upgrade: aioweb.websocket.Upgrade):
+        #
+        # Run the session of an accepted WebSocket until it returns, and
+        # close the WebSocket afterwards unless the session has done so
+        #
+        websocket = self._websocket
+        assert websocket is not None
+        websocket.start(upgrade)
+        self._resume_reading(_PAUSED_BY_WEBSOCKET)
+        code = aioweb.websocket.NORMAL_CLOSURE
+        try:
+            await upgrade.session(websocket)
+        except asyncio.exceptions.CancelledError:
+            raise
+        except aioweb.exceptions.WebSocketClosed:
+            pass
+        except BaseException as exc: # pylint: disable=broad-except
+            logger.error("Got exception (type=%s, msg=%s) in WebSocket session", type(exc), exc)
+            code = aioweb.websocket.INTERNAL_ERROR
+        await websocket.close(code)
+
+    async def _write_stream(self, stream: AsyncIterator, chunked: bool) -> bool:
+        #
+        # Write the chunks produced by an asynchronous iterator into the transport
+        # as they arrive, framing them if we use chunked transfer encoding
+        #
+        try:
+            async for chunk in stream:
+                if not isinstance(chunk, (bytes, bytearray)):
+                    logger.error("Chunk is not a sequence of bytes, ignoring it")
+                    continue
+                #
+                # An empty chunk would terminate the body prematurely
+                #
+                if not chunk:
+                    continue
+                if self._transport.is_closing():
+                    logger.error("Cannot write into closing transport")
+                    return False
+                if chunked:
+                    self._transport.write(b''.join([b'%x\r\n' % len(chunk), chunk, b'\r\n']))
+                else:
+                    self._transport.write(chunk)
+                if self._metrics is not None:
+                    self._metrics.bytes_sent += len(chunk)
+                #
+                # Suspend the producer if the client cannot keep up
+                #
+                await self._drain()
+        except asyncio.exceptions.CancelledError:
+            raise
+        except BaseException as exc: # pylint: disable=broad-except
+            #
+            # We have already sent the header, so all we can do is to close
+            # the connection without terminating the body so that the client
+            # notices that something went wrong
+            #
+            logger.error("Got exception (type=%s, msg=%s) while streaming response",
+                         type(exc), exc)
+            self._transport.close()
+            return False
+        if chunked:
+            self._transport.write(b'0\r\n\r\n')
+        return True
+
+    async def _send_file(self, body: aioweb.response.FileBody) -> bool:
+        #
+        # Send a part of a file. We first try to let the kernel copy the data
+        # from the file into the socket. If the transport does not support this,
+        # for instance because it uses SSL, we fall back to mapping the file into
+        # memory. As the header has already been sent, all we can do if the file
+        # cannot be read or has been truncated in the meantime is to close the
+        # connection
+        #
+        if body.count == 0:
+            return True
+        try:
+            with open(body.path, "rb") as file:
+                try:
+                    sent = await self._loop.sendfile(self._transport, file, body.offset,
+                                                     body.count, fallback=False)
+                except (RuntimeError, NotImplementedError):
+                    sent = await self._write_mapped(file, body.offset, body.count)
+        except (OSError, ValueError) as exc:
+            logger.error("Could not send file %s (msg=%s)", body.path, exc)
+            sent = -1
+        if sent != body.count:
+            logger.error("Could not send %d bytes of %s", body.count, body.path)
+            self._transport.close()
+            return False
+        return True
+
+    async def _write_mapped(self, file, offset: int, count: int) -> int:
+        #
+        # Write a part of a file by mapping it into memory, using memoryviews
+        # so that the transport only copies what it cannot send immediately.
+        # We wait for the transport to drain after each piece so that we do
+        # not read the entire file into the write buffer
+        #
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            end = min(offset + count, len(mapped))
+            position = offset
+            while position < end:
+                if self._transport.is_closing():
+                    break
+                with memoryview(mapped) as view:
+                    self._transport.write(view[position:min(position + _FILE_CHUNK_SIZE, end)])
+                position = min(position + _FILE_CHUNK_SIZE, end)
+                await self._drain()
+            return position - offset
+        finally:
+            try:
+                mapped.close()
+            except BufferError:
+                #
+                # The transport still holds a view of the mapping, which will be
+                # closed when the view is released
+                #
+                pass
+
+    async def _handle(self, request: aioweb.request.HTTPToolsRequest) -> Tuple[bytes, Any, Any]:
+        #
+        # Invoke the handler for a request. A stream returned by the handler might still
+        # read the body of the request, so we only release the request here if the
+        # handler fails, and otherwise once the response has been written
+        #
+        if request.__class__ is _Rejection:
+            return self._encode_response(request, request.status_code, # type: ignore
+                                         bytes(request.reason, "utf-8")) # type: ignore
+        if self._metrics is None and self._access_log is None:
+            try:
+                return await self._invoke_handler(request)
+            except BaseException:
+                request.release()
+                raise
+        started = time.perf_counter()
+        response = None
+        try:
+            response = await self._invoke_handler(request)
+            return response
+        except BaseException:
+            request.release()
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            if self._metrics is not None:
+                self._metrics.requests += 1
+                self._metrics.latency.observe(duration)
+            if self._access_log is not None and response is not None:
+                self._access_log.record(request.method(), request.raw_url(), response[0],
+                                        self._count_sent(response[0], response[1]),
+                                        started, duration, self._peer)
+
+    async def _write_response(self, request: aioweb.request.HTTPToolsRequest,
+                              response_bytes: bytes, body: Any, stream: Any) -> bool:
+        #
+        # Deliver a response, consisting of the header (possibly including the body),
+        # a body which is too large to be copied into the header or a stream, and
+        # release the request afterwards. We return False if the connection cannot
+        # be used for further responses
+        #
+        try:
+            return await self._deliver(request, response_bytes, body, stream)
+        finally:
+            request.release()
+
+    async def _deliver(self, request: aioweb.request.HTTPToolsRequest,
+                       response_bytes: bytes, body: Any, stream: Any) -> bool:
+        if self._transport.is_closing():
+            logger.error("Cannot write into closing transport")
+            return False
+        try:
+            self._transport.write(response_bytes)
+            if self._metrics is not None:
+                self._metrics.bytes_sent += self._count_sent(response_bytes, body)
+            if isinstance(body, aioweb.response.FileBody):
+                if not await self._send_file(body):
+                    return False
+            elif body is not None:
+                #
+                # We do not use writelines here, as the transports of asyncio
+                # join the buffers before writing them, i.e. copy the body.
+                # A second write only copies what the socket does not take
+                # immediately
+                #
+                self._transport.write(body)
+            if stream.__class__ is aioweb.websocket.Upgrade:
+                await self._run_websocket(stream)
+                return False
+            keep_alive = request.keep_alive()
+            if stream is not None:
+                chunked = request.http_version() != "1.0"
+                if not await self._write_stream(stream, chunked):
+                    return False
+                keep_alive = keep_alive and chunked
+            #
+            # Close transport if needed. If we are shutting down, the last
+            # outstanding response is the last one we send, unless the client
+            # has already started to send the next request
+            #
+            self._outstanding -= 1
+            if not keep_alive or (self._draining and self._outstanding == 0
+                                  and self._state == ConnectionState.PENDING):
+                self._transport.close()
+            else:
+                await self._drain()
+        except asyncio.exceptions.CancelledError:
+            raise
+        except BaseException as exc: # pylint: disable=broad-except
+            logger.error("Got unexpected error (type=%s, msg=%s", type(exc), exc)
+        return True
+
+    @staticmethod
+    def _count_sent(response_bytes: bytes, body: Any) -> int:
+        sent = len(response_bytes)
+        if isinstance(body, aioweb.response.FileBody):
+            sent += body.count
+        elif body is not None:
+            sent += len(body)
+        return sent
 
     async def _worker_loop(self):
         #
         # This loop needs to run for the entire
         # duration of the connection
         #
+        if self._pipeline_concurrency > 1:
+            await self._pipelined_worker_loop()
+            return
         while True:
             #
             # Wait for the next request in the queue
             #
             try:
                 request = await self._queue.get()
+                self._next_request()
                 #
                 # Invoke container handler and prepare response
                 #
-                response_bytes = await self._invoke_handler(request)
-                logger.debug("Writing %s", response_bytes.decode("utf-8"))
+                response_bytes, body, stream = await self._handle(request)
             except asyncio.exceptions.CancelledError:
                 #
                 # If the connection has been closed in the meantime (before we get scheduled again),
@@ -247,20 +1091,66 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
             #
             # Deliver response
             #
-            if self._transport.is_closing():
-                logger.error("Cannot write into closing transport")
+            if not await self._write_response(request, response_bytes, body, stream):
                 return
-            try:
-                self._transport.write(response_bytes)
+
+    async def _pipelined_worker_loop(self):
+        #
+        # A variant of the worker loop which runs the handlers for up to
+        # pipeline_concurrency requests concurrently. The deque pending
+        # holds the requests whose responses have not yet been written,
+        # in the order in which they have been received, along with the
+        # tasks running their handlers. It acts as a reorder buffer - we
+        # only ever write the response for the request at its head
+        #
+        pending = collections.deque() # type: Deque[Tuple[Any, asyncio.Task]]
+        getter = None # type: Optional[asyncio.Task]
+        try:
+            while True:
+                #
+                # Start handlers for all requests which are already queued, and
+                # if there is still room, wait for the next request as well
                 #
-                # Close transport if needed
+                while len(pending) < self._pipeline_concurrency and not self._queue.empty():
+                    request = self._queue.get_nowait()
+                    self._next_request()
+                    pending.append((request, asyncio.create_task(self._handle(request))))
+                if getter is None and len(pending) < self._pipeline_concurrency:
+                    getter = asyncio.create_task(self._queue.get())
+                waiting_for = [pending[0][1]] if pending else []
+                if getter is not None:
+                    waiting_for.append(getter)
+                await asyncio.wait(waiting_for, return_when=asyncio.FIRST_COMPLETED)
+                if getter is not None and getter.done():
+                    request = getter.result()
+                    self._next_request()
+                    getter = None
+                    pending.append((request, asyncio.create_task(self._handle(request))))
                 #
-                if not request.keep_alive():
-                    self._transport.close()
-            except BaseException as exc: # pylint: disable=broad-except
-                logger.error("Got unexpected error (type=%s, msg=%s", type(exc), exc)
+                # Write all responses which are ready and not held back by an
+                # earlier response
+                #
+                while pending and pending[0][1].done():
+                    request, task = pending.popleft()
+                    response_bytes, body, stream = task.result()
+                    if not await self._write_response(request, response_bytes, body, stream):
+                        return
+        finally:
+            if getter is not None:
+                getter.cancel()
+            for request, task in pending:
+                task.cancel()
+                request.release()
+
+    def idle_timeout(self):
+        """
+        Signal that the connection has been idle for too long.
 
+        This is invoked by the timer wheel of the container and closes the connection,
+        or sends a ping if the connection is a WebSocket
+        """
 
+        self._do_timeout()
 
     #
     # This will be called by the event loop when a timeout is scheduled.
@@ -271,6 +1161,27 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
         # in a CancelledError being raised, and close the transport
         #
         logger.debug("Timeout fired")
+        #
+        # A WebSocket may well be idle for longer, so we only check that the client is
+        # still there. If it does not send anything, not even the pong, until the
+        # next timeout, we close the connection and let the session finish
+        #
+        if self._websocket is not None and self._websocket.started:
+            if self._ping_sent:
+                if self._metrics is not None:
+                    self._metrics.timeouts += 1
+                self._transport.close()
+                return
+            self._websocket.ping()
+            self._ping_sent = True
+            if self._timer_wheel is not None:
+                self._timer_wheel.add(self)
+            else:
+                self._timeout_handler = self._loop.call_later(self._timeout_seconds,
+                                                              self._do_timeout)
+            return
+        if self._metrics is not None:
+            self._metrics.timeouts += 1
         if self._current_task is not None:
             self._current_task.cancel()
             self._transport.close()
@@ -288,63 +1199,76 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
         """
 
         #
-        # Reset parser
+        # Reset the connection state. We keep the parser, as the next pipelined
+        # message might already be part of the data which it currently parses
         #
-        self._parser = None
         self._state = ConnectionState.PENDING
-        self._headers = {}
+        self._headers = aioweb.headers.Headers()
         #
-        # Complete the future representing the full body of the
-        # currently parsed message
+        # Signal the end of the body to the currently parsed request. This will
+        # complete the future representing the full body of the message
         #
-        if self._body_future is None:
-            logger.error("Could not locate valid future for body completion")
+        if self._request is None:
+            logger.error("Could not locate valid request for body completion")
         else:
-            if self._body is None:
-                self._body_future.set_result(b"")
-            else:
-                self._body_future.set_result(self._body)
-        #
-        # Reset body and parser
-        #
-        self._body = None
-        self._parser = None
-        self._body_future = None
+            self._request.feed_eof()
+        self._request = None
 
 
+    def on_url(self, url):
+        """
+        Receive a part of the URL of a request.
+
+        Called by the parser when it has parsed (a part of) the URL in the request line. As
+        the URL might be split across several packets, we collect the parts
+        """
+
+        self._url += url
+        if self._max_header_bytes is not None:
+            self._header_bytes += len(url)
+            if self._header_bytes > self._max_header_bytes:
+                raise _Rejected(431, "Request Header Fields Too Large")
+
     def on_header(self, key, value):
         """
         Signal a new HTTP request header.
 
         Called by the parser when a header line is received, passing bytes. This method
-        simply adds the received header to an internal dictionary of detected headers
+        simply appends the received header to the headers of the current request, without
+        decoding it
         """
 
         self._state = ConnectionState.HEADER
-        if key is not None:
-            key_str = key.decode("utf-8")
-            if len(key_str) > 0:
-                self._headers[key_str] = value
+        if key:
+            self._headers.add(key, value)
+        if self._max_header_bytes is not None:
+            self._header_bytes += len(key) + len(value)
+            if self._header_bytes > self._max_header_bytes:
+                raise _Rejected(431, "Request Header Fields Too Large")
 
     def on_body(self, data):
         """
         Receive a part of a HTTP request body.
 
-        This method is called by the parser when a piece of the body comes in
-        We simply append the body part to the existing body data
+        This method is called by the parser when a piece of the body comes in.
+        We hand the body part over to the request currently being parsed which
+        will buffer it until the handler consumes it
         """
 
-        if self._body is None:
-            self._body = bytearray()
-        self._body.extend(data)
+        if self._max_body_bytes is not None:
+            self._body_bytes += len(data)
+            if self._body_bytes > self._max_body_bytes:
+                raise _Rejected(413, "Request Entity Too Large")
+        if self._request is not None:
+            self._request.feed_data(data)
 
 
-    def get_headers(self) -> dict:
+    def get_headers(self) -> aioweb.headers.Headers:
         """
         Get all collected HTTP request headers.
 
-        This returns the currently collected headers as a dictionary. The keys are built assuming
-        UTF-8 encoding
+        This returns the currently collected headers as a case-insensitive mapping
+        of header names to values
         """
 
         return self._headers
@@ -359,14 +1283,37 @@ class HttpProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attrib
         """
 
         logger.debug("Header complete")
+        self._header_bytes = 0
+        self._body_bytes = 0
+        #
+        # If the client announces a body which is too large, reject the
+        # request right away instead of waiting for the body
+        #
+        if self._max_body_bytes is not None:
+            length = self._headers.get("Content-Length")
+            if length is not None and length.isdigit() and int(length) > self._max_body_bytes:
+                raise _Rejected(413, "Request Entity Too Large")
         #
         # Build a request object and release handler task to
         # signal that a new header has arrived
         #
-        self._body_future = asyncio.Future()
-        request = aioweb.request.HTTPToolsRequest(future=self._body_future,
+        method = self._parser.get_method()
+        request = aioweb.request.HTTPToolsRequest(future=asyncio.Future(),
                                                   headers=self.get_headers(),
                                                   http_version=self._parser.get_http_version(),
-                                                  keep_alive=self._parser.should_keep_alive())
+                                                  keep_alive=(self._parser.should_keep_alive()
+                                                              and not self._draining),
+                                                  method=_METHODS.get(method) or method.decode(),
+                                                  url=self._url,
+                                                  body_window=self._body_window,
+                                                  pause_reading=self._pause_for_body,
+                                                  resume_reading=self._resume_for_body)
+        self._request = request
+        self._last_request = request
+        self._url = b""
+        self._outstanding += 1
         self._queue.put_nowait(request)
+        if (self._max_pipeline_depth is not None
+                and self._queue.qsize() >= self._max_pipeline_depth):
+            self._pause_reading(_PAUSED_BY_PIPELINE)
         self._state = ConnectionState.BODY
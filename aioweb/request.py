@@ -4,6 +4,15 @@ This module contains classes describing a HTTP request received by the container
 
 import abc
 import asyncio
+import collections
+import multiprocessing.resource_tracker
+import multiprocessing.shared_memory
+import urllib.parse
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional
+
+import httptools # type: ignore
+
+import aioweb.headers
 
 
 class Request:
@@ -11,6 +20,7 @@ class Request:
     This class represents a HTTP request received by the container
     """
 
+    __slots__ = ()
 
     @abc.abstractmethod
     async def body(self) -> bytes:
@@ -19,9 +29,24 @@ class Request:
         """
 
     @abc.abstractmethod
-    def headers(self) -> dict:
+    def body_nowait(self) -> bytes:
+        """
+        Return the body of the request if it has already been received completely,
+        otherwise raise an asyncio.InvalidStateError. This is meant for handlers which
+        are not coroutines and therefore cannot wait for the body
+        """
+
+    @abc.abstractmethod
+    def stream(self) -> AsyncIterator[bytes]:
+        """
+        Return an asynchronous iterator which yields the body of the request
+        chunk by chunk as it is received
+        """
+
+    @abc.abstractmethod
+    def headers(self) -> aioweb.headers.Headers:
         """
-        Return a dictionary containing the headers as a dictionary
+        Return the headers as a case-insensitive mapping from names to values
         """
 
     @abc.abstractmethod
@@ -30,33 +55,160 @@ class Request:
         Return the HTTP version as a string
         """
 
+    @abc.abstractmethod
+    def method(self) -> str:
+        """
+        Return the HTTP method, like GET or POST
+        """
+
+    @abc.abstractmethod
+    def url(self) -> str:
+        """
+        Return the URL of the request as it appears in the request line
+        """
+
+    @abc.abstractmethod
+    def path(self) -> str:
+        """
+        Return the path component of the URL, without percent-decoding
+        """
+
+    @abc.abstractmethod
+    def query(self) -> Dict[str, List[str]]:
+        """
+        Return the decoded query string as a dictionary, mapping each name to the
+        list of values given for it
+        """
+
     @abc.abstractmethod
     def keep_alive(self) -> bool:
         """
         Return true if we want to keep the connection open
         """
 
+#
+# The ways in which the body of a request can be consumed
+#
+_UNDECIDED = 0          # The handler has not yet asked for the body
+_BUFFER = 1             # The handler waits for the full body
+_STREAM = 2             # The handler iterates over the body chunks
+
+class _RawURL: # pylint: disable=too-few-public-methods
+    #
+    # Used instead of the result of httptools.parse_url if the
+    # URL cannot be parsed
+    #
+    __slots__ = ['path', 'query']
+
+    def __init__(self, url: bytes) -> None:
+        self.path = url
+        self.query = None
 
-class HTTPToolsRequest(Request):
+
+def _parse_url(url: bytes):
+    try:
+        return httptools.parse_url(url) # pylint: disable=no-member
+    except httptools.HttpParserInvalidURLError: # pylint: disable=no-member
+        #
+        # This happens for instance for an asterisk as used with OPTIONS,
+        # so we treat the entire URL as path
+        #
+        return _RawURL(url)
+
+
+def _decode_path(parsed_url) -> str:
+    path = parsed_url.path
+    return path.decode("utf-8", "replace") if path else "/"
+
+
+def _decode_query(parsed_url) -> Dict[str, List[str]]:
+    query = parsed_url.query
+    if not query:
+        return {}
+    return urllib.parse.parse_qs(query.decode("utf-8", "replace"), keep_blank_values=True)
+
+
+class HTTPToolsRequest(Request): # pylint: disable=too-many-instance-attributes
     """
     An implementation of the abstract Request class using the HttpTools library
+
+    Body chunks are handed over by the protocol using feed_data and feed_eof. If more than
+    body_window bytes are buffered and not yet consumed by the handler, the callable
+    pause_reading is invoked, and resume_reading is invoked once the handler has caught up
+    again. A handler which awaits the full body will of course disable this mechanism.
+
+    The URL is kept as the raw bytes received from the parser. It is only parsed when path or query
+    are called for the first time, and the results are cached, so that a handler which does not
+    look at the query string does not pay for decoding it.
     """
 
-    def __init__(self, future: asyncio.Future,
-                 headers: dict = None,
+    __slots__ = ['_future', '_headers', '_http_version', '_keep_alive', '_method', '_url',
+                 '_parsed_url', '_path', '_query', '_body_window', '_pause_reading',
+                 '_resume_reading', '_chunks', '_buffered', '_eof', '_paused', '_mode',
+                 '_waiter', '_error']
+
+    def __init__(self, future: asyncio.Future, # pylint: disable=too-many-arguments
+                 headers: Optional[aioweb.headers.Headers] = None,
                  http_version: str = "1.1",
-                 keep_alive: bool = True) -> None:
+                 keep_alive: bool = True,
+                 method: str = "GET",
+                 url: bytes = b"/",
+                 body_window: int = 65536,
+                 pause_reading: Optional[Callable[[], None]] = None,
+                 resume_reading: Optional[Callable[[], None]] = None) -> None:
         self._future = future
         self._headers = headers
         self._http_version = http_version
         self._keep_alive = keep_alive
+        self._method = method
+        self._url = url
+        self._parsed_url = None
+        self._path = None # type: Optional[str]
+        self._query = None # type: Optional[Dict[str, List[str]]]
+        self._body_window = body_window
+        self._pause_reading = pause_reading
+        self._resume_reading = resume_reading
+        self._chunks = collections.deque() # type: Deque[bytes]
+        self._buffered = 0
+        self._eof = False
+        self._paused = False
+        self._mode = _UNDECIDED
+        self._waiter = None # type: Optional[asyncio.Future]
+        self._error = None # type: Optional[BaseException]
 
     async def body(self) -> bytes:
+        if self._mode == _UNDECIDED:
+            self._mode = _BUFFER
+            self._resume()
         return await self._future
 
-    def headers(self) -> dict:
+    def body_nowait(self) -> bytes:
+        return self._future.result()
+
+    async def stream(self) -> AsyncIterator[bytes]: # pylint: disable=invalid-overridden-method
+        if self._mode == _UNDECIDED:
+            self._mode = _STREAM
+        while True:
+            if self._chunks:
+                chunk = self._chunks.popleft()
+                self._buffered -= len(chunk)
+                if self._buffered < self._body_window:
+                    self._resume()
+                yield chunk
+            elif self._eof:
+                if self._error is not None:
+                    raise self._error
+                return
+            else:
+                self._waiter = self._future.get_loop().create_future()
+                try:
+                    await self._waiter
+                finally:
+                    self._waiter = None
+
+    def headers(self) -> aioweb.headers.Headers:
         if self._headers is None:
-            return {}
+            self._headers = aioweb.headers.Headers()
         return self._headers
 
     def http_version(self) -> str:
@@ -64,3 +216,246 @@ class HTTPToolsRequest(Request):
 
     def keep_alive(self) -> bool:
         return self._keep_alive
+
+    def method(self) -> str:
+        return self._method
+
+    def url(self) -> str:
+        return self._url.decode("utf-8", "replace")
+
+    def raw_url(self) -> bytes:
+        """
+        Return the URL as received from the parser, without decoding it
+        """
+
+        return self._url
+
+    def path(self) -> str:
+        if self._path is None:
+            self._path = _decode_path(self._get_parsed_url())
+        return self._path
+
+    def query(self) -> Dict[str, List[str]]:
+        if self._query is None:
+            self._query = _decode_query(self._get_parsed_url())
+        return self._query
+
+    def _get_parsed_url(self):
+        if self._parsed_url is None:
+            self._parsed_url = _parse_url(self._url)
+        return self._parsed_url
+
+    def snapshot(self, shared_memory_threshold: Optional[int] = None) -> "RequestSnapshot":
+        """
+        Return a copy of this request which can be pickled, for instance to hand it over to
+        a different process. The body needs to be complete. If it is at least as large as
+        shared_memory_threshold, it is placed in a shared memory block instead of being part
+        of the pickled snapshot
+        """
+
+        return RequestSnapshot(method=self._method, url=self._url,
+                               http_version=self._http_version, keep_alive=self._keep_alive,
+                               headers=self.headers(), body=self.body_nowait(),
+                               shared_memory_threshold=shared_memory_threshold)
+
+    def feed_data(self, data: bytes):
+        """
+        Add a chunk of the body, called by the protocol when the parser has
+        delivered a part of the body
+        """
+
+        self._chunks.append(data)
+        self._buffered += len(data)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        if self._mode != _BUFFER and self._buffered >= self._body_window:
+            self._pause()
+
+    def feed_eof(self):
+        """
+        Signal that the body is complete. This will complete the future on
+        which body() is waiting
+        """
+
+        self._eof = True
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        if self._mode == _STREAM:
+            self._future.set_result(b"")
+            return
+        self._future.set_result(b"".join(self._chunks))
+        #
+        # If the handler did not yet decide how to consume the body, keep
+        # the chunks so that it can still use stream()
+        #
+        if self._mode == _BUFFER:
+            self._chunks.clear()
+            self._buffered = 0
+
+    def close_connection(self):
+        """
+        Ask for the connection to be closed after the response to this request, called by
+        the protocol when the container shuts down
+        """
+
+        self._keep_alive = False
+
+    def fail(self, exc: BaseException):
+        """
+        Signal that the body cannot be received completely, for instance because it is too
+        large. A handler waiting for the body or iterating over it receives the exception exc,
+        and the connection is closed after the response has been sent
+        """
+
+        self._eof = True
+        self._error = exc
+        self._keep_alive = False
+        self._chunks.clear()
+        self._buffered = 0
+        self._resume()
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        if not self._future.done():
+            self._future.set_exception(exc)
+            #
+            # Avoid a warning about an exception which is never retrieved
+            # if the handler does not look at the body
+            #
+            self._future.exception()
+
+    def release(self):
+        """
+        Signal that the handler is done. As nobody will consume the remaining parts
+        of the body any more, we stop to apply backpressure
+        """
+
+        if not self._eof:
+            self._mode = _BUFFER
+            self._resume()
+        else:
+            self._chunks.clear()
+            self._buffered = 0
+
+    def _pause(self):
+        if not self._paused and self._pause_reading is not None:
+            self._paused = True
+            self._pause_reading()
+
+    def _resume(self):
+        if self._paused:
+            self._paused = False
+            self._resume_reading() # type: ignore
+
+
+class RequestSnapshot(Request): # pylint: disable=too-many-instance-attributes
+    """
+    A complete request, including its body, which can be pickled.
+
+    This is what handlers running in a different process receive. A body which is at least
+    shared_memory_threshold bytes long is copied into a block of shared memory, and only the
+    name of this block is pickled, so that the body is not pushed through a pipe. The creator of
+    the snapshot owns the block and needs to call release once the snapshot is not needed any
+    more, which also frees the block. The receiving side attaches to the block when the body is
+    requested for the first time.
+    """
+
+    __slots__ = ['_method', '_url', '_http_version', '_keep_alive', '_headers', '_body',
+                 '_shm', '_shm_name', '_shm_size', '_parsed_url']
+
+    def __init__(self, method: str, url: bytes, # pylint: disable=too-many-arguments
+                 http_version: str, keep_alive: bool,
+                 headers: aioweb.headers.Headers, body: bytes,
+                 shared_memory_threshold: Optional[int] = None) -> None:
+        self._method = method
+        self._url = url
+        self._http_version = http_version
+        self._keep_alive = keep_alive
+        self._headers = headers
+        self._parsed_url = None
+        self._shm = None # type: Any
+        self._shm_name = None # type: Optional[str]
+        self._shm_size = 0
+        if shared_memory_threshold is not None and len(body) >= shared_memory_threshold:
+            self._shm = multiprocessing.shared_memory.SharedMemory(create=True, size=len(body))
+            self._shm.buf[:len(body)] = body
+            self._shm_name = self._shm.name
+            self._shm_size = len(body)
+            self._body = None # type: Optional[bytes]
+        else:
+            self._body = body
+
+    def __getstate__(self):
+        return (self._method, self._url, self._http_version, self._keep_alive,
+                self._headers, self._body, self._shm_name, self._shm_size)
+
+    def __setstate__(self, state):
+        (self._method, self._url, self._http_version, self._keep_alive,
+         self._headers, self._body, self._shm_name, self._shm_size) = state
+        self._shm = None
+        self._parsed_url = None
+
+    async def body(self) -> bytes:
+        return self.body_nowait()
+
+    def body_nowait(self) -> bytes:
+        if self._body is None:
+            self._body = self._read_shared_memory()
+        return self._body
+
+    async def stream(self) -> AsyncIterator[bytes]: # pylint: disable=invalid-overridden-method
+        body = self.body_nowait()
+        if body:
+            yield body
+
+    def headers(self) -> aioweb.headers.Headers:
+        return self._headers
+
+    def http_version(self) -> str:
+        return self._http_version
+
+    def keep_alive(self) -> bool:
+        return self._keep_alive
+
+    def method(self) -> str:
+        return self._method
+
+    def url(self) -> str:
+        return self._url.decode("utf-8", "replace")
+
+    def path(self) -> str:
+        return _decode_path(self._get_parsed_url())
+
+    def query(self) -> Dict[str, List[str]]:
+        return _decode_query(self._get_parsed_url())
+
+    def release(self):
+        """
+        Free the shared memory block holding the body, called by the creator
+        of the snapshot
+        """
+
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def _get_parsed_url(self):
+        if self._parsed_url is None:
+            self._parsed_url = _parse_url(self._url)
+        return self._parsed_url
+
+    def _read_shared_memory(self) -> bytes:
+        if self._shm is not None:
+            return bytes(self._shm.buf[:self._shm_size])
+        shm = multiprocessing.shared_memory.SharedMemory(name=self._shm_name)
+        #
+        # Attaching to a block registers it with the resource tracker, which would
+        # then remove it when this process exits, although it is owned by the creator
+        # of the snapshot, see https://bugs.python.org/issue39959
+        #
+        name = shm._name # type: ignore # pylint: disable=protected-access
+        multiprocessing.resource_tracker.unregister(name, "shared_memory")
+        try:
+            return bytes(shm.buf[:self._shm_size])
+        finally:
+            shm.close()
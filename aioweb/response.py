@@ -0,0 +1,164 @@
+"""
+This module contains helpers to build HTTP responses. To keep the cost of a response low,
+everything which does not depend on the individual response is encoded once and cached.
+"""
+
+import email.utils
+import http
+import time
+from typing import Any, Dict, Optional, Tuple
+
+#
+# Pre-encoded header lines which are used for many responses
+#
+CONTENT_TYPE_TEXT = b'Content-Type: text/plain; charset=utf-8\r\n'
+TRANSFER_ENCODING_CHUNKED = b'Transfer-Encoding: chunked\r\n'
+CONNECTION_CLOSE = b'Connection: close\r\n'
+
+SERVER_NAME = "aioweb"
+
+_status_lines = {} # type: Dict[Tuple[str, int], bytes]
+
+def status_line(http_version: str, status_code: int) -> bytes:
+    """
+    Return the encoded status line for the given HTTP version and status code,
+    including the terminating CRLF
+    """
+
+    try:
+        return _status_lines[(http_version, status_code)]
+    except KeyError:
+        pass
+    try:
+        reason = http.HTTPStatus(status_code).phrase
+    except ValueError:
+        reason = "Unknown"
+    line = bytes("HTTP/%s %d %s\r\n" % (http_version, status_code, reason), "ascii")
+    _status_lines[(http_version, status_code)] = line
+    return line
+
+#
+# Fill the cache with the status codes that we expect to see most often
+#
+for _version in ("1.0", "1.1"):
+    for _status in http.HTTPStatus:
+        status_line(_version, _status.value)
+
+
+class HeaderCache:
+    """
+    A cache for the Date and Server headers which are part of every response.
+
+    The Date header only changes once per second, so there is no need to format it for every
+    response. If the cache has been started, a single timer refreshes the encoded headers once per
+    second, so that the attribute prelude can be used without any further checks. If the cache
+    is used without being started, prelude checks the clock and refreshes itself if needed
+    """
+
+    __slots__ = ['_prelude', '_second', '_loop', '_handle']
+
+    def __init__(self) -> None:
+        self._prelude = b""
+        self._second = 0
+        self._loop = None
+        self._handle = None
+        self._refresh()
+
+    def start(self, loop):
+        """
+        Start refreshing the cache once per second using a timer of the given loop
+        """
+
+        self._loop = loop
+        self._refresh()
+        self._schedule()
+
+    def stop(self):
+        """
+        Stop the timer refreshing the cache
+        """
+
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    @property
+    def prelude(self) -> bytes:
+        """
+        The encoded Date and Server headers, including the terminating CRLF
+        """
+
+        if self._handle is None and int(time.time()) != self._second:
+            self._refresh()
+        return self._prelude
+
+    def _schedule(self):
+        #
+        # Fire shortly after the next full second
+        #
+        delay = self._second + 1 - time.time()
+        self._handle = self._loop.call_later(max(delay, 0), self._on_timer) # type: ignore
+
+    def _on_timer(self):
+        self._refresh()
+        self._schedule()
+
+    def _refresh(self):
+        now = time.time()
+        self._second = int(now)
+        self._prelude = bytes("Date: %s\r\nServer: %s\r\n" % (
+            email.utils.formatdate(self._second, usegmt=True), SERVER_NAME), "ascii")
+
+
+class Response: # pylint: disable=too-few-public-methods
+    """
+    A response which a handler can return if it needs more control than returning a sequence of
+    bytes gives it, for instance to set a status code or additional headers.
+
+    The body can be anything a handler could return directly, i.e. a sequence of bytes or an
+    asynchronous iterator. Headers are given as a dictionary mapping names to values. The encoded
+    headers are cached, so that a response can be built once and returned many times, as long as
+    its headers and its content type are not changed after it has been sent for the first time.
+    """
+
+    __slots__ = ['body', 'status_code', 'headers', 'content_type', '_encoded_headers']
+
+    def __init__(self, body: Any = b"", status_code: int = 200,
+                 headers: Optional[Dict[str, str]] = None,
+                 content_type: str = "text/plain; charset=utf-8") -> None:
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers
+        self.content_type = content_type
+        self._encoded_headers = None # type: Optional[bytes]
+
+    def encoded_headers(self) -> bytes:
+        """
+        Return the content type and the additional headers of this response
+        encoded as header lines
+        """
+
+        if self._encoded_headers is None:
+            lines = [bytes("Content-Type: %s\r\n" % self.content_type, "latin-1")]
+            if self.headers:
+                for name, value in self.headers.items():
+                    lines.append(bytes("%s: %s\r\n" % (name, value), "latin-1"))
+            self._encoded_headers = b"".join(lines)
+        return self._encoded_headers
+
+
+class FileBody: # pylint: disable=too-few-public-methods
+    """
+    A body which consists of count bytes of the file at path, starting at offset.
+
+    When a response has a body of this type, the protocol does not read the file, but lets the
+    kernel copy the data directly from the file into the socket using loop.sendfile. If the
+    transport does not support this, the file is mapped into memory and written from there
+    """
+
+    __slots__ = ['path', 'offset', 'count']
+
+    def __init__(self, path: str, offset: int = 0, count: int = 0) -> None:
+        self.path = path
+        self.offset = offset
+        self.count = count
@@ -0,0 +1,106 @@
+"""
+This module contains the functions which hand the listening socket of a container over
+to a new process, so that the container can be restarted without refusing connections
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import subprocess
+import sys
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+#
+# The environment variables through which a process learns the descriptor of the
+# listening socket it inherits and the descriptor of the pipe to report readiness
+#
+LISTEN_FD = "AIOWEB_LISTEN_FD"
+READY_FD = "AIOWEB_READY_FD"
+
+
+def inherited_socket() -> Optional[socket.socket]:
+    """
+    Return the listening socket handed over by the process which started us,
+    or None if we have not been started to take over a socket
+    """
+
+    fd = os.environ.pop(LISTEN_FD, None)
+    if fd is None:
+        return None
+    logger.debug("Taking over listening socket %s", fd)
+    return socket.socket(fileno=int(fd))
+
+
+def notify_ready():
+    """
+    Tell the process which started us that we are serving requests, so that it can stop.
+    This has no effect if we have not been started to take over a socket
+    """
+
+    fd = os.environ.pop(READY_FD, None)
+    if fd is None:
+        return
+    try:
+        os.write(int(fd), b"1")
+    except OSError:
+        #
+        # Our predecessor has given up on us already
+        #
+        logger.error("Could not report readiness")
+    finally:
+        os.close(int(fd))
+
+
+async def spawn_successor(sock: socket.socket, command: Optional[List[str]] = None,
+                          timeout: float = 30.0) -> bool:
+    """
+    Start a new process running command (by default, the command line of this process) which
+    inherits the listening socket sock, and wait until it reports that it is ready. Return True
+    if it is ready within timeout seconds, otherwise stop it and return False
+    """
+
+    if command is None:
+        command = [sys.executable] + sys.argv
+    loop = asyncio.get_running_loop()
+    read_fd, write_fd = os.pipe()
+    env = dict(os.environ)
+    env[LISTEN_FD] = str(sock.fileno())
+    env[READY_FD] = str(write_fd)
+    try:
+        process = subprocess.Popen(command, env=env, # pylint: disable=consider-using-with
+                                   pass_fds=(sock.fileno(), write_fd))
+    except OSError:
+        logger.exception("Could not start successor process")
+        os.close(read_fd)
+        return False
+    finally:
+        #
+        # Only the successor writes to the pipe, so that we see the end of the
+        # file if it exits without reporting readiness
+        #
+        os.close(write_fd)
+    logger.info("Started successor process %d", process.pid)
+    waiter = loop.create_future()
+
+    def on_readable():
+        if not waiter.done():
+            waiter.set_result(os.read(read_fd, 1))
+
+    loop.add_reader(read_fd, on_readable)
+    try:
+        ready = await asyncio.wait_for(waiter, timeout)
+    except asyncio.TimeoutError:
+        ready = b""
+    finally:
+        loop.remove_reader(read_fd)
+        os.close(read_fd)
+    if ready:
+        logger.info("Successor process %d is ready", process.pid)
+        return True
+    logger.error("Successor process %d did not become ready, stopping it", process.pid)
+    process.terminate()
+    await loop.run_in_executor(None, process.wait)
+    return False
@@ -0,0 +1,182 @@
+"""
+This module contains a router which maps the method and path of a request to a handler
+"""
+
+import urllib.parse
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import aioweb.response
+
+#
+# Responses returned by the routing container if no route matches. These are built
+# once, so that the encoded headers are cached as well
+#
+NOT_FOUND = aioweb.response.Response(b"Not Found", status_code=404)
+
+#
+# The types which can be used for path parameters. Each type is mapped to a function which
+# converts a path segment into the value of the parameter and raises a ValueError if the
+# segment is not valid for this type. The position in this dictionary determines the order in
+# which parameters of different types are tried when matching a segment
+#
+CONVERTERS = {
+    "int": int,
+    "float": float,
+    "str": str,
+} # type: Dict[str, Callable[[str], Any]]
+
+
+def _param_order(param) -> int:
+    return list(CONVERTERS).index(param[1])
+
+
+class Route: # pylint: disable=too-few-public-methods
+    """
+    The handlers registered for one path pattern, one per HTTP method.
+
+    For every route, we keep a pre-built response with status code 405, which is returned if the
+    path matches but there is no handler for the method of the request.
+    """
+
+    __slots__ = ['pattern', 'handlers', 'method_not_allowed']
+
+    def __init__(self, pattern: str) -> None:
+        self.pattern = pattern
+        self.handlers = {} # type: Dict[str, Any]
+        self.method_not_allowed = aioweb.response.Response(b"Method Not Allowed",
+                                                           status_code=405)
+
+    def add_handler(self, method: str, handler):
+        """
+        Register a handler for the given method
+        """
+
+        self.handlers[method.upper()] = handler
+        self.method_not_allowed = aioweb.response.Response(
+            b"Method Not Allowed", status_code=405,
+            headers={"Allow": ", ".join(sorted(self.handlers))})
+
+
+class _Node: # pylint: disable=too-few-public-methods
+    #
+    # A node of the tree. Every node represents one segment of a path pattern. The children
+    # are split into static children, which we look up by the segment, parameter children,
+    # which we try in turn, and at most one catch-all parameter of type path, which matches
+    # the remainder of the path
+    #
+
+    __slots__ = ['static', 'params', 'catch_all', 'route']
+
+    def __init__(self) -> None:
+        self.static = {} # type: Dict[str, _Node]
+        self.params = [] # type: List[Tuple[str, str, Callable[[str], Any], _Node]]
+        self.catch_all = None # type: Optional[Tuple[str, Route]]
+        self.route = None # type: Optional[Route]
+
+
+class Router:
+    """
+    A router which maps a path to a route, i.e. to a set of handlers by method.
+
+    Path patterns consist of segments separated by slashes. A segment is either static or a
+    parameter written as {name} or {name:type}, where type is one of int, float, str (the
+    default) or path. A parameter of type path matches the remainder of the path, including
+    slashes, and therefore needs to be the last segment of a pattern. Thus /users/{id:int}/posts
+    matches /users/17/posts, passing the parameter id with value 17.
+
+    The patterns are compiled into a tree with one level per segment when they are added. To match
+    a path, we split it into segments and walk down the tree, looking up static segments in a
+    dictionary, so that the cost of a match depends on the length of the path and not on the
+    number of routes. Static segments take precedence over parameters, and parameters are tried
+    in the order of CONVERTERS.
+    """
+
+    __slots__ = ['_root', '_routes']
+
+    def __init__(self) -> None:
+        self._root = _Node()
+        self._routes = {} # type: Dict[str, Route]
+
+    def add_route(self, method: str, pattern: str, handler):
+        """
+        Register a handler for the given method and path pattern
+        """
+
+        if not pattern.startswith("/"):
+            raise ValueError("Pattern %s does not start with a slash" % pattern)
+        route = self._routes.get(pattern)
+        if route is None:
+            route = Route(pattern)
+            self._insert(pattern, route)
+            self._routes[pattern] = route
+        route.add_handler(method, handler)
+
+    def _insert(self, pattern: str, route: Route):
+        node = self._root
+        segments = pattern.split("/")[1:]
+        for index, segment in enumerate(segments):
+            if not (segment.startswith("{") and segment.endswith("}")):
+                node = node.static.setdefault(segment, _Node())
+                continue
+            name, _, kind = segment[1:-1].partition(":")
+            kind = kind or "str"
+            if kind == "path":
+                if index != len(segments) - 1:
+                    raise ValueError("Parameter %s in %s is not the last segment" % (name, pattern))
+                if node.catch_all is not None:
+                    raise ValueError("Conflicting catch-all parameter in %s" % pattern)
+                node.catch_all = (name, route)
+                return
+            if kind not in CONVERTERS:
+                raise ValueError("Unknown parameter type %s in %s" % (kind, pattern))
+            for other_name, other_kind, _, child in node.params:
+                if other_kind == kind:
+                    if other_name != name:
+                        raise ValueError("Conflicting parameter names %s and %s in %s"
+                                         % (other_name, name, pattern))
+                    node = child
+                    break
+            else:
+                child = _Node()
+                node.params.append((name, kind, CONVERTERS[kind], child))
+                node.params.sort(key=_param_order)
+                node = child
+        node.route = route
+
+    def match(self, path: str) -> Optional[Tuple[Route, Dict[str, Any]]]:
+        """
+        Find the route matching the given path. Return the route and the values of the path
+        parameters, or None if there is no matching route
+        """
+
+        params = {} # type: Dict[str, Any]
+        route = self._match(self._root, path.split("/"), 1, params)
+        if route is None:
+            return None
+        return route, params
+
+    def _match(self, node: _Node, segments: List[str], index: int,
+               params: Dict[str, Any]) -> Optional[Route]:
+        if index == len(segments):
+            return node.route
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            route = self._match(child, segments, index + 1, params)
+            if route is not None:
+                return route
+        if segment:
+            for name, _, converter, child in node.params:
+                try:
+                    value = converter(urllib.parse.unquote(segment))
+                except ValueError:
+                    continue
+                route = self._match(child, segments, index + 1, params)
+                if route is not None:
+                    params[name] = value
+                    return route
+        if node.catch_all is not None:
+            name, route = node.catch_all
+            params[name] = urllib.parse.unquote("/".join(segments[index:]))
+            return route
+        return None
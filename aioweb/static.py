@@ -0,0 +1,178 @@
+"""
+This module contains a handler which serves static files from a directory
+"""
+
+import email.utils
+import mimetypes
+import os
+import stat
+import time
+import urllib.parse
+from typing import Dict, Optional, Tuple
+
+import aioweb.response
+
+NOT_FOUND = aioweb.response.Response(b"Not Found", status_code=404)
+
+
+class _FileInfo: # pylint: disable=too-few-public-methods
+    #
+    # What we know about a file, together with the point in time
+    # until which we trust this information
+    #
+    __slots__ = ['path', 'size', 'etag', 'last_modified', 'mtime', 'content_type', 'expires']
+
+    def __init__(self, path: str, info: os.stat_result, expires: float) -> None:
+        self.path = path
+        self.size = info.st_size
+        self.mtime = int(info.st_mtime)
+        self.etag = '"%x-%x"' % (info.st_mtime_ns, info.st_size)
+        self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.expires = expires
+
+
+def _parse_range(value: str, size: int) -> Optional[Tuple[int, int]]: # pylint: disable=too-many-return-statements
+    #
+    # Parse the value of a Range header. Return the first and the last byte
+    # requested, or None if the header is invalid or requests more than one
+    # range, in which case we ignore it and return the full file. If the
+    # range cannot be satisfied, return (size, size)
+    #
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                return size, size
+            return max(0, size - suffix), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start < 0 or (last and end < start):
+        return None
+    if start >= size:
+        return size, size
+    return start, min(end, size - 1)
+
+
+class StaticFiles: # pylint: disable=too-few-public-methods
+    """
+    A handler which serves the files in a directory.
+
+    The handler can be registered with a routing container for a pattern ending in a parameter
+    {path:path}, in which case the value of this parameter is used as the path of the file relative
+    to the directory, or be used as handler of a plain container, in which case the path of the
+    request is used. Paths which lead outside of the directory are rejected.
+
+    The content of a file is not read by the handler. Instead, the handler returns a response
+    whose body is an aioweb.response.FileBody, which the protocol sends using sendfile. The
+    handler supports single byte ranges (status 206, or 416 if the range cannot be satisfied)
+    and the conditional headers If-None-Match and If-Modified-Since (status 304), based on an
+    ETag which is derived from modification time and size of the file.
+
+    To avoid calling os.stat for every request, the result is cached for cache_seconds. Thus a
+    file which is changed is picked up with a delay of at most cache_seconds. At most max_entries
+    files are cached, if more files are requested, the oldest entries are evicted.
+    """
+
+    __slots__ = ['_directory', '_cache_seconds', '_max_entries', '_cache']
+
+    def __init__(self, directory: str, cache_seconds: float = 1.0,
+                 max_entries: int = 1024) -> None:
+        self._directory = os.path.realpath(directory)
+        self._cache_seconds = cache_seconds
+        self._max_entries = max_entries
+        self._cache = {} # type: Dict[str, _FileInfo]
+
+    async def __call__(self, request, container, path: Optional[str] = None):
+        if path is None:
+            path = urllib.parse.unquote(request.path())
+        info = self._lookup(path)
+        if info is None:
+            return NOT_FOUND
+        headers = {
+            "ETag": info.etag,
+            "Last-Modified": info.last_modified,
+            "Accept-Ranges": "bytes",
+        }
+        if self._not_modified(request, info):
+            return aioweb.response.Response(status_code=304, headers=headers,
+                                            content_type=info.content_type)
+        byte_range = None
+        value = request.headers().get("Range")
+        if value is not None:
+            if_range = request.headers().get("If-Range")
+            if if_range is None or if_range.decode("latin-1") in (info.etag, info.last_modified):
+                byte_range = _parse_range(value.decode("latin-1"), info.size)
+        if byte_range is None:
+            return aioweb.response.Response(aioweb.response.FileBody(info.path, 0, info.size),
+                                            headers=headers, content_type=info.content_type)
+        first, last = byte_range
+        if first == info.size:
+            headers["Content-Range"] = "bytes */%d" % info.size
+            return aioweb.response.Response(b"Range Not Satisfiable", status_code=416,
+                                            headers=headers)
+        headers["Content-Range"] = "bytes %d-%d/%d" % (first, last, info.size)
+        return aioweb.response.Response(
+            aioweb.response.FileBody(info.path, first, last - first + 1),
+            status_code=206, headers=headers, content_type=info.content_type)
+
+    @staticmethod
+    def _not_modified(request, info: _FileInfo) -> bool:
+        #
+        # If-None-Match takes precedence over If-Modified-Since
+        #
+        headers = request.headers()
+        value = headers.get("If-None-Match")
+        if value is not None:
+            tags = [tag.strip() for tag in value.decode("latin-1").split(",")]
+            return "*" in tags or info.etag in tags or ("W/" + info.etag) in tags
+        value = headers.get("If-Modified-Since")
+        if value is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(value.decode("latin-1"))
+            except (TypeError, ValueError):
+                return False
+            return info.mtime <= since.timestamp()
+        return False
+
+    def _lookup(self, path: str) -> Optional[_FileInfo]:
+        #
+        # Return the information for the file with the given path, using
+        # the cache if possible
+        #
+        now = time.monotonic()
+        info = self._cache.get(path)
+        if info is not None and info.expires > now:
+            return info
+        #
+        # A path containing a null byte makes realpath raise a ValueError
+        # with newer Python versions and stat with older ones
+        #
+        try:
+            full_path = os.path.realpath(os.path.join(self._directory, path.lstrip("/")))
+            if not full_path.startswith(self._directory + os.sep):
+                return None
+            result = os.stat(full_path)
+        except (OSError, ValueError):
+            self._cache.pop(path, None)
+            return None
+        if not stat.S_ISREG(result.st_mode):
+            return None
+        info = _FileInfo(full_path, result, now + self._cache_seconds)
+        #
+        # Evict the oldest entry if the cache is full. As dictionaries keep the
+        # order of insertion, this is the first key
+        #
+        self._cache.pop(path, None)
+        if len(self._cache) >= self._max_entries:
+            del self._cache[next(iter(self._cache))]
+        self._cache[path] = info
+        return info
@@ -0,0 +1,114 @@
+"""
+This module contains a coarse timer wheel which the container uses to close idle connections
+"""
+
+import asyncio
+import logging
+import math
+from typing import Any, Dict, List, Set
+
+logger = logging.getLogger(__name__)
+
+class TimerWheel:
+    """
+    A timer wheel which expires entries that have been idle for too long.
+
+    Instead of scheduling a timer with the event loop for every entry and rescheduling it whenever
+    there is activity, the wheel uses a single timer which fires once per tick (resolution seconds)
+    and maintains a ring of slots, each holding the entries which are due at a specific tick.
+
+    An entry is any object with an integer attribute last_activity and a method idle_timeout.
+    To signal activity, the owner of an entry simply sets last_activity to the current value of
+    now, so that no timer has to be touched. When the tick at which an entry is due comes, we check
+    last_activity and either call idle_timeout or move the entry to the slot for its new deadline.
+
+    An entry is expired after it has been idle for at least timeout_seconds, but the actual point
+    in time is only accurate up to the resolution of the wheel.
+    """
+
+    __slots__ = ['now', '_loop', '_resolution', '_timeout_ticks', '_slots',
+                 '_slot_of', '_handle']
+
+    def __init__(self, timeout_seconds: float, resolution: float = 1.0, loop=None) -> None:
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.now = 0
+        self._loop = loop
+        self._resolution = resolution
+        #
+        # We add one tick as we do not know at which point between two
+        # ticks the last activity has happened
+        #
+        self._timeout_ticks = max(1, math.ceil(timeout_seconds / resolution)) + 1
+        self._slots = [set() for _ in range(self._timeout_ticks + 1)] # type: List[Set[Any]]
+        self._slot_of = {} # type: Dict[Any, int]
+        self._handle = None # type: Any
+
+    def start(self):
+        """
+        Start the timer which advances the wheel
+        """
+
+        if self._handle is None:
+            self._handle = self._loop.call_later(self._resolution, self._tick)
+
+    def stop(self):
+        """
+        Stop the timer. Entries which are still registered will not expire any more
+        """
+
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def add(self, entry):
+        """
+        Register an entry with the wheel, marking it as active now
+        """
+
+        entry.last_activity = self.now
+        self._insert(entry, self.now + self._timeout_ticks)
+
+    def remove(self, entry):
+        """
+        Remove an entry from the wheel. It is not an error to remove an entry which
+        is not registered
+        """
+
+        index = self._slot_of.pop(entry, None)
+        if index is not None:
+            self._slots[index].discard(entry)
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def _insert(self, entry, deadline: int):
+        index = deadline % len(self._slots)
+        self._slots[index].add(entry)
+        self._slot_of[entry] = index
+
+    def _tick(self):
+        #
+        # Advance the wheel and process the slot which is now due. Entries
+        # which have seen activity in the meantime are moved to the slot
+        # matching their new deadline
+        #
+        self._handle = self._loop.call_later(self._resolution, self._tick)
+        self.now += 1
+        index = self.now % len(self._slots)
+        due = self._slots[index]
+        if not due:
+            return
+        self._slots[index] = set()
+        expired = []
+        for entry in due:
+            deadline = entry.last_activity + self._timeout_ticks
+            if deadline <= self.now:
+                del self._slot_of[entry]
+                expired.append(entry)
+            else:
+                self._insert(entry, deadline)
+        if expired:
+            logger.debug("Expiring %d idle entries", len(expired))
+        for entry in expired:
+            entry.idle_timeout()
@@ -0,0 +1,542 @@
+"""
+This module contains the support for WebSockets (RFC 6455): the handshake, a codec for frames,
+the connection object handed to a handler and groups of connections to which messages can be
+broadcast
+"""
+
+import asyncio
+import base64
+import binascii
+import collections
+import functools
+import hashlib
+import logging
+import struct
+from typing import Any, Awaitable, Callable, Deque, Iterator, List, Optional, Set, Union
+
+import aioweb.exceptions
+
+logger = logging.getLogger(__name__)
+
+#
+# The opcodes of the frame types
+#
+CONTINUATION = 0x0
+TEXT = 0x1
+BINARY = 0x2
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+
+#
+# The status codes of close frames which we use
+#
+NORMAL_CLOSURE = 1000
+GOING_AWAY = 1001
+PROTOCOL_ERROR = 1002
+INVALID_DATA = 1007
+MESSAGE_TOO_BIG = 1009
+INTERNAL_ERROR = 1011
+
+#
+# The value appended to the key of the client to compute the accept header
+#
+_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+#
+# The number of seconds we wait for the client to confirm a close frame
+#
+_CLOSE_TIMEOUT = 5.0
+
+Session = Callable[["WebSocket"], Awaitable[None]]
+
+
+def accept_key(key: bytes) -> bytes:
+    """
+    Return the value of the header Sec-WebSocket-Accept for the key sent by the client
+    """
+
+    return base64.b64encode(hashlib.sha1(key + _GUID).digest())
+
+
+def apply_mask(mask: bytes, data: Union[bytes, bytearray, memoryview]) -> bytes:
+    """
+    XOR data with the four bytes of mask repeated over its full length.
+
+    Instead of looping over the bytes in Python, we turn the data and the repeated mask
+    into two integers and XOR those, so that the work is done in bulk by the interpreter
+    """
+
+    length = len(data)
+    if not length:
+        return b""
+    repeated = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, "little")
+            ^ int.from_bytes(repeated, "little")).to_bytes(length, "little")
+
+
+def encode_frame(opcode: int, payload: bytes) -> bytes:
+    """
+    Return a complete, unmasked frame as sent by a server
+    """
+
+    length = len(payload)
+    if length < 126:
+        header = bytes((0x80 | opcode, length))
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def encode_message(message: Union[str, bytes]) -> bytes:
+    """
+    Return a frame carrying a message, which is sent as text frame if it is a string
+    and as binary frame otherwise
+    """
+
+    if isinstance(message, str):
+        return encode_frame(TEXT, message.encode("utf-8"))
+    return encode_frame(BINARY, bytes(message))
+
+
+def _close_payload(code: int, reason: str) -> bytes:
+    return struct.pack("!H", code) + reason.encode("utf-8")[:123]
+
+
+class Upgrade: # pylint: disable=too-few-public-methods
+    """
+    Returned by a handler to accept a request to upgrade the connection to a WebSocket.
+
+    The protocol then completes the handshake and runs the coroutine function session, which
+    receives the WebSocket, for as long as the connection exists. Messages larger than
+    max_message_bytes are refused, and reading from the connection is paused while max_queue
+    received messages are waiting to be consumed by the session
+    """
+
+    __slots__ = ['session', 'max_message_bytes', 'max_queue']
+
+    def __init__(self, session: Session, max_message_bytes: int = 1048576,
+                 max_queue: int = 16) -> None:
+        self.session = session
+        self.max_message_bytes = max_message_bytes
+        self.max_queue = max_queue
+
+
+def endpoint(session=None, **kwargs):
+    """
+    Turn a coroutine function with the signature
+
+    async def session(websocket, request, container, **params)
+
+    into a handler which accepts the upgrade to a WebSocket and then runs the session. Keyword
+    arguments are passed on to Upgrade. This can be used as decorator, with or without arguments
+    """
+
+    if session is None:
+        return functools.partial(endpoint, **kwargs)
+
+    @functools.wraps(session)
+    async def handler(request, container, **params):
+        async def run(websocket):
+            await session(websocket, request, container, **params)
+        return Upgrade(run, **kwargs)
+    return handler
+
+
+def handshake_key(request) -> Optional[bytes]: # pylint: disable=too-many-return-statements
+    """
+    Return the key sent by the client if the request is a valid request to upgrade the
+    connection to a WebSocket, otherwise return None
+    """
+
+    headers = request.headers()
+    if request.method() != "GET" or request.http_version() != "1.1":
+        return None
+    upgrade = headers.get("Upgrade")
+    if upgrade is None or b"websocket" not in upgrade.lower():
+        return None
+    if headers.get("Sec-WebSocket-Version") != b"13":
+        return None
+    key = headers.get("Sec-WebSocket-Key")
+    if key is None:
+        return None
+    key = key.strip()
+    try:
+        if len(base64.b64decode(key, validate=True)) != 16:
+            return None
+    except binascii.Error:
+        return None
+    return key
+
+
+class WebSocket: # pylint: disable=too-many-instance-attributes
+    """
+    A WebSocket connection as seen by a session.
+
+    The protocol feeds the data it receives into the WebSocket, which parses it into frames as
+    soon as the handshake is complete. Pings are answered right away, data frames are assembled
+    into messages and queued until the session calls receive, which returns a string for text
+    messages, bytes for binary messages and None once the connection is closed. A WebSocket can
+    also be used as asynchronous iterator over the messages.
+
+    Frames are sent unmasked as required for servers, while frames received from the client are
+    unmasked in one go per frame. If the client violates the protocol, we send a close frame with
+    the matching status code and close the connection.
+    """
+
+    __slots__ = ['_transport', '_loop', '_drain', '_pause_reading', '_resume_reading', '_buffer',
+                 '_started', '_max_message_bytes', '_max_queue', '_messages', '_waiter',
+                 '_fragments', '_fragment_opcode', '_fragment_size', '_close_sent',
+                 '_close_received', '_send_lock', 'close_code']
+
+    def __init__(self, transport, loop, # pylint: disable=too-many-arguments
+                 drain: Callable[[], Awaitable[None]], pause_reading: Callable[[], None],
+                 resume_reading: Callable[[], None]) -> None:
+        self._transport = transport
+        self._loop = loop
+        self._drain = drain
+        self._pause_reading = pause_reading
+        self._resume_reading = resume_reading
+        self._buffer = bytearray()
+        self._started = False
+        self._max_message_bytes = 1048576
+        self._max_queue = 16
+        self._messages = collections.deque() # type: Deque[Union[str, bytes]]
+        self._waiter = None # type: Optional[asyncio.Future]
+        self._fragments = [] # type: List[bytes]
+        self._fragment_opcode = 0
+        self._fragment_size = 0
+        self._close_sent = False
+        self._close_received = None # type: Optional[asyncio.Future]
+        self._send_lock = None # type: Optional[asyncio.Lock]
+        self.close_code = None # type: Optional[int]
+
+    @property
+    def started(self) -> bool:
+        """
+        True once the handshake has been sent
+        """
+
+        return self._started
+
+    @property
+    def closed(self) -> bool:
+        """
+        True if we have sent a close frame or the connection has been lost
+        """
+
+        return self._close_sent or self._transport is None
+
+    def start(self, upgrade: Upgrade):
+        """
+        Start to process frames once the handshake has been sent
+        """
+
+        self._max_message_bytes = upgrade.max_message_bytes
+        self._max_queue = upgrade.max_queue
+        #
+        # The protocol has a single waiter for the transport to drain,
+        # so tasks sending concurrently take turns waiting for it
+        #
+        self._send_lock = asyncio.Lock()
+        self._started = True
+        self._parse()
+
+    def feed_data(self, data: bytes):
+        """
+        Hand over data received from the client
+        """
+
+        self._buffer.extend(data)
+        if self._started:
+            self._parse()
+
+    def connection_lost(self):
+        """
+        Signal that the connection has been closed
+        """
+
+        self._transport = None
+        if self.close_code is None:
+            self.close_code = 1006
+        self._wake()
+        if self._close_received is not None and not self._close_received.done():
+            self._close_received.set_result(None)
+
+    async def receive(self) -> Optional[Union[str, bytes]]:
+        """
+        Return the next message, or None if the connection is closed
+        """
+
+        while not self._messages:
+            if self.closed or self.close_code is not None:
+                return None
+            waiter = self._waiter = self._loop.create_future()
+            try:
+                await waiter
+            finally:
+                self._waiter = None
+        message = self._messages.popleft()
+        if len(self._messages) < self._max_queue:
+            self._resume_reading()
+        return message
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Union[str, bytes]:
+        message = await self.receive()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def send(self, message: Union[str, bytes]):
+        """
+        Send a message, as text frame if it is a string and as binary frame otherwise,
+        and wait until the transport is willing to accept more data. Raise WebSocketClosed
+        if the connection is closed
+        """
+
+        if not self.send_frame(encode_message(message)):
+            raise aioweb.exceptions.WebSocketClosed("WebSocket is closed")
+        assert self._send_lock is not None
+        async with self._send_lock:
+            await self._drain()
+
+    def send_frame(self, frame: bytes, max_buffer: Optional[int] = None) -> bool:
+        """
+        Write an encoded frame without waiting. If max_buffer is given and more than this
+        number of bytes are waiting to be sent, the client is considered too slow, and the
+        connection is closed. Return False if the frame has not been written
+        """
+
+        transport = self._transport
+        if transport is None or self._close_sent or transport.is_closing():
+            return False
+        if max_buffer is not None and transport.get_write_buffer_size() > max_buffer:
+            logger.error("Closing WebSocket whose client does not keep up")
+            self.close_code = 1006
+            transport.abort()
+            return False
+        transport.write(frame)
+        return True
+
+    def ping(self, payload: bytes = b""):
+        """
+        Send a ping, which the client answers with a pong
+        """
+
+        self.send_frame(encode_frame(PING, payload))
+
+    async def close(self, code: int = NORMAL_CLOSURE, reason: str = ""):
+        """
+        Send a close frame, wait until the client confirms it, but at most a few
+        seconds, and close the connection
+        """
+
+        if self._transport is None:
+            return
+        if not self._close_sent:
+            self._send_close(code, reason)
+        if self.close_code is None:
+            received = self._close_received = self._loop.create_future()
+            try:
+                await asyncio.wait_for(received, _CLOSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.error("Client did not confirm closing the WebSocket")
+        if self._transport is not None:
+            self._transport.close()
+
+    def going_away(self):
+        """
+        Close the connection as the server is shutting down, without waiting for the client
+        """
+
+        if self._transport is None:
+            return
+        if not self._close_sent:
+            self._send_close(GOING_AWAY, "")
+        self._transport.close()
+
+    def _send_close(self, code: int, reason: str):
+        self._transport.write(encode_frame(CLOSE, _close_payload(code, reason)))
+        self._close_sent = True
+
+    def _fail(self, code: int, reason: str):
+        #
+        # The client has violated the protocol, so we close the connection
+        # without waiting for it to confirm
+        #
+        logger.error("Closing WebSocket with status %d (%s)", code, reason)
+        if self._transport is not None:
+            if not self._close_sent:
+                self._send_close(code, reason)
+            self._transport.close()
+        self.close_code = code
+        self._buffer.clear()
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _parse(self): # pylint: disable=too-many-branches
+        #
+        # Process all complete frames in the buffer and remove them afterwards
+        # in one go, so that every byte is moved at most once
+        #
+        buffer = self._buffer
+        position = 0
+        while self.close_code is None:
+            available = len(buffer) - position
+            if available < 2:
+                break
+            first, second = buffer[position], buffer[position + 1]
+            opcode = first & 0x0F
+            length = second & 0x7F
+            offset = 2
+            if length == 126:
+                if available < 4:
+                    break
+                length = struct.unpack_from("!H", buffer, position + 2)[0]
+                offset = 4
+            elif length == 127:
+                if available < 10:
+                    break
+                length = struct.unpack_from("!Q", buffer, position + 2)[0]
+                offset = 10
+            if first & 0x70 or not second & 0x80:
+                self._fail(PROTOCOL_ERROR, "Reserved bits set or frame not masked")
+                return
+            if opcode >= CLOSE and (length > 125 or not first & 0x80):
+                self._fail(PROTOCOL_ERROR, "Invalid control frame")
+                return
+            if length > self._max_message_bytes:
+                self._fail(MESSAGE_TOO_BIG, "Message too big")
+                return
+            if available < offset + 4 + length:
+                break
+            mask = bytes(buffer[position + offset:position + offset + 4])
+            start = position + offset + 4
+            with memoryview(buffer) as view:
+                payload = apply_mask(mask, view[start:start + length])
+            position = start + length
+            self._process(bool(first & 0x80), opcode, payload)
+        if position:
+            del buffer[:position]
+
+    def _process(self, fin: bool, opcode: int, payload: bytes):
+        if opcode == PING:
+            self.send_frame(encode_frame(PONG, payload))
+        elif opcode == PONG:
+            pass
+        elif opcode == CLOSE:
+            self._closed_by_client(payload)
+        elif opcode == CONTINUATION:
+            if not self._fragments:
+                self._fail(PROTOCOL_ERROR, "Unexpected continuation frame")
+                return
+            self._add_fragment(fin, payload)
+        elif opcode in (TEXT, BINARY):
+            if self._fragments:
+                self._fail(PROTOCOL_ERROR, "Expected continuation frame")
+                return
+            self._fragment_opcode = opcode
+            self._fragment_size = 0
+            self._add_fragment(fin, payload)
+        else:
+            self._fail(PROTOCOL_ERROR, "Unknown opcode")
+
+    def _add_fragment(self, fin: bool, payload: bytes):
+        self._fragment_size += len(payload)
+        if self._fragment_size > self._max_message_bytes:
+            self._fail(MESSAGE_TOO_BIG, "Message too big")
+            return
+        self._fragments.append(payload)
+        if not fin:
+            return
+        data = payload if len(self._fragments) == 1 else b"".join(self._fragments)
+        self._fragments = []
+        message = data # type: Union[str, bytes]
+        if self._fragment_opcode == TEXT:
+            try:
+                message = data.decode("utf-8")
+            except UnicodeDecodeError:
+                self._fail(INVALID_DATA, "Text message is not valid UTF-8")
+                return
+        self._messages.append(message)
+        if len(self._messages) >= self._max_queue:
+            self._pause_reading()
+        self._wake()
+
+    def _closed_by_client(self, payload: bytes):
+        code = NORMAL_CLOSURE
+        if len(payload) >= 2:
+            code = struct.unpack_from("!H", payload)[0]
+        self.close_code = code
+        if self._transport is not None:
+            if not self._close_sent:
+                self._send_close(code, "")
+            self._transport.close()
+        if self._close_received is not None and not self._close_received.done():
+            self._close_received.set_result(None)
+        self._wake()
+
+
+class Group:
+    """
+    A set of WebSockets to which the same message can be sent at once.
+
+    Broadcasting encodes the message into a frame only once and writes this buffer into the
+    transports of all members. A member whose client does not read fast enough, so that more
+    than max_buffer bytes are waiting to be sent to it, is closed and removed from the group,
+    so that a single slow client cannot make the server buffer an unlimited amount of data.
+    Members whose connection is closed are removed during the next broadcast
+    """
+
+    __slots__ = ['_members', '_max_buffer']
+
+    def __init__(self, max_buffer: int = 1048576) -> None:
+        self._members = set() # type: Set[WebSocket]
+        self._max_buffer = max_buffer
+
+    def add(self, websocket: WebSocket):
+        """
+        Add a WebSocket to the group
+        """
+
+        self._members.add(websocket)
+
+    def discard(self, websocket: WebSocket):
+        """
+        Remove a WebSocket from the group if it is a member
+        """
+
+        self._members.discard(websocket)
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __iter__(self) -> Iterator[WebSocket]:
+        return iter(list(self._members))
+
+    def __contains__(self, websocket: Any) -> bool:
+        return websocket in self._members
+
+    def broadcast(self, message: Union[str, bytes]) -> int:
+        """
+        Send a message to all members and return the number of members to
+        which it has been written
+        """
+
+        frame = encode_message(message)
+        max_buffer = self._max_buffer
+        gone = []
+        for websocket in self._members:
+            if not websocket.send_frame(frame, max_buffer):
+                gone.append(websocket)
+        for websocket in gone:
+            self._members.discard(websocket)
+        return len(self._members)
@@ -0,0 +1,273 @@
+"""
+A load generator for HTTP servers which talks to the server via plain sockets and parses
+the responses using httptools, so that the client adds as little overhead as possible.
+
+A run is described by the number of connections used in parallel (concurrency), the total
+number of requests, whether connections are kept alive, the number of requests sent on a
+connection before waiting for the first response (pipeline) and the sizes of request and
+response bodies. The response body size is passed to the server as query parameter size,
+which the sample server understands.
+
+For every request, we measure the time from writing the request until the response has
+been parsed completely. With pipelining, this includes the time a request spends waiting
+behind earlier requests on the same connection.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import time
+from typing import Any, Deque, Dict, List, Optional
+
+import httptools # type: ignore
+
+#
+# The percentiles which we report
+#
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class _Budget: # pylint: disable=too-few-public-methods
+    #
+    # The number of requests which remain to be sent, shared by all connections
+    #
+    __slots__ = ['remaining']
+
+    def __init__(self, remaining: int) -> None:
+        self.remaining = remaining
+
+    def take(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+
+class _ClientProtocol(asyncio.Protocol): # pylint: disable=too-many-instance-attributes
+    #
+    # A connection to the server. Whenever a response is complete, we send the next
+    # request if the budget allows it, so that the number of outstanding requests stays
+    # at the pipeline depth. The future done is completed once no request is outstanding
+    # any more or the connection is lost
+    #
+    __slots__ = ['_request', '_keep_alive', '_budget', '_latencies', '_stats', '_parser',
+                 '_sent', '_transport', 'done']
+
+    def __init__(self, request: bytes, keep_alive: bool, # pylint: disable=too-many-arguments
+                 budget: _Budget, latencies: List[float], stats: Dict[str, int]) -> None:
+        self._request = request
+        self._keep_alive = keep_alive
+        self._budget = budget
+        self._latencies = latencies
+        self._stats = stats
+        self._parser = httptools.HttpResponseParser(self) # pylint: disable=no-member
+        self._sent = collections.deque() # type: Deque[float]
+        self._transport = None # type: Any
+        self.done = asyncio.get_event_loop().create_future()
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def send(self, count: int):
+        """
+        Send count requests at once
+        """
+
+        now = time.perf_counter()
+        self._sent.extend([now] * count)
+        self._transport.write(self._request * count)
+
+    def data_received(self, data: bytes):
+        try:
+            self._parser.feed_data(data)
+        except httptools.HttpParserError: # pylint: disable=no-member
+            self._stats["errors"] += len(self._sent)
+            self._sent.clear()
+            self._transport.close()
+
+    def on_message_complete(self):
+        """
+        Record the latency of the request whose response is complete and
+        send the next request
+        """
+
+        self._latencies.append(time.perf_counter() - self._sent.popleft())
+        if not 200 <= self._parser.get_status_code() < 300:
+            self._stats["errors"] += 1
+        if self._keep_alive and self._budget.take():
+            self.send(1)
+        elif not self._sent and not self.done.done():
+            self.done.set_result(None)
+
+    def connection_lost(self, exc):
+        self._stats["errors"] += len(self._sent)
+        self._sent.clear()
+        if not self.done.done():
+            self.done.set_result(None)
+
+    def close(self):
+        """
+        Close the connection unless the server has already done so
+        """
+
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.close()
+
+
+def build_request(host: str, keep_alive: bool, request_body: int, response_body: int) -> bytes:
+    """
+    Return the encoded request which we send over and over again
+    """
+
+    path = "/?size=%d" % response_body if response_body else "/"
+    lines = ["%s %s HTTP/1.1" % ("POST" if request_body else "GET", path),
+             "Host: %s" % host]
+    if not keep_alive:
+        lines.append("Connection: close")
+    if request_body:
+        lines.append("Content-Length: %d" % request_body)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("ascii") + b"x" * request_body
+
+
+def percentile(ordered: List[float], rank: float) -> float:
+    """
+    Return the given percentile of a sorted list using the nearest-rank method
+    """
+
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, math.ceil(len(ordered) * rank / 100.0) - 1))
+    return ordered[index]
+
+
+class LoadGenerator: # pylint: disable=too-few-public-methods
+    """
+    Sends a given number of requests to a server via concurrency connections and
+    collects throughput and latencies
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8888, # pylint: disable=too-many-arguments
+                 concurrency: int = 10, requests: int = 10000, keep_alive: bool = True,
+                 pipeline: int = 1, request_body: int = 0, response_body: int = 0) -> None:
+        self._host = host
+        self._port = port
+        self._concurrency = concurrency
+        self._requests = requests
+        self._keep_alive = keep_alive
+        #
+        # Without keep-alive, every connection carries a single request
+        #
+        self._pipeline = pipeline if keep_alive else 1
+        self._request = build_request(host, keep_alive, request_body, response_body)
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Run the load and return the results as a dictionary
+        """
+
+        budget = _Budget(self._requests)
+        latencies = [] # type: List[float]
+        stats = {"errors": 0, "connections": 0}
+        started = time.perf_counter()
+        await asyncio.gather(*[self._worker(budget, latencies, stats)
+                               for _ in range(self._concurrency)])
+        duration = time.perf_counter() - started
+        latencies.sort()
+        result = {
+            "requests": len(latencies),
+            "errors": stats["errors"],
+            "connections": stats["connections"],
+            "duration": duration,
+            "throughput": len(latencies) / duration if duration > 0 else 0.0,
+            "latency": {
+                "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+                "max": latencies[-1] if latencies else 0.0,
+            },
+        } # type: Dict[str, Any]
+        for rank in PERCENTILES:
+            result["latency"]["p%g" % rank] = percentile(latencies, rank)
+        return result
+
+    async def _worker(self, budget: _Budget, latencies: List[float], stats: Dict[str, int]):
+        #
+        # Open connections one after the other until the budget is used up
+        #
+        loop = asyncio.get_event_loop()
+        while budget.remaining > 0:
+            count = min(self._pipeline, budget.remaining)
+            budget.remaining -= count
+            protocol = None # type: Optional[_ClientProtocol]
+            try:
+                _, protocol = await loop.create_connection(
+                    lambda: _ClientProtocol(self._request, self._keep_alive, budget,
+                                            latencies, stats),
+                    self._host, self._port)
+            except OSError:
+                stats["errors"] += count
+                continue
+            stats["connections"] += 1
+            protocol.send(count)
+            await protocol.done
+            protocol.close()
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    """
+    Return a one-line summary of a result
+    """
+
+    latency = result["latency"]
+    return "%d requests, %d errors, %.0f req/s, latency p50 %.3f ms, p90 %.3f ms, " \
+           "p99 %.3f ms, p99.9 %.3f ms" % (
+               result["requests"], result["errors"], result["throughput"],
+               latency["p50"] * 1000, latency["p90"] * 1000, latency["p99"] * 1000,
+               latency["p99.9"] * 1000)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """
+    Add the parameters of a run to a parser of command line arguments
+    """
+
+    parser.add_argument("--host", default="127.0.0.1", help="Host to connect to")
+    parser.add_argument("--port", type=int, default=8888, help="Port to connect to")
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="Number of connections used in parallel")
+    parser.add_argument("--requests", type=int, default=10000, help="Total number of requests")
+    parser.add_argument("--no-keep-alive", action="store_true", default=False,
+                        help="Open a new connection for every request")
+    parser.add_argument("--pipeline", type=int, default=1,
+                        help="Number of requests sent on a connection without waiting")
+    parser.add_argument("--request-body", type=int, default=0,
+                        help="Size of the request body, zero for GET requests")
+    parser.add_argument("--response-body", type=int, default=0,
+                        help="Size of the response body requested from the sample server")
+
+
+def main():
+    """
+    Run the load generator once with the parameters given on the command line
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    add_arguments(parser)
+    parser.add_argument("--uvloop", action="store_true", default=False,
+                        help="Use uvloop in the load generator")
+    parser.add_argument("--json", action="store_true", default=False,
+                        help="Print the result as JSON")
+    args = parser.parse_args()
+    if args.uvloop:
+        import uvloop # pylint: disable=import-outside-toplevel
+        uvloop.install()
+    generator = LoadGenerator(args.host, args.port, concurrency=args.concurrency,
+                              requests=args.requests, keep_alive=not args.no_keep_alive,
+                              pipeline=args.pipeline, request_body=args.request_body,
+                              response_body=args.response_body)
+    result = asyncio.run(generator.run())
+    print(json.dumps(result, indent=2) if args.json else format_result(result))
+
+
+if __name__ == "__main__":
+    main()
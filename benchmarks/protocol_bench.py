@@ -0,0 +1,334 @@
+"""
+Microbenchmarks of aioweb.protocol.HttpProtocol which run the protocol in-process against a
+fake transport, so that changes to the parsing of requests and the building of responses can
+be evaluated without the noise of sockets and a separate client.
+
+Every scenario consists of pre-built packets which are fed into data_received. A round ends
+when the protocol has written the responses to all requests contained in the packets. We
+report the number of requests per second and the time per request, using the best of several
+repetitions to reduce noise. In a separate pass with tracemalloc enabled, we determine the
+number of memory blocks allocated per request, i.e. the difference between the snapshots taken
+before and after a round divided by the number of requests in the round, and the number of
+blocks allocated by aioweb during a round which are still alive after it, again per request.
+Some of these blocks, like the headers of the next request, are expected, but an increase
+compared to an earlier run points to a leak. In addition, we report the peak number of bytes
+allocated during a round. The peak is reported per round and not per request, as the requests
+of a pipelined round are in memory at the same time, so that the peak divided by their number
+would not be comparable to that of the other scenarios.
+
+With --access-log, every request is recorded in an access log which is written to
+os.devnull by its background thread, to measure the cost of recording requests.
+
+With --baseline, the results are compared to those of an earlier run written with --output,
+and the script fails if the time per request of any scenario has grown by more than
+--threshold percent.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+#
+# Make the package importable if the script is run from the source tree
+#
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aioweb.accesslog # pylint: disable=wrong-import-position
+import aioweb.protocol # pylint: disable=wrong-import-position
+import aioweb.timer # pylint: disable=wrong-import-position
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(aioweb.protocol.__file__))
+
+#
+# The body of every response. It is small enough to be written together with the
+# header, so that every response results in exactly one write
+#
+_RESPONSE_BODY = b"Hello, World!"
+
+_GET = (b"GET /benchmark?name=value HTTP/1.1\r\n"
+        b"Host: localhost:8888\r\n"
+        b"User-Agent: protocol-bench\r\n"
+        b"Accept: */*\r\n"
+        b"Accept-Encoding: gzip, deflate\r\n"
+        b"\r\n")
+
+_POST = (b"POST /benchmark HTTP/1.1\r\n"
+         b"Host: localhost:8888\r\n"
+         b"Content-Type: application/octet-stream\r\n"
+         b"Content-Length: 1024\r\n"
+         b"\r\n" + b"x" * 1024)
+
+_PIPELINE_DEPTH = 16
+
+_FRAGMENT_SIZE = 16
+
+
+def _fragment(data: bytes, size: int) -> List[bytes]:
+    return [data[position:position + size] for position in range(0, len(data), size)]
+
+#
+# The scenarios, each given by a name, the packets fed into the protocol
+# per round and the number of requests contained in them
+#
+SCENARIOS = [
+    ("single", [_GET], 1),
+    ("pipelined", [_GET * _PIPELINE_DEPTH], _PIPELINE_DEPTH),
+    ("fragmented", _fragment(_GET, _FRAGMENT_SIZE), 1),
+    ("post-1k", [_POST], 1),
+]
+
+
+class _Container: # pylint: disable=too-few-public-methods
+    #
+    # A container whose handler reads the body and returns a constant response
+    #
+    async def handle_request(self, request):
+        await request.body()
+        return _RESPONSE_BODY
+
+
+class FakeTransport:
+    """
+    A transport which counts writes and completes a future once a given
+    number of writes has happened
+    """
+
+    __slots__ = ['_loop', '_writes', '_target', '_waiter']
+
+    def __init__(self, loop) -> None:
+        self._loop = loop
+        self._writes = 0
+        self._target = 0
+        self._waiter = None # type: Optional[asyncio.Future]
+
+    def expect(self, count: int) -> asyncio.Future:
+        """
+        Return a future which is completed once count more writes have happened
+        """
+
+        self._target = self._writes + count
+        self._waiter = self._loop.create_future()
+        return self._waiter
+
+    def write(self, data):
+        """
+        Count a write
+        """
+
+        self._writes += 1
+        if self._writes >= self._target and self._waiter is not None:
+            if not self._waiter.done():
+                self._waiter.set_result(None)
+
+    def get_extra_info(self, name: str):
+        """
+        Return a fixed address of the client for the access log
+        """
+
+        return ("127.0.0.1", 50000) if name == "peername" else None
+
+    def is_closing(self) -> bool:
+        """
+        The transport is never closing
+        """
+
+        return False
+
+    def close(self):
+        """
+        Closing is not supported
+        """
+
+        raise RuntimeError("Unexpected close")
+
+    def pause_reading(self):
+        """
+        Pausing has no effect
+        """
+
+    def resume_reading(self):
+        """
+        Resuming has no effect
+        """
+
+
+#
+# The access log used by all protocols if requested on the command line
+#
+_ACCESS_LOG = None # type: Optional[aioweb.accesslog.AccessLog]
+
+
+def _create_protocol(loop):
+    transport = FakeTransport(loop)
+    protocol = aioweb.protocol.HttpProtocol(_Container(), loop=loop,
+                                            timer_wheel=aioweb.timer.TimerWheel(5, loop=loop),
+                                            access_log=_ACCESS_LOG)
+    protocol.connection_made(transport)
+    return protocol, transport
+
+
+async def _run_rounds(protocol, transport: FakeTransport, packets: List[bytes],
+                      requests: int, rounds: int):
+    for _ in range(rounds):
+        done = transport.expect(requests)
+        for packet in packets:
+            protocol.data_received(packet)
+        await done
+
+
+async def measure_time(packets: List[bytes], requests: int, rounds: int) -> float:
+    """
+    Return the time in seconds per request for the given scenario
+    """
+
+    loop = asyncio.get_running_loop()
+    protocol, transport = _create_protocol(loop)
+    await _run_rounds(protocol, transport, packets, requests, max(1, rounds // 10))
+    gc.collect()
+    started = time.perf_counter()
+    await _run_rounds(protocol, transport, packets, requests, rounds)
+    elapsed = time.perf_counter() - started
+    protocol.connection_lost(None)
+    return elapsed / (rounds * requests)
+
+
+async def measure_memory(packets: List[bytes], requests: int, rounds: int) -> Dict[str, float]:
+    """
+    Return the number of blocks allocated per request and the peak number of bytes allocated
+    while processing one round, both averaged over all rounds, and the number of blocks which
+    remain allocated per request
+    """
+
+    loop = asyncio.get_running_loop()
+    protocol, transport = _create_protocol(loop)
+    await _run_rounds(protocol, transport, packets, requests, 10)
+    peaks = []
+    allocated = 0
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for _ in range(rounds):
+            #
+            # Python 3.8 cannot reset the peak, but clearing the traces
+            # resets both the traced memory and the peak
+            #
+            tracemalloc.clear_traces()
+            before = tracemalloc.take_snapshot()
+            await _run_rounds(protocol, transport, packets, requests, 1)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            after = tracemalloc.take_snapshot()
+            allocated += sum(stat.count_diff for stat in after.compare_to(before, "filename")
+                             if stat.count_diff > 0)
+        #
+        # The traces now only contain the blocks allocated in the last round, so
+        # whatever is still allocated by aioweb has been retained by that round
+        #
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    protocol.connection_lost(None)
+    retained = sum(stat.count for stat in snapshot.statistics("filename")
+                   if stat.traceback[0].filename.startswith(_PACKAGE_DIR))
+    return {
+        "allocated_blocks": allocated / (rounds * requests),
+        "peak_bytes": sum(peaks) / len(peaks),
+        "retained_blocks": retained / requests,
+    }
+
+
+def run(rounds: int, memory_rounds: int, repeat: int, selected: List[str]) -> Dict[str, Any]:
+    """
+    Run all selected scenarios and return the results
+    """
+
+    results = {}
+    for name, packets, requests in SCENARIOS:
+        if selected and name not in selected:
+            continue
+        per_request = min(asyncio.run(measure_time(packets, requests, max(1, rounds // requests)))
+                          for _ in range(repeat))
+        memory = asyncio.run(measure_memory(packets, requests, memory_rounds))
+        results[name] = {
+            "requests_per_second": 1.0 / per_request,
+            "us_per_request": per_request * 1e6,
+            "allocated_blocks_per_request": memory["allocated_blocks"],
+            "peak_bytes_per_round": memory["peak_bytes"],
+            "retained_blocks_per_request": memory["retained_blocks"],
+        }
+        print(("%-12s %9.0f req/s %7.2f us/request %7.2f blocks/request "
+               "%8.0f peak bytes/round %6.2f blocks retained/request") % (
+                   name, 1.0 / per_request, per_request * 1e6, memory["allocated_blocks"],
+                   memory["peak_bytes"], memory["retained_blocks"]))
+    return results
+
+
+def check(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """
+    Compare the time per request with a baseline and return False if any scenario
+    has become slower by more than threshold percent
+    """
+
+    passed = True
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        change = 100.0 * (result["us_per_request"] / previous["us_per_request"] - 1)
+        verdict = "ok"
+        if change > threshold:
+            verdict = "REGRESSION"
+            passed = False
+        print("%-12s %+6.1f%% %s" % (name, change, verdict))
+    return passed
+
+
+def main():
+    """
+    Run the benchmarks with the parameters given on the command line
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rounds", type=int, default=50000,
+                        help="Number of requests per scenario for the time measurement")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of time measurements of which the best is used")
+    parser.add_argument("--memory-rounds", type=int, default=200,
+                        help="Number of rounds traced with tracemalloc")
+    parser.add_argument("--scenario", action="append", default=[],
+                        help="Only run this scenario, can be given more than once")
+    parser.add_argument("--uvloop", action="store_true", default=False, help="Use uvloop")
+    parser.add_argument("--access-log", action="store_true", default=False,
+                        help="Record all requests in an access log")
+    parser.add_argument("--output", help="File to which the results are written as JSON")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Maximum increase of the time per request in percent")
+    args = parser.parse_args()
+    if args.uvloop:
+        import uvloop # pylint: disable=import-outside-toplevel
+        uvloop.install()
+    global _ACCESS_LOG # pylint: disable=global-statement
+    if args.access_log:
+        _ACCESS_LOG = aioweb.accesslog.AccessLog(output=open(os.devnull, "w"))
+        _ACCESS_LOG.start()
+    results = run(args.rounds, args.memory_rounds, args.repeat, args.scenario)
+    if _ACCESS_LOG is not None:
+        _ACCESS_LOG.stop()
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            if not check(results, json.load(file), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
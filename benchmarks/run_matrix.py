@@ -0,0 +1,175 @@
+"""
+Run a fixed matrix of load scenarios against the sample server, once with the asyncio
+event loop and once with uvloop, and write the results to a JSON file.
+
+For every event loop, the sample server is started as a separate process on a free port,
+every scenario is run after a short warm-up, and the server is stopped again. As the matrix
+is fixed, results written by different versions can be compared to spot regressions, which
+is what --baseline does.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import loadgen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#
+# The scenarios, each given by a name and the parameters of the load generator
+#
+SCENARIOS = [
+    ("keep-alive", dict(concurrency=50)),
+    ("no-keep-alive", dict(concurrency=50, keep_alive=False)),
+    ("pipeline-8", dict(concurrency=10, pipeline=8)),
+    ("single-connection", dict(concurrency=1)),
+    ("request-body-16k", dict(concurrency=50, request_body=16384)),
+    ("response-body-64k", dict(concurrency=50, response_body=65536)),
+] # type: List[Any]
+
+LOOPS = ("asyncio", "uvloop")
+
+#
+# The number of requests sent before every scenario to warm up the server
+#
+_WARMUP_REQUESTS = 1000
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _loop_available(loop: str) -> bool:
+    if loop == "asyncio":
+        return True
+    try:
+        import uvloop # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return False
+    return True
+
+
+def run_scenarios(loop: str, requests: int, selected: List[str]) -> Dict[str, Any]:
+    """
+    Start the sample server using the given event loop and run all selected scenarios
+    against it
+    """
+
+    port = _free_port()
+    command = [sys.executable, os.path.join(ROOT, "sample_server.py"), "--port", str(port)]
+    if loop == "uvloop":
+        command.append("--uvloop")
+    server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL)
+    results = {}
+    try:
+        _wait_for_port(port)
+        for name, params in SCENARIOS:
+            if selected and name not in selected:
+                continue
+            asyncio.run(loadgen.LoadGenerator(port=port, requests=_WARMUP_REQUESTS,
+                                              **params).run())
+            result = asyncio.run(loadgen.LoadGenerator(port=port, requests=requests,
+                                                       **params).run())
+            result["parameters"] = params
+            results[name] = result
+            print("%-8s %-18s %s" % (loop, name, loadgen.format_result(result)))
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]):
+    """
+    Print the relative change of throughput and p99 latency for all scenarios which
+    appear in both results
+    """
+
+    for loop, scenarios in results["loops"].items():
+        for name, result in scenarios.items():
+            previous = baseline.get("loops", {}).get(loop, {}).get(name)
+            if previous is None or not previous["throughput"] or not previous["latency"]["p99"]:
+                continue
+            print("%-8s %-18s throughput %+6.1f%%, p99 latency %+6.1f%%" % (
+                loop, name,
+                100.0 * (result["throughput"] / previous["throughput"] - 1),
+                100.0 * (result["latency"]["p99"] / previous["latency"]["p99"] - 1)))
+
+
+def main():
+    """
+    Run the matrix and write the results
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=20000,
+                        help="Number of requests per scenario")
+    parser.add_argument("--scenario", action="append", default=[],
+                        help="Only run this scenario, can be given more than once")
+    parser.add_argument("--loop", action="append", choices=LOOPS, default=[],
+                        help="Only use this event loop, can be given more than once")
+    parser.add_argument("--output", default="benchmark-results.json",
+                        help="File to which the results are written")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with")
+    args = parser.parse_args()
+    results = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "requests": args.requests,
+        "loops": {},
+    } # type: Dict[str, Any]
+    for loop in args.loop or LOOPS:
+        if not _loop_available(loop):
+            print("Skipping %s, it is not installed" % loop)
+            continue
+        results["loops"][loop] = run_scenarios(loop, args.requests, args.scenario)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print("Results written to %s" % args.output)
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ import logging
 
 import uvloop
 
+import aioweb.accesslog
 import aioweb.container
 import aioweb.protocol
 
@@ -23,6 +24,12 @@ async def handler(request, container):
     global counter
     body = await request.body()
     counter += 1
+    #
+    # The benchmarks ask for a response body of a given size
+    #
+    size = request.query().get("size")
+    if size:
+        return b"x" * int(size[0])
     return body
 
 def handle_signal(container, signal, frame):
@@ -32,12 +39,26 @@ async def main():
     #
     # Create container
     #
-    container = aioweb.container.HttpToolsWebContainer(host="127.0.0.1", port="8888", handler=handler)
+    access_log = None
+    output = None
+    if args.access_log:
+        output = open(args.access_log, "a")
+        access_log = aioweb.accesslog.AccessLog(output=output)
+    container = aioweb.container.HttpToolsWebContainer(host="127.0.0.1", port=str(args.port), handler=handler,
+                                                       workers=args.workers, hot_restart=args.hot_restart,
+                                                       access_log=access_log)
     #
     # Register signal handler
     #
     signal.signal(signal.SIGINT, functools.partial(handle_signal, container))
-    await container.start()
+    try:
+        await container.start()
+    finally:
+        #
+        # The container has stopped the thread writing the log when it returns
+        #
+        if output is not None:
+            output.close()
 
 #
 # Parse arguments
@@ -51,6 +72,20 @@ parser.add_argument("--uvloop",
                     action="store_true",
                     default=False,
                     help="Use uvloop")
+parser.add_argument("--port",
+                    type=int,
+                    default=8888,
+                    help="Port to listen on")
+parser.add_argument("--workers",
+                    type=int,
+                    default=1,
+                    help="Number of worker processes")
+parser.add_argument("--hot-restart",
+                    action="store_true",
+                    default=False,
+                    help="Restart without downtime on SIGHUP")
+parser.add_argument("--access-log",
+                    help="File to which an access log is written")
 args=parser.parse_args()
 
 #
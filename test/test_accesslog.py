@@ -0,0 +1,61 @@
+import io
+import logging
+import time
+
+import aioweb.accesslog
+
+
+def record(access_log, url, status=b"200"):
+    access_log.record("GET", url, b"HTTP/1.1 " + status + b" OK\r\n", 42, time.perf_counter(),
+                      0.0015, ("127.0.0.1", 4711))
+
+
+def test_flush():
+    output = io.StringIO()
+    access_log = aioweb.accesslog.AccessLog(capacity=4, output=output)
+    record(access_log, b"/a?b=c")
+    record(access_log, b"/missing", b"404")
+    access_log.flush()
+    lines = output.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith(time.strftime("%Y-%m-%dT", time.gmtime()))
+    assert lines[0].endswith("Z 127.0.0.1:4711 GET /a?b=c 200 42 0.001500")
+    assert lines[1].endswith(" GET /missing 404 42 0.001500")
+    #
+    # Flushed entries are not written again
+    #
+    access_log.flush()
+    assert len(output.getvalue().splitlines()) == 2
+    assert access_log.dropped == 0
+
+def test_overflow():
+    output = io.StringIO()
+    access_log = aioweb.accesslog.AccessLog(capacity=4, output=output)
+    for index in range(6):
+        record(access_log, b"/%d" % index)
+    access_log.flush()
+    urls = [line.split()[3] for line in output.getvalue().splitlines()]
+    assert urls[-1] == "/5"
+    assert access_log.dropped + len(urls) == 6
+    assert access_log.dropped >= 2
+
+def test_logger(caplog):
+    access_log = aioweb.accesslog.AccessLog()
+    access_log.record("POST", b"/form", b"HTTP/1.0 503 Service Unavailable\r\n", 0,
+                      time.perf_counter(), 0.5, None)
+    with caplog.at_level(logging.INFO, logger="aioweb.accesslog"):
+        access_log.flush()
+    assert caplog.messages[0].endswith(" - POST /form 503 0 0.500000")
+
+def test_thread():
+    output = io.StringIO()
+    access_log = aioweb.accesslog.AccessLog(output=output, flush_interval=0.01)
+    access_log.start()
+    record(access_log, b"/")
+    deadline = time.monotonic() + 5
+    while not output.getvalue() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(output.getvalue().splitlines()) == 1
+    record(access_log, b"/last")
+    access_log.stop()
+    assert output.getvalue().splitlines()[-1].endswith(" GET /last 200 42 0.001500")
@@ -0,0 +1,44 @@
+import unittest.mock
+
+import aioweb.admission
+
+
+def test_connection_limit():
+    admission = aioweb.admission.AdmissionControl(max_connections=2)
+    protocols = [unittest.mock.Mock() for _ in range(4)]
+    assert admission.connection_made(protocols[0])
+    assert admission.connection_made(protocols[1])
+    assert not admission.connection_made(protocols[2])
+    assert not admission.connection_made(protocols[3])
+    assert admission.connections == 2
+    assert admission.parked == 2
+    #
+    # A parked connection which is closed simply disappears
+    #
+    admission.connection_lost(protocols[3])
+    assert admission.parked == 1
+    #
+    # Closing a served connection admits the oldest parked one
+    #
+    admission.connection_lost(protocols[0])
+    protocols[2].admit.assert_called_once_with()
+    assert not protocols[3].admit.called
+    assert admission.connections == 2
+    assert admission.parked == 0
+
+def test_in_flight_limit():
+    admission = aioweb.admission.AdmissionControl(max_in_flight=1, retry_after=5)
+    assert admission.acquire()
+    assert not admission.acquire()
+    assert admission.rejected == 1
+    admission.release()
+    assert admission.acquire()
+    assert admission.in_flight == 1
+    assert admission.response.status_code == 503
+    assert admission.response.headers["Retry-After"] == "5"
+
+def test_no_limits():
+    admission = aioweb.admission.AdmissionControl()
+    for _ in range(100):
+        assert admission.connection_made(unittest.mock.Mock())
+        assert admission.acquire()
@@ -0,0 +1,215 @@
+import asyncio
+import unittest.mock
+
+import pytest
+
+import aioweb.cache
+import aioweb.headers
+import aioweb.request
+import aioweb.response
+
+
+def create_request(url=b"/", method="GET", **headers):
+    items = aioweb.headers.Headers()
+    for name, value in headers.items():
+        items.add(name.replace("_", "-").encode(), value.encode())
+    return aioweb.request.HTTPToolsRequest(asyncio.Future(), headers=items, url=url,
+                                           method=method)
+
+class Producer:
+
+    def __init__(self, result=b"abc", delay=0):
+        self._result = result
+        self._delay = delay
+        self.calls = 0
+
+    async def __call__(self, request):
+        self.calls += 1
+        if self._delay:
+            await asyncio.sleep(self._delay)
+        return 200, self._result
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+def test_hit():
+    cache = aioweb.cache.ResponseCache()
+    produce = Producer()
+    entry, response = run(cache.fetch(create_request(), produce))
+    assert response is None
+    assert entry.status_code == 200
+    assert entry.body == b"abc"
+    assert entry.header_lines == aioweb.response.CONTENT_TYPE_TEXT
+    assert entry.content_length == b"Content-Length: 3\r\n\r\n"
+    again, response = run(cache.fetch(create_request(), produce))
+    assert again is entry
+    assert produce.calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    #
+    # A different URL is a different entry
+    #
+    run(cache.fetch(create_request(b"/?x=1"), produce))
+    assert produce.calls == 2
+    assert len(cache) == 2
+
+def test_not_cached():
+    cache = aioweb.cache.ResponseCache()
+    #
+    # Only GET requests are cached
+    #
+    produce = Producer()
+    entry, response = run(cache.fetch(create_request(method="POST"), produce))
+    assert entry is None
+    assert response == (200, b"abc")
+    #
+    # Streams, errors and responses forbidding caching are not cached either
+    #
+    async def generate():
+        yield b"abc"
+    for result in [generate(), aioweb.response.Response(b"x", status_code=500),
+                   aioweb.response.Response(b"x", headers={"Cache-Control": "no-store"}),
+                   aioweb.response.Response(b"x", headers={"Cache-Control": "max-age=0"})]:
+        produce = Producer(result)
+        entry, response = run(cache.fetch(create_request(), produce))
+        assert entry is None
+        assert response == (200, result)
+    assert len(cache) == 0
+
+def test_vary():
+    cache = aioweb.cache.ResponseCache(vary=["Accept-Encoding"])
+    produce = Producer()
+    run(cache.fetch(create_request(Accept_Encoding="gzip"), produce))
+    run(cache.fetch(create_request(accept_encoding="gzip"), produce))
+    assert produce.calls == 1
+    run(cache.fetch(create_request(), produce))
+    assert produce.calls == 2
+
+def test_credentials():
+    cache = aioweb.cache.ResponseCache()
+    produce = Producer()
+    run(cache.fetch(create_request(), produce))
+    #
+    # Requests with credentials are neither answered from the cache
+    # nor are their responses stored
+    #
+    for headers in [{"Authorization": "Basic dXNlcjpwdw=="}, {"Cookie": "session=1"}]:
+        entry, response = run(cache.fetch(create_request(b"/private", **headers), produce))
+        assert entry is None
+        assert response == (200, b"abc")
+        entry, _ = run(cache.fetch(create_request(b"/", **headers), produce))
+        assert entry is None
+    assert produce.calls == 5
+    assert len(cache) == 1
+    #
+    # unless the response explicitly allows it
+    #
+    for value in ["public", "s-maxage=60"]:
+        produce = Producer(aioweb.response.Response(b"x", headers={"cache-control": value}))
+        entry, _ = run(cache.fetch(create_request(value.encode(), Cookie="session=1"), produce))
+        assert entry is not None
+        entry, _ = run(cache.fetch(create_request(value.encode()), produce))
+        assert entry is not None
+        assert produce.calls == 1
+    #
+    # A cookie listed in vary is part of the key
+    #
+    cache = aioweb.cache.ResponseCache(vary=["Cookie"])
+    produce = Producer()
+    run(cache.fetch(create_request(Cookie="session=1"), produce))
+    run(cache.fetch(create_request(Cookie="session=1"), produce))
+    assert produce.calls == 1
+    run(cache.fetch(create_request(Cookie="session=2"), produce))
+    assert produce.calls == 2
+
+def test_private_responses():
+    cache = aioweb.cache.ResponseCache()
+    for headers in [{"Set-Cookie": "session=1"}, {"set-cookie": "session=1",
+                                                   "Cache-Control": "public, max-age=60"},
+                    {"Cache-Control": "private"}, {"cache-control": "Private, max-age=60"}]:
+        produce = Producer(aioweb.response.Response(b"x", headers=headers))
+        entry, _ = run(cache.fetch(create_request(), produce))
+        assert entry is None
+        run(cache.fetch(create_request(), produce))
+        assert produce.calls == 2
+    assert len(cache) == 0
+
+def test_ttl():
+    cache = aioweb.cache.ResponseCache(default_ttl=5)
+    produce = Producer(aioweb.response.Response(b"x", headers={"Cache-Control": "max-age=60"}))
+    with unittest.mock.patch("time.monotonic", return_value=1000):
+        run(cache.fetch(create_request(b"/long"), produce))
+        run(cache.fetch(create_request(b"/short"), Producer()))
+    with unittest.mock.patch("time.monotonic", return_value=1010):
+        entry, _ = run(cache.fetch(create_request(b"/long"), produce))
+        assert entry is not None
+        assert produce.calls == 1
+        produce = Producer()
+        run(cache.fetch(create_request(b"/short"), produce))
+        assert produce.calls == 1
+
+def test_lru_eviction():
+    body = b"x" * 1000
+    entry_size = aioweb.cache.CachedResponse(200, aioweb.response.CONTENT_TYPE_TEXT,
+                                             body, 0).size
+    cache = aioweb.cache.ResponseCache(max_bytes=3 * entry_size, max_entry_bytes=entry_size)
+    produce = Producer(body)
+    for url in [b"/1", b"/2", b"/3"]:
+        run(cache.fetch(create_request(url), produce))
+    assert cache.size == 3 * entry_size
+    #
+    # Use /1 so that /2 is the least recently used entry
+    #
+    run(cache.fetch(create_request(b"/1"), produce))
+    run(cache.fetch(create_request(b"/4"), produce))
+    assert len(cache) == 3
+    calls = produce.calls
+    run(cache.fetch(create_request(b"/1"), produce))
+    assert produce.calls == calls
+    run(cache.fetch(create_request(b"/2"), produce))
+    assert produce.calls == calls + 1
+    #
+    # Entries which are too large are not cached
+    #
+    entry, _ = run(cache.fetch(create_request(b"/large"), Producer(body + b"x")))
+    assert entry is None
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.size == 0
+
+def test_single_flight():
+    cache = aioweb.cache.ResponseCache()
+    produce = Producer(delay=0.01)
+
+    async def fetch_all():
+        return await asyncio.gather(*[cache.fetch(create_request(), produce) for _ in range(5)])
+
+    results = run(fetch_all())
+    assert produce.calls == 1
+    assert all(entry is results[0][0] for entry, _ in results)
+
+def test_single_flight_not_cacheable():
+    cache = aioweb.cache.ResponseCache()
+    produce = Producer(aioweb.response.Response(b"x", status_code=500), delay=0.01)
+
+    async def fetch_all():
+        return await asyncio.gather(*[cache.fetch(create_request(), produce) for _ in range(3)])
+
+    results = run(fetch_all())
+    assert produce.calls == 3
+    assert all(entry is None for entry, _ in results)
+
+def test_single_flight_cancelled():
+    cache = aioweb.cache.ResponseCache()
+    produce = Producer(delay=0.01)
+
+    async def fetch_all():
+        first = asyncio.ensure_future(cache.fetch(create_request(), produce))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.fetch(create_request(), produce))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    entry, _ = run(fetch_all())
+    assert entry is not None
+    assert produce.calls == 2
@@ -0,0 +1,137 @@
+import asyncio
+import gzip
+import unittest.mock
+import zlib
+
+import pytest
+
+import aioweb.cache
+import aioweb.compression
+import aioweb.container
+import aioweb.headers
+import aioweb.request
+import aioweb.response
+
+BODY = b'{"key": "value"}' * 200
+
+def create_request(accept_encoding=None):
+    headers = aioweb.headers.Headers()
+    if accept_encoding is not None:
+        headers.add(b"Accept-Encoding", accept_encoding.encode())
+    return aioweb.request.HTTPToolsRequest(asyncio.Future(), headers=headers)
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+@pytest.mark.parametrize("value, encoding", [
+    ("gzip", "gzip"),
+    ("deflate", "deflate"),
+    ("gzip, deflate, br", "gzip"),
+    ("deflate, gzip", "gzip"),
+    ("gzip;q=0.5, deflate", "deflate"),
+    ("gzip;q=0, deflate;q=0", None),
+    ("br", None),
+    ("*", "gzip"),
+    ("*, gzip;q=0", "deflate"),
+    ("identity", None),
+    ("", None),
+])
+def test_negotiate(value, encoding):
+    assert aioweb.compression.negotiate(value) == encoding
+
+def test_compress_gzip():
+    compression = aioweb.compression.Compression()
+    response = aioweb.response.Response(BODY, headers={"X-A": "b"},
+                                        content_type="application/json")
+    status_code, result = run(compression.compress(create_request("gzip, deflate"), 200, response))
+    assert status_code == 200
+    assert result.headers == {"X-A": "b", "Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+    assert result.content_type == "application/json"
+    assert gzip.decompress(result.body) == BODY
+    assert len(result.body) < len(BODY) // 8
+
+def test_compress_deflate():
+    compression = aioweb.compression.Compression()
+    status_code, result = run(compression.compress(create_request("deflate"), 200, BODY))
+    assert result.headers["Content-Encoding"] == "deflate"
+    assert result.content_type == "text/plain; charset=utf-8"
+    assert zlib.decompress(result.body) == BODY
+
+def test_compress_in_thread():
+    compression = aioweb.compression.Compression(thread_threshold=1024)
+    loop = asyncio.get_event_loop()
+    with unittest.mock.patch.object(loop, "run_in_executor",
+                                    wraps=loop.run_in_executor) as mock:
+        _, result = run(compression.compress(create_request("gzip"), 200, BODY))
+        assert mock.call_count == 1
+    assert gzip.decompress(result.body) == BODY
+
+def test_memoryview_size():
+    #
+    # The size of a memoryview is its number of bytes, not of its elements
+    #
+    compression = aioweb.compression.Compression(min_size=1000, thread_threshold=2000)
+    body = memoryview(BODY[:1600]).cast("I")
+    assert len(body) == 400
+    loop = asyncio.get_event_loop()
+    with unittest.mock.patch.object(loop, "run_in_executor",
+                                    wraps=loop.run_in_executor) as mock:
+        _, result = run(compression.compress(create_request("gzip"), 200, body))
+        assert mock.call_count == 0
+    assert gzip.decompress(result.body) == BODY[:1600]
+    body = memoryview(BODY[:2400]).cast("I")
+    with unittest.mock.patch.object(loop, "run_in_executor",
+                                    wraps=loop.run_in_executor) as mock:
+        _, result = run(compression.compress(create_request("gzip"), 200, body))
+        assert mock.call_count == 1
+    assert gzip.decompress(result.body) == BODY[:2400]
+
+def test_not_compressed():
+    compression = aioweb.compression.Compression(min_size=100)
+    request = create_request("gzip")
+    for status_code, result in [
+            (200, b"short"),
+            (200, aioweb.response.Response(BODY, content_type="image/png")),
+            (200, aioweb.response.Response(BODY, headers={"Content-Encoding": "br"})),
+            (200, aioweb.response.Response(BODY, status_code=206)),
+            (200, aioweb.response.Response(aioweb.response.FileBody("x", 0, 1000))),
+            (500, BODY[:50])]:
+        assert run(compression.compress(request, status_code, result))[1] is result
+    #
+    # If the client does not accept compression, we only add a Vary header
+    #
+    _, result = run(compression.compress(create_request(), 200,
+                                         aioweb.response.Response(BODY, headers={"Vary": "Cookie"})))
+    assert result.body == BODY
+    assert result.headers == {"Vary": "Cookie, Accept-Encoding"}
+
+def test_compress_stream():
+    compression = aioweb.compression.Compression()
+
+    async def generate():
+        for _ in range(10):
+            yield BODY[:100]
+
+    async def collect():
+        _, result = await compression.compress(create_request("gzip"), 200, generate())
+        assert result.headers["Content-Encoding"] == "gzip"
+        return [chunk async for chunk in result.body]
+
+    chunks = run(collect())
+    assert len(chunks) == 11
+    #
+    # Every chunk is flushed, so that it can be decompressed right away
+    #
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decompressor.decompress(chunks[0]) == BODY[:100]
+    assert gzip.decompress(b"".join(chunks)) == BODY[:100] * 10
+
+def test_container_cache_varies_on_encoding():
+    cache = aioweb.cache.ResponseCache(vary=["accept-encoding"])
+    aioweb.container.HttpToolsWebContainer("127.0.0.1", "8888", None, cache=cache,
+                                           compression=aioweb.compression.Compression())
+    assert cache._vary == ("accept-encoding",)
+    cache = aioweb.cache.ResponseCache()
+    aioweb.container.HttpToolsWebContainer("127.0.0.1", "8888", None, cache=cache,
+                                           compression=aioweb.compression.Compression())
+    assert cache._vary == ("Accept-Encoding",)
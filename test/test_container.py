@@ -2,6 +2,7 @@ import asyncio
 import aioweb.container
 import pytest
 import requests
+import socket
 import threading
 import time
 
@@ -36,6 +37,27 @@ def test_client():
     t.start()
     return simple_client
 
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    #
+    # Wait until the container accepts connections on the port
+    #
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
 def test_container_creation():
 
     async def handler(request, container):
@@ -88,4 +110,170 @@ async def test_single_request(test_client):
     #
     assert test_client._request_done 
     assert test_client._status_code == 200
-    assert test_client._text == "abcd"
\ No newline at end of file
+    assert test_client._text == "abcd"
+
+
+@pytest.mark.asyncio
+async def test_workers():
+
+    async def handler(request, container):
+        return b"abcd"
+
+    port = free_port()
+    container = aioweb.container.HttpToolsWebContainer(host="127.0.0.1", port=str(port),
+                                                       handler=handler, workers=2)
+    responses = []
+
+    def do_requests():
+        #
+        # Wait for the workers to start, then send a few requests
+        #
+        wait_for_port(port)
+        for _ in range(4):
+            response = requests.get("http://127.0.0.1:%d" % port)
+            responses.append((response.status_code, response.text))
+            response.close()
+
+    async def run_client():
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, do_requests)
+        finally:
+            container.stop()
+
+    await asyncio.gather(run_client(), container.start())
+    assert responses == [(200, "abcd")] * 4
+
+@pytest.mark.asyncio
+async def test_routing_container():
+
+    async def get_user(request, container, id):
+        return b"user %d" % id
+
+    container = aioweb.container.RoutingWebContainer(host="127.0.0.1", port="8888")
+    container.add_route("GET", "/users/{id:int}", get_user)
+
+    def create_request(method, url):
+        future = asyncio.get_running_loop().create_future()
+        return aioweb.request.HTTPToolsRequest(future, method=method, url=url)
+
+    result = await container.handle_request(create_request("GET", b"/users/17?x=1"))
+    assert result == b"user 17"
+    #
+    # Unknown paths and methods should be answered without calling a handler
+    #
+    result = await container.handle_request(create_request("GET", b"/groups"))
+    assert result.status_code == 404
+    result = await container.handle_request(create_request("DELETE", b"/users/17"))
+    assert result.status_code == 405
+    assert result.headers["Allow"] == "GET"
+
+@pytest.mark.asyncio
+async def test_static_files(tmp_path):
+
+    data = bytes(range(256)) * 1024
+    (tmp_path / "data.bin").write_bytes(data)
+    port = free_port()
+    url = "http://127.0.0.1:%d/static/" % port
+    container = aioweb.container.RoutingWebContainer(host="127.0.0.1", port=str(port))
+    container.add_static("/static", str(tmp_path))
+    responses = []
+
+    def do_requests():
+        wait_for_port(port)
+        with requests.Session() as session:
+            response = session.get(url + "data.bin")
+            responses.append((response.status_code, response.content))
+            etag = response.headers["ETag"]
+            response = session.get(url + "data.bin",
+                                   headers={"Range": "bytes=10-19"})
+            responses.append((response.status_code, response.content))
+            response = session.get(url + "data.bin",
+                                   headers={"If-None-Match": etag})
+            responses.append((response.status_code, response.content))
+            response = session.get(url + "missing")
+            responses.append((response.status_code, response.content))
+
+    async def run_client():
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, do_requests)
+        finally:
+            container.stop()
+
+    await asyncio.gather(run_client(), container.start())
+    assert responses == [(200, data), (206, data[10:20]), (304, b""), (404, b"Not Found")]
+
+@pytest.mark.asyncio
+async def test_stop_drains_connections():
+
+    started = asyncio.Event()
+
+    async def handler(request, container):
+        started.set()
+        await asyncio.sleep(0.5)
+        return b"abcd"
+
+    port = free_port()
+    container = aioweb.container.HttpToolsWebContainer(host="127.0.0.1", port=str(port),
+                                                       handler=handler, grace_seconds=2)
+    responses = []
+
+    def do_request():
+        wait_for_port(port)
+        response = requests.get("http://127.0.0.1:%d" % port)
+        responses.append((response.status_code, response.text,
+                          response.headers.get("Connection")))
+        response.close()
+
+    async def stop_container():
+        await started.wait()
+        begin = time.monotonic()
+        container.stop()
+        return begin
+
+    loop = asyncio.get_running_loop()
+    client = loop.run_in_executor(None, do_request)
+    begin, _ = await asyncio.gather(stop_container(), container.start())
+    #
+    # The request in flight completes, and the container does not wait for the grace period
+    #
+    assert time.monotonic() - begin < 1.5
+    await client
+    assert responses == [(200, "abcd", "close")]
+
+@pytest.mark.asyncio
+async def test_stop_closes_silent_connections():
+
+    async def handler(request, container):
+        return b"abcd"
+
+    port = free_port()
+    container = aioweb.container.HttpToolsWebContainer(host="127.0.0.1", port=str(port),
+                                                       handler=handler, grace_seconds=5)
+    connected = threading.Event()
+    closed = []
+
+    def open_connection():
+        #
+        # Connect without sending a request and wait until the server closes the connection
+        #
+        wait_for_port(port)
+        with socket.create_connection(("127.0.0.1", port), timeout=10) as sock:
+            connected.set()
+            closed.append(sock.recv(1) == b"")
+
+    async def stop_container():
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, connected.wait)
+        await asyncio.sleep(0.1)
+        begin = time.monotonic()
+        container.stop()
+        return begin
+
+    loop = asyncio.get_running_loop()
+    client = loop.run_in_executor(None, open_connection)
+    begin, _ = await asyncio.gather(stop_container(), container.start())
+    assert time.monotonic() - begin < 1
+    await client
+    assert closed == [True]
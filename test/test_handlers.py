@@ -0,0 +1,199 @@
+import asyncio
+import functools
+import os
+import pickle
+import threading
+import unittest.mock
+
+import pytest
+
+import aioweb.container
+import aioweb.handlers
+import aioweb.request
+import aioweb.static
+
+
+async def async_handler(request, container):
+    return b"async"
+
+def sync_handler(request, container):
+    return b"sync"
+
+class AsyncCallable:
+    async def __call__(self, request, container):
+        return b"async"
+
+class SyncCallable:
+    def __call__(self, request, container):
+        return b"sync"
+
+    async def async_method(self, request, container):
+        return b"async"
+
+    def sync_method(self, request, container):
+        return b"sync"
+
+def test_runs_in_thread():
+    instance = SyncCallable()
+    assert not aioweb.handlers.runs_in_thread(async_handler)
+    assert not aioweb.handlers.runs_in_thread(AsyncCallable())
+    assert not aioweb.handlers.runs_in_thread(instance.async_method)
+    assert not aioweb.handlers.runs_in_thread(functools.partial(async_handler))
+    assert not aioweb.handlers.runs_in_thread(aioweb.static.StaticFiles("."))
+    assert aioweb.handlers.runs_in_thread(sync_handler)
+    assert aioweb.handlers.runs_in_thread(lambda request, container: b"")
+    assert aioweb.handlers.runs_in_thread(instance)
+    assert aioweb.handlers.runs_in_thread(instance.sync_method)
+    assert aioweb.handlers.runs_in_thread(functools.partial(sync_handler))
+
+    @aioweb.handlers.run_in_thread
+    async def marked(request, container):
+        return b""
+    assert aioweb.handlers.runs_in_thread(marked)
+
+@pytest.mark.asyncio
+async def test_thread_pool_run():
+    pool = aioweb.handlers.ThreadPool(max_workers=2)
+    result = await pool.run(lambda x, y=0: (threading.get_ident(), x + y), 1, y=2)
+    assert result[0] != threading.get_ident()
+    assert result[1] == 3
+    await asyncio.sleep(0)
+    assert pool.in_flight == 0
+    pool.shutdown()
+
+@pytest.mark.asyncio
+async def test_thread_pool_saturated():
+    pool = aioweb.handlers.ThreadPool(max_workers=1, max_queue=1)
+    event = threading.Event()
+    try:
+        first = asyncio.ensure_future(pool.run(event.wait))
+        second = asyncio.ensure_future(pool.run(event.wait))
+        await asyncio.sleep(0)
+        assert pool.in_flight == 2
+        #
+        # One invocation is running and one is queued, so we should reject the next
+        #
+        assert await pool.run(event.wait) is aioweb.handlers.SERVICE_UNAVAILABLE
+        #
+        # Cancelling the queued invocation frees its slot, while cancelling
+        # the running one does not, as it still occupies the thread
+        #
+        second.cancel()
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert pool.in_flight == 1
+    finally:
+        event.set()
+    await asyncio.sleep(0.01)
+    assert pool.in_flight == 0
+    pool.shutdown()
+
+def create_request(method="POST", url=b"/", body=b"xyz"):
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(body)
+    return aioweb.request.HTTPToolsRequest(future, method=method, url=url)
+
+@pytest.mark.asyncio
+async def test_sync_handler_in_container():
+
+    def handler(request, container):
+        return b"%s in thread %d" % (request.body_nowait(), threading.get_ident() != main)
+
+    main = threading.get_ident()
+    container = aioweb.container.HttpToolsWebContainer("127.0.0.1", "8888", handler)
+    assert await container.handle_request(create_request()) == b"xyz in thread 1"
+
+@pytest.mark.asyncio
+async def test_sync_handler_returns_coroutine():
+
+    async def handler(request, container):
+        return b"%s on loop %d" % (await request.body(), threading.get_ident() == main)
+
+    def plain(request, container):
+        return handler(request, container)
+
+    main = threading.get_ident()
+    for wrapper in [lambda request, container: handler(request, container), plain]:
+        container = aioweb.container.HttpToolsWebContainer("127.0.0.1", "8888", wrapper)
+        assert await container.handle_request(create_request()) == b"xyz on loop 1"
+
+@pytest.mark.asyncio
+async def test_sync_route():
+
+    def get_user(request, container, id):
+        return b"user %d" % id
+
+    container = aioweb.container.RoutingWebContainer(host="127.0.0.1", port="8888")
+    container.add_route("GET", "/users/{id:int}", get_user)
+    assert await container.handle_request(create_request("GET", b"/users/3")) == b"user 3"
+
+@aioweb.handlers.cpu_bound
+def process_handler(request, container, name="body"):
+    body = request.body_nowait()
+    return b"%s %d %s %s %s %d" % (request.method().encode(), os.getpid(), request.path().encode(),
+                                   request.headers()["X-Test"], name.encode(), len(body))
+
+@pytest.mark.asyncio
+async def test_snapshot():
+    request = create_request(url=b"/path?a=1")
+    request.headers().add(b"X-Test", b"value")
+    snapshot = pickle.loads(pickle.dumps(request.snapshot()))
+    assert snapshot.method() == "POST"
+    assert snapshot.path() == "/path"
+    assert snapshot.query() == {"a": ["1"]}
+    assert snapshot.headers()["x-test"] == b"value"
+    assert snapshot.body_nowait() == b"xyz"
+
+@pytest.mark.asyncio
+async def test_snapshot_shared_memory():
+    body = bytes(range(256)) * 64
+    request = create_request(body=body)
+    snapshot = request.snapshot(shared_memory_threshold=1024)
+    data = pickle.dumps(snapshot)
+    assert len(data) < len(body)
+    try:
+        assert pickle.loads(data).body_nowait() == body
+    finally:
+        snapshot.release()
+
+@pytest.mark.asyncio
+async def test_process_pool():
+    pool = aioweb.handlers.ProcessPool(max_workers=1, shm_threshold=1024)
+    try:
+        await pool.start()
+        for body in (b"xyz", b"x" * 4096):
+            request = create_request(url=b"/test", body=body)
+            request.headers().add(b"X-Test", b"value")
+            result = await pool.run(process_handler, request, name="param")
+            method, pid, path, header, name, length = result.split()
+            assert int(pid) != os.getpid()
+            assert (method, path, header, name) == (b"POST", b"/test", b"value", b"param")
+            assert int(length) == len(body)
+    finally:
+        pool.shutdown()
+
+@pytest.mark.asyncio
+async def test_cpu_bound_route():
+    container = aioweb.container.RoutingWebContainer(host="127.0.0.1", port="8888",
+                                                     process_pool_size=1)
+    container.add_route("POST", "/upload/{name}", process_handler)
+    request = create_request(url=b"/upload/file")
+    request.headers().add(b"X-Test", b"value")
+    try:
+        result = await container.handle_request(request)
+        assert result.endswith(b"/upload/file value file 3")
+    finally:
+        container._process_pool.shutdown()
+
+def test_process_pool_size_per_worker():
+    #
+    # By default, the CPUs are divided among the worker processes
+    #
+    with unittest.mock.patch("os.cpu_count", return_value=32):
+        for workers, size in ((1, 32), (4, 8), (32, 1), (64, 1)):
+            container = aioweb.container.HttpToolsWebContainer("127.0.0.1", "8888", process_handler,
+                                                               workers=workers)
+            assert container._process_pool._max_workers == size
+        container = aioweb.container.HttpToolsWebContainer("127.0.0.1", "8888", process_handler,
+                                                           workers=4, process_pool_size=2)
+        assert container._process_pool._max_workers == 2
@@ -0,0 +1,37 @@
+import aioweb.headers
+
+
+def test_lookup_is_case_insensitive():
+    headers = aioweb.headers.Headers()
+    headers.add(b"Content-Type", b"text/plain")
+    headers.add(b"X-CUSTOM", b"a")
+    assert headers["content-type"] == b"text/plain"
+    assert headers["CONTENT-TYPE"] == b"text/plain"
+    assert headers[b"content-type"] == b"text/plain"
+    assert headers["x-custom"] == b"a"
+    assert "X-Custom" in headers
+    assert "Missing" not in headers
+    assert headers.get("missing") is None
+
+
+def test_repeated_headers():
+    headers = aioweb.headers.Headers()
+    headers.add(b"Via", b"1.1 a")
+    headers.add(b"Host", b"example.com")
+    headers.add(b"via", b"1.1 b")
+    assert headers["Via"] == b"1.1 a"
+    assert headers.getall("VIA") == [b"1.1 a", b"1.1 b"]
+    assert headers.getall("Missing") is None
+    assert headers.getall("Missing", []) == []
+    assert len(headers) == 2
+    assert sorted(headers) == ["host", "via"]
+    assert headers.raw_items() == [(b"Via", b"1.1 a"), (b"Host", b"example.com"),
+                                   (b"via", b"1.1 b")]
+
+
+def test_add_after_lookup():
+    headers = aioweb.headers.Headers()
+    headers.add(b"A", b"1")
+    assert headers["a"] == b"1"
+    headers.add(b"B", b"2")
+    assert headers["b"] == b"2"
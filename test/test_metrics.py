@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import aioweb.cache
+import aioweb.container
+import aioweb.metrics
+import aioweb.request
+import aioweb.response
+
+
+def test_histogram_buckets():
+    histogram = aioweb.metrics.Histogram(first=1.0, buckets=4)
+    assert histogram.bounds() == [1.0, 2.0, 4.0, 8.0]
+    for value in (0.5, 1.0, 1.5, 2.0, 2.1, 8.0, 100.0):
+        histogram.observe(value)
+    assert histogram.cumulative() == [2, 4, 5, 6, 7]
+    assert histogram.count == 7
+    assert histogram.sum == pytest.approx(115.1)
+
+def test_render():
+    metrics = aioweb.metrics.Metrics()
+    metrics.requests = 3
+    metrics.latency.observe(0.00015)
+    text = metrics.render().decode()
+    assert "# TYPE aioweb_requests_total counter\naioweb_requests_total 3\n" in text
+    assert 'aioweb_connections{state="pending"} 0\n' in text
+    assert 'aioweb_request_duration_seconds_bucket{le="0.0001"} 0\n' in text
+    assert 'aioweb_request_duration_seconds_bucket{le="0.0002"} 1\n' in text
+    assert 'aioweb_request_duration_seconds_bucket{le="+Inf"} 1\n' in text
+    assert "aioweb_request_duration_seconds_count 1\n" in text
+
+@pytest.mark.asyncio
+async def test_handler():
+    response = await aioweb.metrics.Metrics()(None, None)
+    assert response.content_type == aioweb.metrics.CONTENT_TYPE
+    assert b"aioweb_max_queue_depth 0" in response.body
+
+@pytest.mark.asyncio
+async def test_container_endpoint():
+
+    async def handler(request, container):
+        return b"handler"
+
+    container = aioweb.container.HttpToolsWebContainer("127.0.0.1", "8888", handler,
+                                                       metrics=aioweb.metrics.Metrics(),
+                                                       metrics_path="/metrics")
+    for url, expected in ((b"/metrics", True), (b"/other", False)):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(b"")
+        request = aioweb.request.HTTPToolsRequest(future, method="GET", url=url)
+        result = await container.handle_request(request)
+        assert isinstance(result, aioweb.response.Response) == expected
+
+@pytest.mark.asyncio
+async def test_not_cached():
+    metrics = aioweb.metrics.Metrics()
+    cache = aioweb.cache.ResponseCache()
+
+    async def produce(request):
+        return 200, await metrics(request, None)
+
+    for count in (1, 2):
+        metrics.requests = count
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(b"")
+        request = aioweb.request.HTTPToolsRequest(future, method="GET", url=b"/metrics")
+        entry, (_, response) = await cache.fetch(request, produce)
+        assert entry is None
+        assert b"aioweb_requests_total %d\n" % count in response.body
+    assert len(cache) == 0
@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 import aioweb.protocol
 import unittest.mock
@@ -149,3 +150,118 @@ Content-Length: 3
     assert parser.get_status_code() == 200
     assert bytes(parser_helper._body) == b"123"
 
+
+
+class SlowFirstContainer:
+
+    def __init__(self):
+        self._started = []
+        self._finished = []
+
+    async def handle_request(self, request):
+        name = request.headers()['Host']
+        self._started.append(name)
+        if name == b"slow.com":
+            await asyncio.sleep(0.05)
+        self._finished.append(name)
+        return name
+
+
+def test_pipelining_concurrent(transport):
+
+    container = SlowFirstContainer()
+
+    async def run():
+        protocol = aioweb.protocol.HttpProtocol(container=container, loop=asyncio.get_running_loop(),
+                                                pipeline_concurrency=4)
+        protocol.connection_made(transport)
+        data = b''
+        for host in (b"slow.com", b"fast1.com", b"fast2.com"):
+            data += b'GET / HTTP/1.1\r\nHost: ' + host + b'\r\n\r\n'
+        protocol.data_received(data)
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+            if len(transport._messages) == 3:
+                break
+        protocol.connection_lost(None)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(run())
+    loop.close()
+    #
+    # The fast requests have been handled while the slow one was still running,
+    # but the responses have been written in the order of the requests
+    #
+    assert container._started == [b"slow.com", b"fast1.com", b"fast2.com"]
+    assert container._finished == [b"fast1.com", b"fast2.com", b"slow.com"]
+    assert len(transport._messages) == 3
+    for message, host in zip(transport._messages, (b"slow.com", b"fast1.com", b"fast2.com")):
+        assert message.endswith(b"\r\n\r\n" + host)
+
+
+def test_pipelining_concurrency_limit(transport):
+
+    container = SlowFirstContainer()
+
+    async def run():
+        protocol = aioweb.protocol.HttpProtocol(container=container, loop=asyncio.get_running_loop(),
+                                                pipeline_concurrency=2)
+        protocol.connection_made(transport)
+        data = b''
+        for host in (b"slow.com", b"fast1.com", b"fast2.com"):
+            data += b'GET / HTTP/1.1\r\nHost: ' + host + b'\r\n\r\n'
+        protocol.data_received(data)
+        await asyncio.sleep(0.02)
+        #
+        # Only two handlers may run at the same time, so the third request
+        # waits until the slow response has been written
+        #
+        assert container._started == [b"slow.com", b"fast1.com"]
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+            if len(transport._messages) == 3:
+                break
+        protocol.connection_lost(None)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(run())
+    loop.close()
+    assert container._started == [b"slow.com", b"fast1.com", b"fast2.com"]
+    assert len(transport._messages) == 3
+
+
+def test_pipelining_concurrency_echo_stream(transport):
+
+    class EchoContainer:
+
+        async def handle_request(self, request):
+            async def echo():
+                async for chunk in request.stream():
+                    yield chunk
+            return echo()
+
+    async def run():
+        protocol = aioweb.protocol.HttpProtocol(container=EchoContainer(),
+                                                loop=asyncio.get_running_loop(),
+                                                pipeline_concurrency=2)
+        protocol.connection_made(transport)
+        protocol.data_received(b"POST / HTTP/1.1\r\nHost: example.com\r\n"
+                               b"Content-Length: 12\r\n\r\naaaa")
+        for chunk in (b"bbbb", b"cccc"):
+            await asyncio.sleep(0.01)
+            protocol.data_received(chunk)
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+            if len(transport._messages) == 5:
+                break
+        protocol.connection_lost(None)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(run())
+    loop.close()
+    #
+    # The body is streamed back completely, although the handler
+    # has returned before all of it has been received
+    #
+    assert transport._messages[1:] == [b"4\r\naaaa\r\n", b"4\r\nbbbb\r\n",
+                                       b"4\r\ncccc\r\n", b"0\r\n\r\n"]
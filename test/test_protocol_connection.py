@@ -267,3 +267,66 @@ def test_timeout_fired(transport):
     # and that the transport has been closed
     #
     assert transport._is_closing
+
+#
+# Test that we apply the write buffer limits to the transport
+#
+def test_write_buffer_limits(transport):
+    transport.set_write_buffer_limits = unittest.mock.Mock()
+    protocol = aioweb.protocol.HttpProtocol(container=None, loop=unittest.mock.Mock(),
+                                            write_buffer_high=1024, write_buffer_low=256)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+        coro.close()
+    transport.set_write_buffer_limits.assert_called_with(high=1024, low=256)
+
+#
+# Test pause_writing and resume_writing. If writing is paused, draining
+# should block until writing is resumed
+#
+def test_pause_resume_writing(transport):
+    loop = asyncio.new_event_loop()
+    protocol = aioweb.protocol.HttpProtocol(container=None, loop=loop)
+    #
+    # If we are not paused, draining should complete immediately
+    #
+    with pytest.raises(StopIteration):
+        protocol._drain().send(None)
+    protocol.pause_writing()
+    drain = protocol._drain()
+    waiter = drain.send(None)
+    assert not waiter.done()
+    protocol.resume_writing()
+    assert waiter.done()
+    with pytest.raises(StopIteration):
+        drain.send(None)
+    loop.close()
+
+#
+# If the container provides a timer wheel, we should register with the
+# wheel instead of scheduling our own timer, and data_received should only
+# record the activity
+#
+def test_timer_wheel(transport):
+    loop = unittest.mock.Mock()
+    wheel = unittest.mock.Mock()
+    wheel.now = 17
+    protocol = aioweb.protocol.HttpProtocol(container=None, loop=loop, timer_wheel=wheel)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+        coro.close()
+    wheel.add.assert_called_with(protocol)
+    loop.call_later.assert_not_called()
+    with unittest.mock.patch("aioweb.protocol.httptools.HttpRequestParser") as mock:
+        protocol.data_received(b'GET / HTTP/1.1')
+    assert protocol.last_activity == 17
+    loop.call_later.assert_not_called()
+    #
+    # When the wheel expires the connection, the transport should be closed
+    #
+    protocol.idle_timeout()
+    assert transport._is_closing
+    protocol.connection_lost(exc=None)
+    wheel.remove.assert_called_with(protocol)
@@ -1,3 +1,7 @@
+import gzip
+import io
+import mmap
+import socket
 import warnings
 import asyncio
 
@@ -6,7 +10,15 @@ import unittest.mock
 
 import httptools
 
+import aioweb.accesslog
+import aioweb.admission
+import aioweb.cache
+import aioweb.compression
+import aioweb.headers
+import aioweb.metrics
 import aioweb.protocol
+import aioweb.response
+import aioweb.websocket
 
 
 ###############################################
@@ -30,12 +42,25 @@ class DummyTransport:
         self._data = b""
         self._is_closing = False
         self._fail_next = False
+        self._reading = True
+        self._messages = []
+        self._socket = None
+
+    def get_extra_info(self, name):
+        return self._socket if name == "socket" else None
+
+    def pause_reading(self):
+        self._reading = False
+
+    def resume_reading(self):
+        self._reading = True
 
     def write(self, data):
         if self._fail_next:
             self._fail_next = False
             raise BaseException()
         self._data = data
+        self._messages.append(data)
 
     def is_closing(self):
         return self._is_closing
@@ -92,9 +117,18 @@ def test_on_header():
     assert headers["A"] == b"B"
     assert protocol.get_state() == aioweb.protocol.ConnectionState.HEADER
 
+def test_on_header_repeated():
+    protocol = aioweb.protocol.HttpProtocol(container=None, loop=unittest.mock.Mock())
+    protocol.on_header(b"Set-Cookie", b"a=1")
+    protocol.on_header(b"set-cookie", b"b=2")
+    headers = protocol.get_headers()
+    assert headers["SET-COOKIE"] == b"a=1"
+    assert headers.getall("Set-Cookie") == [b"a=1", b"b=2"]
+
 def test_on_headers_complete():
     with unittest.mock.patch("aioweb.protocol.httptools.HttpRequestParser") as mock:
         with unittest.mock.patch("aioweb.protocol.asyncio.Queue") as Queue:
+            Queue.return_value.qsize.return_value = 0
             protocol = aioweb.protocol.HttpProtocol(container=None, loop=unittest.mock.Mock())
             #
             # Simulate data to make sure that the protocol creates a parser
@@ -318,10 +352,12 @@ X'''
     assert isinstance(request, aioweb.request.Request)
     headers = request.headers()
     assert headers is not None
-    assert isinstance(headers, dict)
+    assert isinstance(headers, aioweb.headers.Headers)
     assert "Host" in headers
     assert headers["Host"] == b"example.com"
     assert request.http_version() == "1.1"
+    assert request.method() == "GET"
+    assert request.url() == "/"
     #
     # Get the future to wait for completion of the body
     #
@@ -357,6 +393,11 @@ X'''
     assert parser.get_status_code() == 200
     assert parser_helper._body == b"abc"
     #
+    # The response should contain a Date and a Server header
+    #
+    assert b"\r\nDate: " in transport._data
+    assert b"\r\nServer: aioweb\r\n" in transport._data
+    #
     # Finally check that the transport is not closed
     #
     assert not transport._is_closing
@@ -398,7 +439,7 @@ Content-Length: 3
     assert isinstance(request, aioweb.request.Request)
     headers = request.headers()
     assert headers is not None
-    assert isinstance(headers, dict)
+    assert isinstance(headers, aioweb.headers.Headers)
     assert "Host" in headers
     assert headers["Host"] == b"example.com"
     assert request.http_version() == "1.0"
@@ -418,6 +459,7 @@ Content-Length: 3
     #
     assert parser.get_status_code() == 200
     assert parser_helper._body == b"abc"
+    assert b"\r\nConnection: close\r\n" in transport._data
     #
     # Finally check that the transport is closed
     #
@@ -464,7 +506,7 @@ XYZ'''
     assert isinstance(request, aioweb.request.Request)
     headers = request.headers()
     assert headers is not None
-    assert isinstance(headers, dict)
+    assert isinstance(headers, aioweb.headers.Headers)
     assert "Host" in headers
     assert headers["Host"] == b"example.com"
     assert request.http_version() == "1.1"
@@ -482,6 +524,7 @@ XYZ'''
     # If we get to this point, this is a valid HTTP response
     #
     assert parser.get_status_code() == 500
+    assert transport._data.startswith(b"HTTP/1.1 500 Internal Server Error\r\n")
     #
     # Finally check that the transport is not closed
     #
@@ -528,7 +571,7 @@ XYZ'''
     assert isinstance(request, aioweb.request.Request)
     headers = request.headers()
     assert headers is not None
-    assert isinstance(headers, dict)
+    assert isinstance(headers, aioweb.headers.Headers)
     assert "Host" in headers
     assert headers["Host"] == b"example.com"
     assert request.http_version() == "1.1"
@@ -550,3 +593,629 @@ XYZ'''
     # Finally check that the transport is not closed
     #
     assert not transport._is_closing
+
+#
+# Stream a request body which is larger than the body window and verify
+# that we pause reading until the handler consumes the data
+#
+def test_full_request_lifecycle_stream(transport):
+
+    class StreamingContainer:
+
+        def __init__(self):
+            self._chunks = []
+
+        async def handle_request(self, request):
+            async for chunk in request.stream():
+                self._chunks.append(chunk)
+            return b"".join(self._chunks)
+
+    container = StreamingContainer()
+    protocol = aioweb.protocol.HttpProtocol(container=container, body_window=4)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    request = b'''POST / HTTP/1.1
+Host: example.com
+Content-Length: 8
+
+ABCDE'''
+    protocol.data_received(request.replace(b'\n', b'\r\n'))
+    #
+    # The body part exceeds the window, so we should have stopped reading
+    #
+    assert not transport._reading
+    #
+    # Let the handler consume the first chunk, this should resume reading
+    #
+    coro.send(None)
+    assert transport._reading
+    assert container._chunks == [b"ABCDE"]
+    protocol.data_received(b"FGH")
+    coro.send(None)
+    assert container._chunks == [b"ABCDE", b"FGH"]
+    parser_helper = ParserHelper()
+    parser = httptools.HttpResponseParser(parser_helper)
+    parser.feed_data(transport._data)
+    assert parser.get_status_code() == 200
+    assert parser_helper._body == b"ABCDEFGH"
+
+#
+# A container whose handler returns an asynchronous generator
+#
+class StreamingResponseContainer:
+
+    def __init__(self, chunks, exc=None):
+        self._chunks = chunks
+        self._exc = exc
+
+    async def handle_request(self, request):
+        async def generate():
+            for chunk in self._chunks:
+                yield chunk
+            if self._exc is not None:
+                raise self._exc
+        return generate()
+
+def test_full_request_lifecycle_chunked(transport):
+
+    container = StreamingResponseContainer([b"abc", b"", b"defg"])
+    protocol = aioweb.protocol.HttpProtocol(container=container)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    request = b'''GET / HTTP/1.1
+Host: example.com
+
+'''
+    protocol.data_received(request.replace(b'\n', b'\r\n'))
+    coro.send(None)
+    #
+    # We should have written the header, two chunks and the terminating chunk
+    #
+    assert len(transport._messages) == 4
+    assert transport._messages[1] == b"3\r\nabc\r\n"
+    assert transport._messages[3] == b"0\r\n\r\n"
+    parser_helper = ParserHelper()
+    parser = httptools.HttpResponseParser(parser_helper)
+    parser.feed_data(b"".join(transport._messages))
+    assert parser.get_status_code() == 200
+    assert parser_helper._body == b"abcdefg"
+    assert not transport._is_closing
+
+def test_full_request_lifecycle_echo_stream(transport):
+    #
+    # A handler which streams the body of the request back. The request must
+    # not be released before the response has been written, and reading stays
+    # paused while the handler has not consumed the data
+    #
+    class EchoContainer:
+
+        async def handle_request(self, request):
+            async def echo():
+                async for chunk in request.stream():
+                    yield chunk
+            return echo()
+
+    protocol = aioweb.protocol.HttpProtocol(container=EchoContainer(), body_window=4)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    protocol.data_received(b"POST / HTTP/1.1\r\nHost: example.com\r\n"
+                           b"Content-Length: 12\r\n\r\naaaa")
+    coro.send(None)
+    assert transport._reading
+    protocol.data_received(b"bbbb")
+    assert not transport._reading
+    coro.send(None)
+    assert transport._reading
+    protocol.data_received(b"cccc")
+    coro.send(None)
+    assert transport._messages[1:] == [b"4\r\naaaa\r\n", b"4\r\nbbbb\r\n",
+                                       b"4\r\ncccc\r\n", b"0\r\n\r\n"]
+    assert not transport._is_closing
+
+def test_full_request_lifecycle_stream_http10(transport):
+
+    container = StreamingResponseContainer([b"abc", b"defg"])
+    protocol = aioweb.protocol.HttpProtocol(container=container)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    request = b'''GET / HTTP/1.0
+Host: example.com
+Connection: keep-alive
+
+'''
+    protocol.data_received(request.replace(b'\n', b'\r\n'))
+    coro.send(None)
+    #
+    # HTTP 1.0 does not know chunked encoding, so we need to close the
+    # connection to mark the end of the body
+    #
+    assert b"chunked" not in transport._messages[0]
+    assert transport._messages[1:] == [b"abc", b"defg"]
+    assert transport._is_closing
+
+def test_full_request_lifecycle_stream_error(transport):
+
+    container = StreamingResponseContainer([b"abc"], exc=BaseException())
+    protocol = aioweb.protocol.HttpProtocol(container=container)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    request = b'''GET / HTTP/1.1
+Host: example.com
+
+'''
+    protocol.data_received(request.replace(b'\n', b'\r\n'))
+    with pytest.raises(StopIteration):
+        coro.send(None)
+    #
+    # The body should not be terminated, and the connection should be closed
+    #
+    assert transport._messages[-1] == b"3\r\nabc\r\n"
+    assert transport._is_closing
+
+#
+# A streaming handler should be suspended while the transport
+# has paused writing
+#
+def test_full_request_lifecycle_chunked_drain(transport):
+
+    container = StreamingResponseContainer([b"abc", b"defg"])
+    protocol = aioweb.protocol.HttpProtocol(container=container)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    request = b'''GET / HTTP/1.1
+Host: example.com
+
+'''
+    protocol.data_received(request.replace(b'\n', b'\r\n'))
+    #
+    # Simulate a full write buffer
+    #
+    protocol.pause_writing()
+    coro.send(None)
+    #
+    # We should have written the header and the first chunk and then
+    # wait until writing is resumed
+    #
+    assert len(transport._messages) == 2
+    protocol.resume_writing()
+    coro.send(None)
+    assert len(transport._messages) == 4
+    assert transport._messages[3] == b"0\r\n\r\n"
+
+#
+# Check that we collect the URL if it is split across several packets
+#
+def test_url_fragmented(transport, container):
+
+    protocol = aioweb.protocol.HttpProtocol(container=container)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    protocol.data_received(b"POST /users/1")
+    protocol.data_received(b"7?q=a HTTP/1.1\r\nContent-Length: 0\r\n\r\n")
+    coro.send(None)
+    request = container._request
+    assert request.method() == "POST"
+    assert request.url() == "/users/17?q=a"
+
+class BufferContainer:
+
+    def __init__(self, body):
+        self._body = body
+
+    async def handle_request(self, request):
+        return self._body
+
+def run_buffer_request(transport, body):
+    container = BufferContainer(body)
+    protocol = aioweb.protocol.HttpProtocol(container=container)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    request = b'''GET / HTTP/1.1
+Host: example.com
+
+'''
+    protocol.data_received(request.replace(b'\n', b'\r\n'))
+    coro.send(None)
+    parser_helper = ParserHelper()
+    parser = httptools.HttpResponseParser(parser_helper)
+    parser.feed_data(b"".join(transport._messages))
+    assert parser.get_status_code() == 200
+    return parser_helper._body
+
+#
+# Small bodies of any buffer type are written together with the header
+#
+@pytest.mark.parametrize("body", [bytearray(b"abc"), memoryview(b"abc"),
+                                  memoryview(bytearray(b"xxabcxx"))[2:5]])
+def test_small_buffer_body(transport, body):
+    assert run_buffer_request(transport, body) == b"abc"
+    assert len(transport._messages) == 1
+
+#
+# Large bodies are written separately and not copied
+#
+def test_large_buffer_body(transport):
+    body = bytearray(b"x" * (aioweb.protocol._COPY_THRESHOLD + 1))
+    assert run_buffer_request(transport, body) == body
+    assert len(transport._messages) == 2
+    assert transport._messages[1] is body
+
+def test_mmap_body(transport, tmp_path):
+    path = tmp_path / "body"
+    data = b"0123456789" * 4096
+    path.write_bytes(data)
+    with open(path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    assert run_buffer_request(transport, mapped) == data
+    assert isinstance(transport._messages[1], memoryview)
+
+#
+# If the transport does not support sendfile, files are sent from a
+# memory mapping
+#
+def test_send_file_fallback(transport, tmp_path):
+    path = tmp_path / "body"
+    data = bytes(range(256)) * 2048
+    path.write_bytes(data)
+    loop = asyncio.new_event_loop()
+    protocol = aioweb.protocol.HttpProtocol(container=None, loop=loop)
+    protocol._transport = transport
+    body = aioweb.response.FileBody(str(path), 1000, len(data) - 2000)
+    assert loop.run_until_complete(protocol._send_file(body))
+    assert len(transport._messages) > 1
+    assert b"".join(transport._messages) == data[1000:-1000]
+    assert not transport._is_closing
+    #
+    # If the file is shorter than expected, we need to close the connection
+    #
+    transport._messages.clear()
+    body = aioweb.response.FileBody(str(path), len(data) - 10, 20)
+    assert not loop.run_until_complete(protocol._send_file(body))
+    assert b"".join(transport._messages) == data[-10:]
+    assert transport._is_closing
+    #
+    # The same applies if the file does not exist
+    #
+    body = aioweb.response.FileBody(str(tmp_path / "missing"), 0, 20)
+    assert not loop.run_until_complete(protocol._send_file(body))
+    loop.close()
+
+def test_not_modified_has_no_body(transport):
+    response = aioweb.response.Response(status_code=304, headers={"ETag": '"x"'})
+    container = BufferContainer(response)
+    protocol = aioweb.protocol.HttpProtocol(container=container)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    protocol.data_received(b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    coro.send(None)
+    assert len(transport._messages) == 1
+    assert transport._messages[0].startswith(b"HTTP/1.1 304 Not Modified\r\n")
+    assert b"Content-Length" not in transport._messages[0]
+    assert transport._messages[0].endswith(b'ETag: "x"\r\n\r\n')
+
+#
+# With a cache, a repeated request is answered without invoking the handler
+#
+def test_response_cache(transport, container):
+    cache = aioweb.cache.ResponseCache()
+    protocol = aioweb.protocol.HttpProtocol(container=container, cache=cache)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    protocol.data_received(b"GET /x HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    coro.send(None)
+    assert container._handle_request_called
+    container._handle_request_called = False
+    protocol.data_received(b"GET /x HTTP/1.0\r\nHost: example.com\r\n\r\n")
+    coro.send(None)
+    assert not container._handle_request_called
+    assert len(transport._messages) == 2
+    assert transport._messages[1].startswith(b"HTTP/1.0 200 OK\r\nDate: ")
+    assert transport._messages[1].endswith(b"Connection: close\r\nContent-Length: 3\r\n\r\nabc")
+    assert cache.hits == 1
+
+def test_response_compression(transport):
+    container = BufferContainer(b"abc" * 1000)
+    protocol = aioweb.protocol.HttpProtocol(container=container,
+                                            compression=aioweb.compression.Compression())
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    protocol.data_received(b"GET / HTTP/1.1\r\nHost: example.com\r\nAccept-Encoding: gzip\r\n\r\n")
+    coro.send(None)
+    assert b"Content-Encoding: gzip\r\n" in transport._messages[0]
+    parser_helper = ParserHelper()
+    parser = httptools.HttpResponseParser(parser_helper)
+    parser.feed_data(b"".join(transport._messages))
+    assert gzip.decompress(parser_helper._body) == b"abc" * 1000
+
+def test_metrics(transport, container):
+    metrics = aioweb.metrics.Metrics()
+    protocol = aioweb.protocol.HttpProtocol(container=container, metrics=metrics)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    assert metrics.connection_states()["PENDING"] == 1
+    request = b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n"
+    protocol.data_received(request)
+    assert metrics.queue_depths() == [1]
+    coro.send(None)
+    assert metrics.requests == 1
+    assert metrics.latency.count == 1
+    assert metrics.bytes_received == len(request)
+    assert metrics.bytes_sent == len(transport._messages[0])
+    container.set_exception(BaseException())
+    protocol.data_received(request)
+    coro.send(None)
+    assert metrics.handler_exceptions == 1
+    protocol.connection_lost(None)
+    assert metrics.connection_states()["PENDING"] == 0
+
+def test_access_log(transport, container):
+    output = io.StringIO()
+    access_log = aioweb.accesslog.AccessLog(output=output)
+    transport.get_extra_info = lambda name: ("10.0.0.1", 1234)
+    protocol, coro = start_protocol(transport, container, access_log=access_log)
+    protocol.data_received(b"GET /path?a=b HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    coro.send(None)
+    access_log.flush()
+    fields = output.getvalue().split()
+    assert fields[1:6] == ["10.0.0.1:1234", "GET", "/path?a=b", "200",
+                           str(len(transport._messages[0]))]
+
+#
+# Requests exceeding the limit of concurrent handlers are rejected without
+# invoking the handler, and parked connections are not read from
+#
+def test_admission_control(transport, container):
+    admission = aioweb.admission.AdmissionControl(max_connections=1, max_in_flight=1)
+    protocol = aioweb.protocol.HttpProtocol(container=container, admission=admission)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    assert admission.acquire()
+    protocol.data_received(b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    coro.send(None)
+    assert not container._handle_request_called
+    assert transport._messages[0].startswith(b"HTTP/1.1 503 Service Unavailable\r\n")
+    assert b"Retry-After: 1\r\n" in transport._messages[0]
+    admission.release()
+    protocol.data_received(b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    coro.send(None)
+    assert container._handle_request_called
+    assert admission.in_flight == 0
+    parked_transport = DummyTransport()
+    parked = aioweb.protocol.HttpProtocol(container=container, admission=admission)
+    with unittest.mock.patch("asyncio.create_task"):
+        parked.connection_made(parked_transport)
+    assert not parked_transport._reading
+    protocol.connection_lost(None)
+    assert parked_transport._reading
+
+def start_protocol(transport, container, **kwargs):
+    protocol = aioweb.protocol.HttpProtocol(container=container, **kwargs)
+    with unittest.mock.patch("asyncio.create_task") as mock:
+        protocol.connection_made(transport)
+        coro = mock.call_args.args[0]
+    coro.send(None)
+    return protocol, coro
+
+def test_max_pipeline_depth(transport, container):
+    protocol, coro = start_protocol(transport, container, max_pipeline_depth=2)
+    protocol.data_received(b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    assert transport._reading
+    protocol.data_received(b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    assert not transport._reading
+    coro.send(None)
+    assert transport._reading
+    assert len(transport._messages) == 2
+
+def test_max_pipeline_depth_single_read(transport, container):
+    #
+    # The limit is approximate, all requests contained in one
+    # read are queued before reading is paused
+    #
+    protocol, coro = start_protocol(transport, container, max_pipeline_depth=2)
+    protocol.data_received(b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n" * 5)
+    assert not transport._reading
+    assert protocol.get_queue_depth() == 5
+    coro.send(None)
+    assert transport._reading
+    assert len(transport._messages) == 5
+
+def test_max_header_bytes(transport, container):
+    protocol, coro = start_protocol(transport, container, max_header_bytes=64)
+    protocol.data_received(b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    protocol.data_received(b"GET / HTTP/1.1\r\nHost: example.com\r\nX-Long: " + b"x" * 64
+                           + b"\r\nAccept: */*\r\n")
+    assert not transport._reading
+    coro.send(None)
+    assert len(transport._messages) == 2
+    assert transport._messages[0].startswith(b"HTTP/1.1 200 OK\r\n")
+    assert transport._messages[1].startswith(b"HTTP/1.1 431 Request Header Fields Too Large\r\n")
+    assert transport._is_closing
+
+def test_max_body_bytes_announced(transport, container):
+    protocol, coro = start_protocol(transport, container, max_body_bytes=10)
+    protocol.data_received(b"POST / HTTP/1.1\r\nHost: example.com\r\nContent-Length: 11\r\n\r\n")
+    coro.send(None)
+    assert not container._handle_request_called
+    assert transport._messages[0].startswith(b"HTTP/1.1 413 Request Entity Too Large\r\n")
+    assert transport._is_closing
+    #
+    # Whatever the client sends afterwards is ignored
+    #
+    protocol.data_received(b"x" * 11)
+
+class BodyContainer:
+
+    async def handle_request(self, request):
+        return await request.body()
+
+def test_max_body_bytes_chunked(transport):
+    protocol, coro = start_protocol(transport, BodyContainer(), max_body_bytes=10)
+    protocol.data_received(b"POST / HTTP/1.1\r\nHost: example.com\r\n"
+                           b"Transfer-Encoding: chunked\r\n\r\n")
+    coro.send(None)
+    protocol.data_received(b"8\r\n01234567\r\n")
+    assert transport._reading
+    protocol.data_received(b"8\r\n01234567\r\n")
+    assert not transport._reading
+    coro.send(None)
+    assert transport._messages[0].startswith(b"HTTP/1.1 413 Request Entity Too Large\r\n")
+    assert transport._is_closing
+
+def test_invalid_request(transport, container):
+    protocol, coro = start_protocol(transport, container)
+    protocol.data_received(b"GET / HTTP/1.1\r\nHost example.com\r\n\r\n")
+    coro.send(None)
+    assert not container._handle_request_called
+    assert transport._messages[0].startswith(b"HTTP/1.1 400 Bad Request\r\n")
+    assert transport._is_closing
+
+def test_shutdown_idle(transport, container):
+    registry = aioweb.protocol.ConnectionRegistry()
+    protocol, coro = start_protocol(transport, container, registry=registry)
+    assert list(registry) == [protocol]
+    protocol.data_received(b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    coro.send(None)
+    assert not transport._is_closing
+    protocol.shutdown()
+    assert transport._is_closing
+    protocol.connection_lost(None)
+    assert len(registry) == 0
+
+def test_shutdown_busy(transport, container):
+    protocol, coro = start_protocol(transport, container)
+    protocol.data_received(b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n"
+                           b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    protocol.shutdown()
+    assert not transport._is_closing
+    coro.send(None)
+    assert len(transport._messages) == 2
+    assert b"Connection: close" not in transport._messages[0]
+    assert b"Connection: close" in transport._messages[1]
+    assert transport._is_closing
+
+def test_shutdown_silent(transport, container):
+    #
+    # A connection on which nothing has arrived yet is closed right away
+    #
+    server, client = socket.socketpair()
+    with server, client:
+        transport._socket = server
+        protocol, _ = start_protocol(transport, container)
+        protocol.shutdown()
+        assert transport._is_closing
+
+def test_shutdown_unread_data(transport, container):
+    #
+    # Data which the client has sent, but which we have not read yet,
+    # is treated like a part of a header which has already arrived
+    #
+    server, client = socket.socketpair()
+    with server, client:
+        transport._socket = server
+        protocol, coro = start_protocol(transport, container)
+        client.sendall(b"GET / HTTP/1.1\r\n")
+        protocol.shutdown()
+        assert not transport._is_closing
+        protocol.data_received(server.recv(1024))
+    protocol.data_received(b"Host: example.com\r\n\r\n")
+    coro.send(None)
+    assert b"Connection: close" in transport._messages[0]
+    assert transport._is_closing
+
+def test_shutdown_partial_header(transport, container):
+    protocol, coro = start_protocol(transport, container)
+    protocol.data_received(b"GET / HTTP/1.1\r\n")
+    protocol.shutdown()
+    assert not transport._is_closing
+    protocol.data_received(b"Host: example.com\r\n\r\n")
+    coro.send(None)
+    assert b"Connection: close" in transport._messages[0]
+    assert transport._is_closing
+
+@pytest.mark.asyncio
+async def test_registry_wait_empty(transport, container):
+    registry = aioweb.protocol.ConnectionRegistry()
+    assert await registry.wait_empty(0.1)
+    protocol = aioweb.protocol.HttpProtocol(container=container, registry=registry)
+    protocol.connection_made(transport)
+    assert not await registry.wait_empty(0.01)
+    asyncio.get_running_loop().call_later(0.01, protocol.connection_lost, None)
+    assert await registry.wait_empty(1)
+
+class WebSocketContainer:
+
+    def __init__(self):
+        self._messages = []
+
+    async def handle_request(self, request):
+        async def session(websocket):
+            async for message in websocket:
+                self._messages.append(message)
+        return aioweb.websocket.Upgrade(session)
+
+_WEBSOCKET_HANDSHAKE = (b"GET /chat HTTP/1.1\r\nHost: example.com\r\nUpgrade: websocket\r\n"
+                        b"Connection: Upgrade\r\nSec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+                        b"Sec-WebSocket-Version: 13\r\n\r\n")
+
+def test_websocket_keepalive(transport):
+    container = WebSocketContainer()
+    protocol, coro = start_protocol(transport, container)
+    #
+    # A frame arriving together with the handshake is held back until
+    # the upgrade has been accepted
+    #
+    protocol.data_received(_WEBSOCKET_HANDSHAKE + b"\x81\x82\x00\x00\x00\x00hi")
+    assert not transport._reading
+    coro.send(None)
+    assert transport._messages[0].startswith(b"HTTP/1.1 101 Switching Protocols\r\n")
+    assert transport._reading
+    assert container._messages == ["hi"]
+    #
+    # An idle WebSocket receives a ping, and is closed if the
+    # client remains silent until the next timeout
+    #
+    protocol._do_timeout()
+    assert transport._messages[-1] == b"\x89\x00"
+    assert not transport._is_closing
+    protocol.data_received(b"\x8a\x80\x00\x00\x00\x00")
+    protocol._do_timeout()
+    assert not transport._is_closing
+    protocol._do_timeout()
+    assert transport._is_closing
+    protocol.connection_lost(None)
+    with pytest.raises(StopIteration):
+        coro.send(None)
+
+def test_websocket_shutdown(transport):
+    protocol, coro = start_protocol(transport, WebSocketContainer())
+    protocol.data_received(_WEBSOCKET_HANDSHAKE)
+    coro.send(None)
+    protocol.shutdown()
+    assert transport._messages[-1] == b"\x88\x02\x03\xe9"
+    assert transport._is_closing
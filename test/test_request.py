@@ -27,3 +27,139 @@ def test_get_http_version(future):
     request = aioweb.request.HTTPToolsRequest(future, http_version="1.0")
     version = request.http_version()
     assert version == "1.0"
+
+class FlowControl:
+
+    def __init__(self):
+        self._paused = False
+        self._pause_count = 0
+
+    def pause_reading(self):
+        self._paused = True
+        self._pause_count += 1
+
+    def resume_reading(self):
+        self._paused = False
+
+@pytest.fixture
+def flow_control():
+    return FlowControl()
+
+def test_body_complete(future):
+
+    request = aioweb.request.HTTPToolsRequest(future)
+    request.feed_data(b"ab")
+    request.feed_data(b"c")
+    request.feed_eof()
+    assert future.result() == b"abc"
+
+def test_stream_chunks(future):
+
+    request = aioweb.request.HTTPToolsRequest(future)
+    stream = request.stream()
+    request.feed_data(b"ab")
+    request.feed_data(b"c")
+    #
+    # The iterator should return the chunks in the order in which they were fed
+    #
+    with pytest.raises(StopIteration) as exc:
+        stream.__anext__().send(None)
+    assert exc.value.value == b"ab"
+    with pytest.raises(StopIteration) as exc:
+        stream.__anext__().send(None)
+    assert exc.value.value == b"c"
+    #
+    # Now there is no data, so the iterator should wait
+    #
+    waiter = stream.__anext__()
+    waiter.send(None)
+    request.feed_eof()
+    with pytest.raises(StopAsyncIteration):
+        waiter.send(None)
+
+def test_stream_backpressure(future, flow_control):
+
+    request = aioweb.request.HTTPToolsRequest(future, body_window=4,
+                                              pause_reading=flow_control.pause_reading,
+                                              resume_reading=flow_control.resume_reading)
+    stream = request.stream()
+    request.feed_data(b"ab")
+    assert not flow_control._paused
+    request.feed_data(b"cd")
+    #
+    # We have now reached the window and should have paused reading
+    #
+    assert flow_control._paused
+    request.feed_data(b"ef")
+    assert flow_control._pause_count == 1
+    #
+    # Consume the first chunk, after which we are still at the window
+    #
+    with pytest.raises(StopIteration):
+        stream.__anext__().send(None)
+    assert flow_control._paused
+    #
+    # Consume the second chunk, after which we are below the window again
+    #
+    with pytest.raises(StopIteration):
+        stream.__anext__().send(None)
+    assert not flow_control._paused
+
+def test_body_resumes_reading(future, flow_control):
+
+    request = aioweb.request.HTTPToolsRequest(future, body_window=2,
+                                              pause_reading=flow_control.pause_reading,
+                                              resume_reading=flow_control.resume_reading)
+    request.feed_data(b"abc")
+    assert flow_control._paused
+    #
+    # If the handler asks for the full body, we need to read everything
+    #
+    request.body().send(None)
+    assert not flow_control._paused
+    request.feed_data(b"def")
+    assert not flow_control._paused
+    request.feed_eof()
+    assert future.result() == b"abcdef"
+
+def test_release_resumes_reading(future, flow_control):
+
+    request = aioweb.request.HTTPToolsRequest(future, body_window=2,
+                                              pause_reading=flow_control.pause_reading,
+                                              resume_reading=flow_control.resume_reading)
+    request.feed_data(b"abc")
+    assert flow_control._paused
+    request.release()
+    assert not flow_control._paused
+
+def test_path_and_query(future):
+
+    request = aioweb.request.HTTPToolsRequest(future, url=b"/a/b%20c?x=1&y=2&x=3&z=")
+    assert request.url() == "/a/b%20c?x=1&y=2&x=3&z="
+    assert request.path() == "/a/b%20c"
+    assert request.query() == {"x": ["1", "3"], "y": ["2"], "z": [""]}
+    #
+    # Results are cached
+    #
+    assert request.query() is request.query()
+
+def test_path_without_query(future):
+
+    request = aioweb.request.HTTPToolsRequest(future, url=b"/index.html")
+    assert request.path() == "/index.html"
+    assert request.query() == {}
+
+def test_path_absolute_and_invalid_url(future):
+
+    request = aioweb.request.HTTPToolsRequest(future, url=b"http://example.com/x?a=b")
+    assert request.path() == "/x"
+    assert request.query() == {"a": ["b"]}
+    request = aioweb.request.HTTPToolsRequest(future, url=b"*")
+    assert request.path() == "*"
+    assert request.query() == {}
+
+def test_request_has_slots(future):
+
+    request = aioweb.request.HTTPToolsRequest(future)
+    with pytest.raises(AttributeError):
+        request.foo = 1
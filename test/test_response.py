@@ -0,0 +1,41 @@
+import email.utils
+import unittest.mock
+
+import aioweb.response
+
+def test_status_line():
+    line = aioweb.response.status_line("1.1", 200)
+    assert line == b"HTTP/1.1 200 OK\r\n"
+    line = aioweb.response.status_line("1.0", 500)
+    assert line == b"HTTP/1.0 500 Internal Server Error\r\n"
+    #
+    # Status lines should be cached
+    #
+    assert aioweb.response.status_line("1.1", 404) is aioweb.response.status_line("1.1", 404)
+
+def test_status_line_unknown():
+    line = aioweb.response.status_line("1.1", 599)
+    assert line == b"HTTP/1.1 599 Unknown\r\n"
+
+def test_header_cache_prelude():
+    cache = aioweb.response.HeaderCache()
+    prelude = cache.prelude
+    assert prelude.startswith(b"Date: ")
+    assert prelude.endswith(b"\r\nServer: aioweb\r\n")
+    date = prelude.split(b"\r\n")[0][6:].decode("ascii")
+    assert email.utils.parsedate_to_datetime(date) is not None
+
+def test_header_cache_timer():
+    loop = unittest.mock.Mock()
+    cache = aioweb.response.HeaderCache()
+    cache.start(loop)
+    loop.call_later.assert_called_once()
+    assert loop.call_later.call_args.args[0] <= 1
+    #
+    # When the timer fires, it should schedule itself again
+    #
+    on_timer = loop.call_later.call_args.args[1]
+    on_timer()
+    assert loop.call_later.call_count == 2
+    cache.stop()
+    loop.call_later.return_value.cancel.assert_called()
@@ -0,0 +1,137 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+#
+# A server which answers every request with its process id
+#
+SERVER = """
+import asyncio
+import os
+import signal
+import sys
+
+import aioweb.container
+
+async def handler(request, container):
+    return str(os.getpid()).encode()
+
+async def main():
+    container = aioweb.container.HttpToolsWebContainer(host="127.0.0.1", port=sys.argv[1],
+                                                       handler=handler, hot_restart=True,
+                                                       grace_seconds=5)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, container.stop)
+    await container.start()
+
+asyncio.run(main())
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_pid(port):
+    response = requests.get("http://127.0.0.1:%d" % port, timeout=5)
+    assert response.status_code == 200
+    return int(response.text)
+
+
+def wait_for_pid(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return get_pid(port)
+        except requests.ConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def read_response(sock):
+    #
+    # Read from a socket until the server closes the connection
+    #
+    data = b""
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            return data
+        data += chunk
+
+
+def read_keep_alive_response(sock):
+    #
+    # Read a response without waiting for the connection to be closed
+    #
+    data = b""
+    while b"\r\n\r\n" not in data:
+        data += sock.recv(4096)
+    header, _, body = data.partition(b"\r\n\r\n")
+    length = int(header.lower().split(b"content-length: ")[1].split(b"\r\n")[0])
+    while len(body) < length:
+        body += sock.recv(4096)
+    return body
+
+
+def test_hot_restart(tmp_path):
+    script = tmp_path / "server.py"
+    script.write_text(SERVER)
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    server = subprocess.Popen([sys.executable, str(script), str(port)], env=env)
+    successor = None
+    try:
+        first = wait_for_pid(port)
+        assert first == server.pid
+        #
+        # Open a connection on which the client does not send anything and a
+        # connection on which it starts to send a request. As connections are
+        # accepted in the order in which they have been made, answering a
+        # request on the second one shows that the server has accepted both
+        #
+        silent = socket.create_connection(("127.0.0.1", port), timeout=10)
+        busy = socket.create_connection(("127.0.0.1", port), timeout=10)
+        with busy, silent:
+            busy.sendall(b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n")
+            assert read_keep_alive_response(busy) == str(first).encode()
+            busy.sendall(b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n")
+            #
+            # Once the successor serves requests, the server stops accepting
+            # connections and closes the silent connection right away
+            #
+            server.send_signal(signal.SIGHUP)
+            assert read_response(silent) == b""
+            assert server.poll() is None
+            #
+            # While the server drains its connections, the successor
+            # accepts new ones on the same socket
+            #
+            successor = get_pid(port)
+            assert successor != first
+            #
+            # The request which has already been started is answered with
+            # Connection: close, after which the server exits
+            #
+            busy.sendall(b"\r\n")
+            response = read_response(busy)
+            assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+            assert b"Connection: close\r\n" in response
+            assert response.endswith(str(first).encode())
+        server.wait(15)
+        assert server.returncode == 0
+        assert get_pid(port) == successor
+    finally:
+        if server.poll() is None:
+            server.kill()
+        if successor is not None:
+            os.kill(successor, signal.SIGTERM)
@@ -0,0 +1,82 @@
+import pytest
+
+import aioweb.router
+
+def handler():
+    pass
+
+def other_handler():
+    pass
+
+@pytest.fixture
+def router():
+    router = aioweb.router.Router()
+    router.add_route("GET", "/", handler)
+    router.add_route("GET", "/users", handler)
+    router.add_route("POST", "/users", other_handler)
+    router.add_route("GET", "/users/{id:int}", handler)
+    router.add_route("GET", "/users/me", other_handler)
+    router.add_route("GET", "/users/{name}/posts/{post:int}", handler)
+    router.add_route("GET", "/prices/{price:float}", handler)
+    router.add_route("GET", "/static/{path:path}", handler)
+    return router
+
+def test_static_match(router):
+    route, params = router.match("/users")
+    assert route.pattern == "/users"
+    assert route.handlers["GET"] is handler
+    assert route.handlers["POST"] is other_handler
+    assert params == {}
+    route, params = router.match("/")
+    assert route.pattern == "/"
+
+def test_no_match(router):
+    assert router.match("/unknown") is None
+    assert router.match("/users/17/posts") is None
+    assert router.match("/users/17/17") is None
+
+def test_typed_params(router):
+    route, params = router.match("/users/17")
+    assert route.pattern == "/users/{id:int}"
+    assert params == {"id": 17}
+    route, params = router.match("/prices/1.5")
+    assert params == {"price": 1.5}
+    assert router.match("/prices/abc") is None
+
+def test_static_before_param(router):
+    route, params = router.match("/users/me")
+    assert route.pattern == "/users/me"
+    assert params == {}
+
+def test_backtracking(router):
+    #
+    # 17 can be an int, but only the str parameter leads to a match
+    #
+    route, params = router.match("/users/17/posts/3")
+    assert route.pattern == "/users/{name}/posts/{post:int}"
+    assert params == {"name": "17", "post": 3}
+
+def test_unquote(router):
+    route, params = router.match("/users/j%20doe/posts/1")
+    assert params == {"name": "j doe", "post": 1}
+
+def test_catch_all(router):
+    route, params = router.match("/static/css/main.css")
+    assert route.pattern == "/static/{path:path}"
+    assert params == {"path": "css/main.css"}
+
+def test_method_not_allowed(router):
+    route, _ = router.match("/users")
+    response = route.method_not_allowed
+    assert response.status_code == 405
+    assert response.headers["Allow"] == "GET, POST"
+
+def test_invalid_patterns(router):
+    with pytest.raises(ValueError):
+        router.add_route("GET", "users", handler)
+    with pytest.raises(ValueError):
+        router.add_route("GET", "/files/{path:path}/x", handler)
+    with pytest.raises(ValueError):
+        router.add_route("GET", "/files/{id:uuid}", handler)
+    with pytest.raises(ValueError):
+        router.add_route("GET", "/users/{other:int}", handler)
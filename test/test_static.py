@@ -0,0 +1,126 @@
+import asyncio
+import os
+import unittest.mock
+
+import pytest
+
+import aioweb.headers
+import aioweb.request
+import aioweb.response
+import aioweb.static
+
+
+@pytest.fixture
+def directory(tmp_path):
+    (tmp_path / "index.html").write_bytes(b"<html>0123456789</html>")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "data.bin").write_bytes(b"x" * 100)
+    return tmp_path
+
+def create_request(url=b"/", **headers):
+    items = aioweb.headers.Headers()
+    for name, value in headers.items():
+        items.add(name.replace("_", "-").encode(), value.encode())
+    return aioweb.request.HTTPToolsRequest(asyncio.Future(), headers=items, url=url)
+
+def call(handler, request, path=None):
+    return asyncio.get_event_loop().run_until_complete(handler(request, None, path=path))
+
+def test_full_file(directory):
+    handler = aioweb.static.StaticFiles(str(directory))
+    response = call(handler, create_request(b"/index.html"))
+    assert response.status_code == 200
+    assert response.content_type == "text/html"
+    assert isinstance(response.body, aioweb.response.FileBody)
+    assert response.body.path == str(directory / "index.html")
+    assert response.body.offset == 0
+    assert response.body.count == 23
+    assert response.headers["Accept-Ranges"] == "bytes"
+    #
+    # A path parameter takes precedence over the path of the request
+    #
+    response = call(handler, create_request(b"/static/x"), path="sub/data.bin")
+    assert response.status_code == 200
+    assert response.content_type == "application/octet-stream"
+    assert response.body.count == 100
+
+def test_not_found(directory):
+    handler = aioweb.static.StaticFiles(str(directory / "sub"))
+    for path in ["missing", "", "/", "../index.html", "sub/../../index.html", "a\0b"]:
+        response = call(handler, create_request(), path=path)
+        assert response.status_code == 404
+    #
+    # Directories are not served either
+    #
+    handler = aioweb.static.StaticFiles(str(directory))
+    assert call(handler, create_request(b"/sub")).status_code == 404
+
+@pytest.mark.parametrize("value, offset, count", [
+    ("bytes=0-9", 0, 10),
+    ("bytes=10-", 10, 90),
+    ("bytes=-5", 95, 5),
+    ("bytes=90-200", 90, 10),
+])
+def test_range(directory, value, offset, count):
+    handler = aioweb.static.StaticFiles(str(directory))
+    response = call(handler, create_request(b"/sub/data.bin", Range=value))
+    assert response.status_code == 206
+    assert response.body.offset == offset
+    assert response.body.count == count
+    assert response.headers["Content-Range"] == "bytes %d-%d/100" % (offset, offset + count - 1)
+
+def test_range_not_satisfiable(directory):
+    handler = aioweb.static.StaticFiles(str(directory))
+    response = call(handler, create_request(b"/sub/data.bin", Range="bytes=100-"))
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == "bytes */100"
+
+@pytest.mark.parametrize("value", ["bytes=0-1,5-6", "lines=1-2", "bytes=5-1", "bytes=a-b"])
+def test_range_ignored(directory, value):
+    handler = aioweb.static.StaticFiles(str(directory))
+    response = call(handler, create_request(b"/sub/data.bin", Range=value))
+    assert response.status_code == 200
+    assert response.body.count == 100
+
+def test_if_range(directory):
+    handler = aioweb.static.StaticFiles(str(directory))
+    etag = call(handler, create_request(b"/sub/data.bin")).headers["ETag"]
+    response = call(handler, create_request(b"/sub/data.bin", Range="bytes=0-9", If_Range=etag))
+    assert response.status_code == 206
+    response = call(handler, create_request(b"/sub/data.bin", Range="bytes=0-9",
+                                            If_Range='"other"'))
+    assert response.status_code == 200
+
+def test_conditional(directory):
+    handler = aioweb.static.StaticFiles(str(directory))
+    response = call(handler, create_request(b"/index.html"))
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+    response = call(handler, create_request(b"/index.html", If_None_Match=etag))
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    response = call(handler, create_request(b"/index.html", If_None_Match='"a", ' + etag))
+    assert response.status_code == 304
+    response = call(handler, create_request(b"/index.html", If_None_Match='"other"'))
+    assert response.status_code == 200
+    response = call(handler, create_request(b"/index.html", If_Modified_Since=last_modified))
+    assert response.status_code == 304
+    response = call(handler, create_request(b"/index.html",
+                                            If_Modified_Since="Mon, 01 Jan 1990 00:00:00 GMT"))
+    assert response.status_code == 200
+    response = call(handler, create_request(b"/index.html", If_Modified_Since="garbage"))
+    assert response.status_code == 200
+
+def test_stat_cache(directory):
+    handler = aioweb.static.StaticFiles(str(directory), cache_seconds=60, max_entries=1)
+    with unittest.mock.patch("os.stat", wraps=os.stat) as mock:
+        call(handler, create_request(b"/index.html"))
+        call(handler, create_request(b"/index.html"))
+        assert mock.call_count == 1
+        #
+        # As the cache only holds one entry, requesting a different
+        # file evicts the first one
+        #
+        call(handler, create_request(b"/sub/data.bin"))
+        call(handler, create_request(b"/index.html"))
+        assert mock.call_count == 3
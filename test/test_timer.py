@@ -0,0 +1,76 @@
+import unittest.mock
+
+import pytest
+
+import aioweb.timer
+
+class Entry:
+
+    def __init__(self):
+        self.last_activity = None
+        self._expired = False
+
+    def idle_timeout(self):
+        self._expired = True
+
+@pytest.fixture
+def loop():
+    return unittest.mock.Mock()
+
+def test_start_stop(loop):
+    wheel = aioweb.timer.TimerWheel(timeout_seconds=3, loop=loop)
+    wheel.start()
+    loop.call_later.assert_called_once()
+    assert loop.call_later.call_args.args[0] == 1.0
+    handle = loop.call_later.return_value
+    wheel.stop()
+    handle.cancel.assert_called()
+
+def test_add_remove(loop):
+    wheel = aioweb.timer.TimerWheel(timeout_seconds=3, loop=loop)
+    entry = Entry()
+    wheel.add(entry)
+    assert entry.last_activity == wheel.now
+    assert len(wheel) == 1
+    wheel.remove(entry)
+    assert len(wheel) == 0
+    #
+    # Removing an entry twice should not do any harm
+    #
+    wheel.remove(entry)
+
+#
+# An idle entry should expire once the timeout has passed, but not before
+#
+def test_expire_idle(loop):
+    wheel = aioweb.timer.TimerWheel(timeout_seconds=3, loop=loop)
+    wheel.start()
+    entry = Entry()
+    wheel.add(entry)
+    _tick = loop.call_later.call_args.args[1]
+    for _ in range(3):
+        _tick()
+        assert not entry._expired
+    _tick()
+    assert entry._expired
+    assert len(wheel) == 0
+
+#
+# An entry which records activity should only expire after it has been
+# idle for the timeout
+#
+def test_activity_defers_expiry(loop):
+    wheel = aioweb.timer.TimerWheel(timeout_seconds=3, loop=loop)
+    wheel.start()
+    entry = Entry()
+    wheel.add(entry)
+    _tick = loop.call_later.call_args.args[1]
+    for _ in range(10):
+        _tick()
+        entry.last_activity = wheel.now
+        assert not entry._expired
+    for _ in range(3):
+        _tick()
+        assert not entry._expired
+    _tick()
+    assert entry._expired
@@ -0,0 +1,208 @@
+import asyncio
+import os
+import socket
+import struct
+
+import pytest
+
+import aioweb.container
+import aioweb.websocket
+
+
+def client_frame(opcode, payload, fin=True, mask=b"\x01\x02\x03\x04"):
+    first = (0x80 if fin else 0) | opcode
+    if len(payload) < 126:
+        header = bytes((first, 0x80 | len(payload)))
+    elif len(payload) < 65536:
+        header = struct.pack("!BBH", first, 0x80 | 126, len(payload))
+    else:
+        header = struct.pack("!BBQ", first, 0x80 | 127, len(payload))
+    return header + mask + aioweb.websocket.apply_mask(mask, payload)
+
+
+def read_frame(sock):
+    def read(count):
+        data = b""
+        while len(data) < count:
+            chunk = sock.recv(count - len(data))
+            assert chunk
+            data += chunk
+        return data
+    first, second = read(2)
+    assert not second & 0x80
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", read(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", read(8))[0]
+    return first & 0x0F, read(length)
+
+
+def test_accept_key():
+    #
+    # The example given in RFC 6455
+    #
+    assert (aioweb.websocket.accept_key(b"dGhlIHNhbXBsZSBub25jZQ==")
+            == b"s3pPLMBiTxaQ9kYGzzhZRbK+xOo=")
+
+
+@pytest.mark.parametrize("length", [0, 1, 3, 4, 5, 1000])
+def test_apply_mask(length):
+    mask = b"\x12\x34\x56\x78"
+    data = os.urandom(length)
+    masked = aioweb.websocket.apply_mask(mask, data)
+    assert masked == bytes(byte ^ mask[index % 4] for index, byte in enumerate(data))
+    assert aioweb.websocket.apply_mask(mask, masked) == data
+
+
+@pytest.mark.parametrize("length, header_length", [(5, 2), (125, 2), (126, 4), (70000, 10)])
+def test_encode_frame(length, header_length):
+    frame = aioweb.websocket.encode_frame(aioweb.websocket.BINARY, b"x" * length)
+    assert frame[0] == 0x82
+    assert len(frame) == header_length + length
+
+
+class GroupTransport:
+
+    def __init__(self, buffered=0):
+        self.frames = []
+        self.buffered = buffered
+        self.aborted = False
+
+    def write(self, data):
+        self.frames.append(data)
+
+    def is_closing(self):
+        return self.aborted
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def abort(self):
+        self.aborted = True
+
+
+def test_group_broadcast():
+
+    async def drain():
+        pass
+
+    transports = [GroupTransport() for _ in range(3)] + [GroupTransport(buffered=2048)]
+    group = aioweb.websocket.Group(max_buffer=1024)
+    for transport in transports:
+        group.add(aioweb.websocket.WebSocket(transport, None, drain, None, None))
+    assert group.broadcast("hello") == 3
+    #
+    # Every member receives the same buffer, and the slow one is dropped
+    #
+    frame = transports[0].frames[0]
+    assert frame == b"\x81\x05hello"
+    assert all(transport.frames[0] is frame for transport in transports[:3])
+    assert transports[3].aborted and not transports[3].frames
+    assert len(group) == 3
+
+
+def handshake(sock, key=b"dGhlIHNhbXBsZSBub25jZQ=="):
+    sock.sendall(b"GET /chat HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\n"
+                 b"Connection: Upgrade\r\nSec-WebSocket-Key: " + key
+                 + b"\r\nSec-WebSocket-Version: 13\r\n\r\n")
+    response = b""
+    while b"\r\n\r\n" not in response:
+        chunk = sock.recv(4096)
+        assert chunk
+        response += chunk
+    return response
+
+
+async def run_with_container(handler, client):
+    container = aioweb.container.HttpToolsWebContainer(host="127.0.0.1", port="8888",
+                                                       handler=handler)
+
+    async def run_client():
+        await asyncio.sleep(0.5)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, client)
+        finally:
+            container.stop()
+
+    result, _ = await asyncio.gather(run_client(), container.start())
+    return result
+
+
+@pytest.mark.asyncio
+async def test_websocket_echo():
+
+    closed = []
+
+    @aioweb.websocket.endpoint
+    async def handler(websocket, request, container):
+        async for message in websocket:
+            await websocket.send(message)
+        closed.append(websocket.close_code)
+
+    def client():
+        with socket.create_connection(("127.0.0.1", 8888)) as sock:
+            response = handshake(sock)
+            frames = [client_frame(aioweb.websocket.TEXT, "héllo".encode("utf-8")),
+                      client_frame(aioweb.websocket.PING, b"ping"),
+                      client_frame(aioweb.websocket.BINARY, b"ab", fin=False),
+                      client_frame(aioweb.websocket.CONTINUATION, b"c" * 70000)]
+            sock.sendall(b"".join(frames))
+            received = [read_frame(sock) for _ in range(3)]
+            sock.sendall(client_frame(aioweb.websocket.CLOSE, struct.pack("!H", 1000)))
+            received.append(read_frame(sock))
+            return response, received
+
+    response, frames = await run_with_container(handler, client)
+    assert response.startswith(b"HTTP/1.1 101 Switching Protocols\r\n")
+    assert b"Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=\r\n" in response
+    #
+    # Pings are answered while parsing, before the session gets to the messages
+    #
+    assert frames == [(aioweb.websocket.PONG, b"ping"),
+                      (aioweb.websocket.TEXT, "héllo".encode("utf-8")),
+                      (aioweb.websocket.BINARY, b"ab" + b"c" * 70000),
+                      (aioweb.websocket.CLOSE, struct.pack("!H", 1000))]
+    assert closed == [1000]
+
+
+@pytest.mark.asyncio
+async def test_websocket_protocol_error():
+
+    @aioweb.websocket.endpoint
+    async def handler(websocket, request, container):
+        await websocket.receive()
+
+    def client():
+        with socket.create_connection(("127.0.0.1", 8888)) as sock:
+            handshake(sock)
+            #
+            # Frames sent by the client must be masked
+            #
+            sock.sendall(b"\x81\x02ab")
+            frame = read_frame(sock)
+            return frame, sock.recv(1)
+
+    frame, rest = await run_with_container(handler, client)
+    assert frame == (aioweb.websocket.CLOSE,
+                     struct.pack("!H", 1002) + b"Reserved bits set or frame not masked")
+    assert rest == b""
+
+
+@pytest.mark.asyncio
+async def test_websocket_invalid_handshake():
+
+    @aioweb.websocket.endpoint
+    async def handler(websocket, request, container):
+        pass
+
+    def client():
+        with socket.create_connection(("127.0.0.1", 8888)) as sock:
+            response = handshake(sock, key=b"invalid")
+            while sock.recv(4096):
+                pass
+            return response
+
+    response = await run_with_container(handler, client)
+    assert response.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+    assert b"Connection: close\r\n" in response